@@ -1,28 +1,11 @@
 # geo_bbox.py
 from __future__ import annotations
-import aiohttp
+
 from typing import Optional, Tuple
 
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+from city_bbox import RESOLVER
+
 
 async def city_bbox(city: str, country_hint: str = "Россия") -> Optional[Tuple[float,float,float,float]]:
-    params = {
-        "q": f"{city}, {country_hint}" if country_hint else city,
-        "format": "json",
-        "limit": 1,
-        "addressdetails": 0,
-        "polygon_geojson": 0,
-    }
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(NOMINATIM_URL, params=params, headers={"User-Agent":"omniboard-bot"}) as r:
-            if r.status >= 400:
-                return None
-            js = await r.json()
-    if not js:
-        return None
-    b = js[0].get("boundingbox")
-    if not b or len(b) != 4:
-        return None
-    # Nominatim: [south, north, west, east]
-    south, north, west, east = map(float, b)
-    return (west, south, east, north)
\ No newline at end of file
+    """(west, south, east, north): из сохранённых/инвентаря, Nominatim — один раз на город."""
+    return await RESOLVER.resolve(city, country_hint=country_hint)
@@ -0,0 +1,205 @@
+# adaptive_http.py
+# Массовые GET к API с адаптивной параллельностью (AIMD) и ретраями.
+#   AIMDLimiter — сколько запросов держим в полёте: +1 за «окно» здоровых ответов, ×0.5 на 429/5xx/таймаут;
+#   fetch_json  — один GET с ретраями (экспонента с джиттером, Retry-After уважаем);
+#   RunStats    — счётчики прогона для отчёта в чат/лог.
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, NamedTuple, Optional
+
+import aiohttp
+
+RETRYABLE_HTTP = {408, 425, 429, 500, 502, 503, 504}
+
+
+class AIMDLimiter:
+    """
+    Лимит одновременных запросов, который сам подстраивается под сервер.
+    Рост: +1 после limit успешных ответов с задержкой ниже latency_target_s (≈ +1 за «круг»).
+    Спад: limit × decrease на перегрузку, не чаще раза в cooldown_s — пачка ошибок от уже
+    отправленных запросов не обнуляет лимит. Retry-After ставит паузу на все новые запросы.
+    """
+
+    def __init__(
+        self,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_target_s: float = 2.0,
+        decrease: float = 0.5,
+        cooldown_s: float = 1.0,
+    ):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+        self.latency_target_s = float(latency_target_s)
+        self.decrease = float(decrease)
+        self.cooldown_s = float(cooldown_s)
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.low_limit = self.limit
+        self._healthy = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency_s: float) -> None:
+        if latency_s > self.latency_target_s:
+            self._healthy = 0
+            return
+        self._healthy += 1
+        if self._healthy >= int(self.limit) and self.limit < self.max_limit:
+            self._healthy = 0
+            self.limit += 1
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+    def on_overload(self, retry_after_s: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._healthy = 0
+        if retry_after_s:
+            self._paused_until = max(self._paused_until, now + retry_after_s)
+        if now - self._last_decrease >= self.cooldown_s:
+            self._last_decrease = now
+            self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            self.low_limit = min(self.low_limit, self.limit)
+
+
+class RunStats:
+    """Счётчики одного прогона массовых запросов."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0     # все попытки, включая повторы
+        self.ok = 0
+        self.not_modified = 0
+        self.retries = 0
+        self.throttled = 0    # 429/5xx/таймауты
+        self.failed = 0       # не получили данные даже после повторов
+        self.latency_sum = 0.0
+
+    def summary(self, limiter: Optional[AIMDLimiter] = None) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        done = self.ok + self.not_modified
+        avg_ms = self.latency_sum / max(1, self.requests) * 1000
+        parts = [
+            f"ok {done}, дыр {self.failed}",
+            f"запросов {self.requests} (повторов {self.retries}, перегрузок {self.throttled})",
+            f"{done / elapsed:.1f}/с за {elapsed:.1f} с, ср. {avg_ms:.0f} мс",
+        ]
+        if limiter is not None:
+            parts.append(f"параллельность {int(limiter.low_limit)}…{int(limiter.peak_limit)}, итог {int(limiter.limit)}")
+        return " | ".join(parts)
+
+
+class FetchResult(NamedTuple):
+    status: int                  # 0 — сетевая ошибка/таймаут
+    data: Any                    # JSON при 200, иначе None
+    headers: dict                # заголовки ответа, ключи в нижнем регистре (etag, last-modified…)
+    error: Optional[str]
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Retry-After: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def backoff_delay(attempt: int, base_s: float = 0.5, max_s: float = 30.0) -> float:
+    """Экспонента с «полным» джиттером: случайное в [0, min(max_s, base·2^attempt)]."""
+    return random.uniform(0, min(max_s, base_s * (2 ** attempt)))
+
+
+async def fetch_json(
+    session: aiohttp.ClientSession,
+    url: str,
+    *,
+    limiter: AIMDLimiter,
+    stats: Optional[RunStats] = None,
+    headers: Optional[dict] = None,
+    ssl: Any = None,
+    timeout_s: float = 20.0,
+    retries: int = 4,
+    max_delay_s: float = 30.0,
+) -> FetchResult:
+    """
+    GET url под limiter. 429/5xx/таймауты: лимитер сжимается, пауза = max(Retry-After, backoff), повтор.
+    200 → JSON, 304 → data=None без ошибки, прочие статусы — сразу ошибка без повторов.
+    """
+    stats = stats if stats is not None else RunStats()
+    last_err = None
+    for attempt in range(retries + 1):
+        if attempt:
+            stats.retries += 1
+        retry_after = None
+        await limiter.acquire()
+        t0 = time.monotonic()
+        try:
+            stats.requests += 1
+            async with session.get(url, headers=headers, ssl=ssl,
+                                   timeout=aiohttp.ClientTimeout(total=timeout_s)) as resp:
+                latency = time.monotonic() - t0
+                stats.latency_sum += latency
+                resp_headers = {k.lower(): v for k, v in resp.headers.items()}
+                if resp.status == 200:
+                    try:
+                        data = await resp.json(content_type=None)
+                    except ValueError as e:
+                        stats.failed += 1
+                        return FetchResult(200, None, resp_headers, f"bad JSON: {e}")
+                    limiter.on_success(latency)
+                    stats.ok += 1
+                    return FetchResult(200, data, resp_headers, None)
+                if resp.status == 304:
+                    limiter.on_success(latency)
+                    stats.not_modified += 1
+                    return FetchResult(304, None, resp_headers, None)
+                txt = (await resp.text())[:120]
+                if resp.status not in RETRYABLE_HTTP:
+                    stats.failed += 1
+                    return FetchResult(resp.status, None, resp_headers, f"HTTP {resp.status}: {txt}")
+                retry_after = retry_after_seconds(resp.headers.get("Retry-After"))
+                last_err = f"HTTP {resp.status}: {txt}"
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stats.latency_sum += time.monotonic() - t0
+            last_err = repr(e)
+            status = 0
+        finally:
+            await limiter.release()
+
+        stats.throttled += 1
+        limiter.on_overload(retry_after)
+        if attempt < retries:
+            await asyncio.sleep(max(retry_after or 0.0, backoff_delay(attempt, max_s=max_delay_s)))
+
+    stats.failed += 1
+    return FetchResult(status, None, {}, last_err)
@@ -0,0 +1,132 @@
+# attr_index.py
+# Инвертированный индекс атрибутов инвентаря: city / format / owner → отсортированные позиции строк.
+# Строится вместе с гео-сеткой для каждого снимка инвентаря (inventory_snapshot.build). Запрос сравнивает только
+# уникальные значения колонки (их десятки–сотни), а строки берёт готовыми срезами постингов;
+# несколько условий («Москва + BILLBOARD + owner=russ») — пересечение отсортированных массивов,
+# начиная с самого короткого. Нормализация та же, что у масок inventory_prep (регистр, пробелы,
+# CITY* → семейство CITY_FORMAT*, BB → BILLBOARD), так что индекс и маски дают одни и те же строки.
+# Модуль без aiogram/BOT_TOKEN, как geo_index.
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import inventory_prep
+
+# колонка → нормализация значений (как в соответствующей маске inventory_prep)
+INDEXED_COLUMNS: Dict[str, Callable[[pd.Index], np.ndarray]] = {
+    "city": inventory_prep._lower,
+    "format": inventory_prep._upper,
+    "owner": inventory_prep._lower,
+}
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class _Postings:
+    """Постинги одной колонки: позиции строк, сгруппированные по коду значения (CSR: order + bounds)."""
+
+    def __init__(self, series: pd.Series, normalize: Callable[[pd.Index], np.ndarray]):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            cats = series.cat.categories
+            codes = series.cat.codes.to_numpy()
+        else:
+            codes, cats = pd.factorize(series, sort=False)
+            cats = pd.Index(cats)
+        self.codes = np.asarray(codes)
+        self.keys = normalize(cats) if len(cats) else np.empty(0, dtype=object)
+        self.labels = np.asarray(cats, dtype=object)
+        # stable-сортировка по коду: внутри кода позиции остаются по возрастанию
+        self.order = np.argsort(self.codes, kind="stable").astype(np.int64, copy=False)
+        self.bounds = np.searchsorted(self.codes[self.order], np.arange(len(cats) + 1))
+        self.counts = np.diff(self.bounds)
+
+    def positions(self, hit: np.ndarray) -> np.ndarray:
+        """Отсортированные позиции строк, у которых значение отмечено в hit (bool на каждый код)."""
+        codes = np.flatnonzero(hit)
+        if len(codes) == 0:
+            return _EMPTY
+        if len(codes) == 1:
+            c = codes[0]
+            return self.order[self.bounds[c]:self.bounds[c + 1]]
+        total = int(self.counts[codes].sum())
+        if total * 8 < len(self.codes):
+            # мало строк — склеиваем срезы и сортируем только их
+            return np.sort(np.concatenate([self.order[self.bounds[c]:self.bounds[c + 1]] for c in codes]))
+        # много строк — один проход по кодам дешевле сортировки
+        level = np.append(np.asarray(hit, dtype=bool), False)   # код -1 (NaN) → последний элемент
+        return np.flatnonzero(level[self.codes])
+
+
+def intersect(arrays: Iterable[np.ndarray]) -> np.ndarray:
+    """Пересечение отсортированных массивов позиций: от короткого к длинному, searchsorted по длинному."""
+    arrays = sorted(arrays, key=len)
+    if not arrays:
+        return _EMPTY
+    out = arrays[0]
+    for other in arrays[1:]:
+        if len(out) == 0:
+            break
+        idx = np.searchsorted(other, out)
+        idx[idx == len(other)] = 0
+        out = out[other[idx] == out] if len(other) else _EMPTY
+    return out
+
+
+class AttrIndex:
+    """Индекс по колонкам INDEXED_COLUMNS одного df; позиции — для df.iloc / df.take."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self._cols: Dict[str, _Postings] = {}
+        for col, normalize in INDEXED_COLUMNS.items():
+            if col in df.columns and not isinstance(df[col], pd.DataFrame):
+                self._cols[col] = _Postings(df[col], normalize)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "AttrIndex":
+        return cls(df)
+
+    def freeze(self) -> "AttrIndex":
+        """Массивы постингов → read-only: positions() отдаёт их срезы наружу, запись в них испортила бы индекс."""
+        for p in self._cols.values():
+            for arr in (p.codes, p.order, p.bounds, p.counts):
+                arr.flags.writeable = False
+        return self
+
+    def has(self, column: str) -> bool:
+        return column in self._cols
+
+    def city(self, value: str) -> np.ndarray:
+        """Точное совпадение города без учёта регистра и крайних пробелов (как inventory_prep.equals_mask)."""
+        p = self._cols["city"]
+        return p.positions(p.keys == (value or "").strip().lower())
+
+    def formats(self, tokens: Iterable[str] | str) -> np.ndarray:
+        """format совпадает с любым из токенов (как inventory_prep.format_mask)."""
+        p = self._cols["format"]
+        toks = [tokens] if isinstance(tokens, str) else [t for t in tokens if t and t.strip()]
+        hit = np.zeros(len(p.keys), dtype=bool)
+        for t in toks:
+            hit |= inventory_prep.format_level_hit(p.keys, t)
+        return p.positions(hit)
+
+    def owners(self, needles: Iterable[str]) -> np.ndarray:
+        """owner содержит любую из подстрок (как inventory_prep.owner_mask)."""
+        p = self._cols["owner"]
+        needles = [n.strip().lower() for n in needles if n and n.strip()]
+        return p.positions(np.array([any(n in k for n in needles) for k in p.keys], dtype=bool))
+
+    def top(self, column: str, k: int = 5) -> List[Tuple[str, int]]:
+        """k самых частых значений колонки с числом строк (для /status)."""
+        p = self._cols.get(column)
+        if p is None or len(p.counts) == 0:
+            return []
+        best = np.argsort(-p.counts, kind="stable")[:k]
+        return [(str(p.labels[c]), int(p.counts[c])) for c in best if p.counts[c] > 0]
+
+    def distinct(self, column: str) -> int:
+        p = self._cols.get(column)
+        return int((p.counts > 0).sum()) if p is not None else 0
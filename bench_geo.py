@@ -0,0 +1,173 @@
+# bench_geo.py
+# Бенчмарк гео-движка на синтетическом инвентаре: python bench_geo.py [n_screens]
+# Сравнивает старую построчную реализацию (iterrows + скалярный haversine) с geo_index.
+import math, sys, time
+
+import numpy as np
+import pandas as pd
+
+import geo_index
+
+
+def _haversine_km(a, b):
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    h = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
+    return 2 * 6371.0088 * math.asin(math.sqrt(h))
+
+
+def legacy_find_within_radius(df, center, radius_km):
+    rows = []
+    for _, row in df.iterrows():
+        d = _haversine_km(center, (row["lat"], row["lon"]))
+        if d <= radius_km:
+            rows.append({
+                "screen_id": row.get("screen_id", ""),
+                "name": row.get("name", ""),
+                "city": row.get("city", ""),
+                "format": row.get("format", ""),
+                "owner": row.get("owner", ""),
+                "lat": row["lat"],
+                "lon": row["lon"],
+                "distance_km": round(d, 3),
+            })
+    out = pd.DataFrame(rows)
+    return out.sort_values("distance_km") if not out.empty else out
+
+
+def legacy_spread_select(df, n, *, random_start=True, seed=None):
+    import random as _random
+    if df.empty or n <= 0:
+        return df.iloc[0:0]
+    n = min(n, len(df))
+    if seed is not None:
+        _random.seed(seed)
+    coords = df[["lat", "lon"]].to_numpy()
+    if random_start:
+        start_idx = _random.randrange(len(df))
+    else:
+        lat_med = float(df["lat"].median())
+        lon_med = float(df["lon"].median())
+        start_idx = min(range(len(df)), key=lambda i: _haversine_km((lat_med, lon_med), (coords[i][0], coords[i][1])))
+    chosen = [start_idx]
+    dists = [_haversine_km((coords[start_idx][0], coords[start_idx][1]), (coords[i][0], coords[i][1])) for i in range(len(df))]
+    while len(chosen) < n:
+        maxd = max(dists)
+        candidates = [i for i, d in enumerate(dists) if d == maxd]
+        next_idx = _random.choice(candidates)
+        chosen.append(next_idx)
+        cx, cy = coords[next_idx]
+        for i in range(len(df)):
+            d = _haversine_km((cx, cy), (coords[i][0], coords[i][1]))
+            if d < dists[i]:
+                dists[i] = d
+    res = df.iloc[chosen].copy()
+    res["min_dist_to_others_km"] = 0.0
+    cc = res[["lat", "lon"]].to_numpy()
+    for i in range(len(res)):
+        mind = min(
+            _haversine_km((cc[i][0], cc[i][1]), (cc[j][0], cc[j][1]))
+            for j in range(len(res)) if j != i
+        ) if len(res) > 1 else 0.0
+        res.iat[i, res.columns.get_loc("min_dist_to_others_km")] = round(mind, 3)
+    return res
+
+
+def synthetic_screens(n: int, seed: int = 42) -> pd.DataFrame:
+    """n экранов вокруг Москвы (~±0.5°) с типичными колонками инвентаря."""
+    rng = np.random.default_rng(seed)
+    formats = np.array(["BILLBOARD", "SUPERSITE", "CITY_FORMAT", "CITY_FORMAT_RC", "MEDIAFACADE"])
+    owners = np.array(["Russ", "РИМ", "Перспектива", "Gallery"])
+    return pd.DataFrame({
+        "screen_id": [f"S{i:07d}" for i in range(n)],
+        "name": [f"screen {i}" for i in range(n)],
+        "city": "Москва",
+        "format": formats[rng.integers(0, len(formats), n)],
+        "owner": owners[rng.integers(0, len(owners), n)],
+        "lat": 55.75 + rng.uniform(-0.5, 0.5, n),
+        "lon": 37.62 + rng.uniform(-0.8, 0.8, n),
+    })
+
+
+def _timeit(fn, repeat: int = 1) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _by_distance(frame: pd.DataFrame) -> list:
+    """screen_id по (distance_km, screen_id): порядок равных расстояний у legacy не определён (нестабильный sort)."""
+    if frame.empty:
+        return []
+    return list(frame.sort_values(["distance_km", "screen_id"], kind="stable")["screen_id"])
+
+
+def bench_radius(df: pd.DataFrame, center=(55.75, 37.62), radius_km: float = 2.0):
+    new = geo_index.within_radius(df, center, radius_km)
+    t_new = _timeit(lambda: geo_index.within_radius(df, center, radius_km), repeat=5)
+    t_old = _timeit(lambda: legacy_find_within_radius(df, center, radius_km))
+    old = legacy_find_within_radius(df, center, radius_km)
+    same = _by_distance(old) == _by_distance(new)
+    print(f"find_within_radius n={len(df)}: legacy {t_old*1000:.1f} ms | numpy {t_new*1000:.2f} ms "
+          f"| x{t_old / max(t_new, 1e-9):.0f} | rows={len(new)} same={same}")
+
+
+def bench_grid_index(df: pd.DataFrame, center=(55.75, 37.62), radius_km: float = 2.0):
+    t_build = _timeit(lambda: geo_index.GridIndex.from_frame(df))
+    idx = geo_index.GridIndex.from_frame(df)
+    full = geo_index.within_radius(df, center, radius_km)
+    via_idx = geo_index.within_radius(df, center, radius_km, index=idx)
+    same = _by_distance(full) == _by_distance(via_idx)
+    t_scan = _timeit(lambda: geo_index.radius_positions(df, center, radius_km), repeat=5)
+    t_idx = _timeit(lambda: idx.query(center, radius_km), repeat=20)
+    print(f"GridIndex n={len(df)}: build {t_build*1000:.0f} ms | full scan {t_scan*1000:.2f} ms "
+          f"| index query {t_idx*1000:.3f} ms | same={same}")
+
+
+def bench_radius_join(df: pd.DataFrame, n_pois: int = 50, radius_km: float = 2.0):
+    rng = np.random.default_rng(7)
+    centers = [(55.75 + rng.uniform(-0.4, 0.4), 37.62 + rng.uniform(-0.6, 0.6)) for _ in range(n_pois)]
+    idx = geo_index.GridIndex.from_frame(df)
+
+    def per_poi():
+        frames = [geo_index.within_radius(df, c, radius_km) for c in centers]
+        return pd.concat(frames, ignore_index=True).drop_duplicates(subset=["screen_id"])
+
+    t_loop = _timeit(per_poi, repeat=3)
+    t_join = _timeit(lambda: geo_index.radius_join_frame(df, centers, radius_km, index=idx), repeat=3)
+    print(f"/near_geo {n_pois} POI x n={len(df)}: per-POI loop {t_loop*1000:.1f} ms "
+          f"| batched join {t_join*1000:.1f} ms")
+
+
+def vectorized_spread_select(df, n, *, random_start=True, seed=None):
+    """То же, что bot.spread_select (bot.py нельзя импортировать без BOT_TOKEN)."""
+    lat_r, lon_r = geo_index.coords_radians(df)
+    chosen = geo_index.farthest_point_positions(lat_r, lon_r, n, random_start=random_start, seed=seed)
+    res = df.iloc[chosen].copy()
+    res["min_dist_to_others_km"] = np.round(geo_index.min_dist_to_others_km(lat_r[chosen], lon_r[chosen]), 3)
+    return res
+
+
+def bench_spread_select(df: pd.DataFrame, n: int = 200, seed: int = 42):
+    t_new = _timeit(lambda: vectorized_spread_select(df, n, seed=seed), repeat=3)
+    new = vectorized_spread_select(df, n, seed=seed)
+    t_old = _timeit(lambda: legacy_spread_select(df, n, seed=seed))
+    old = legacy_spread_select(df, n, seed=seed)
+    same = (list(old["screen_id"]) == list(new["screen_id"])
+            and np.allclose(old["min_dist_to_others_km"], new["min_dist_to_others_km"]))
+    print(f"spread_select n={n} of {len(df)}: legacy {t_old*1000:.0f} ms | numpy {t_new*1000:.1f} ms "
+          f"| x{t_old / max(t_new, 1e-9):.0f} | same(seed={seed})={same}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    screens = synthetic_screens(n)
+    bench_radius(screens)
+    bench_radius_join(screens)
+    bench_spread_select(synthetic_screens(min(n, 20_000)))
+    bench_grid_index(synthetic_screens(max(n, 1_000_000)))
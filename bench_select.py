@@ -0,0 +1,175 @@
+# bench_select.py
+# Бенчмарк памяти команд подбора на синтетическом инвентаре: python bench_select.py [n_screens]
+# Для каждой команды — пик аллокаций (tracemalloc) и время: старый конвейер с копиями DataFrame
+# (apply_filters → df.copy(), SCREENS.copy(), _fill_min_bid, _select_with_mix, spread_select .copy())
+# против screen_query (позиции строк, одна материализация на выходе).
+import sys, time, tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import attr_index
+import geo_index
+import inventory_prep
+import screen_query
+from screen_query import ScreenQuery
+from selection import _allocate_counts, _extract_screen_ids, parse_mix
+
+
+def synthetic_inventory(n: int, seed: int = 42) -> pd.DataFrame:
+    """n экранов в трёх городах с колонками как после /sync_api (grp — строками, как приходят из API)."""
+    rng = np.random.default_rng(seed)
+    cities = np.array(["Москва", "Санкт-Петербург", "Казань"], dtype=object)
+    centers = np.array([[55.75, 37.62], [59.93, 30.33], [55.79, 49.12]])
+    ci = rng.integers(0, len(cities), n)
+    formats = np.array(["BILLBOARD", "SUPERSITE", "CITY_FORMAT", "CITY_FORMAT_RC", "MEDIA_FACADE"], dtype=object)
+    owners = np.array(["Russ Outdoor", "Gallery", "РИМ", "Перспектива"], dtype=object)
+    return pd.DataFrame({
+        "screen_id": [f"S{i:07d}" for i in range(n)],
+        "name": [f"screen {i}" for i in range(n)],
+        "city": cities[ci],
+        "format": formats[rng.integers(0, len(formats), n)],
+        "owner": owners[rng.integers(0, len(owners), n)],
+        "lat": centers[ci, 0] + rng.normal(0, 0.1, n),
+        "lon": centers[ci, 1] + rng.normal(0, 0.15, n),
+        "grp": np.array(["1,5", "2", "0.5", "3", ""], dtype=object)[rng.integers(0, 5, n)],
+        "ots": rng.random(n) * 1000,
+        "minBid": np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 300 + 50),
+    })
+
+
+# ---------- старый конвейер (с копиями), как было в bot.py/selection.py ----------
+
+def legacy_apply_filters(df, formats=(), owners=(), grp_min=None):
+    out = df.copy()
+    if formats:
+        out = out[inventory_prep.format_mask(out["format"], list(formats))]
+    if owners:
+        out = out[inventory_prep.owner_mask(out["owner"], list(owners))]
+    if grp_min is not None:
+        out = out[inventory_prep.numeric(out["grp"]).ge(grp_min).fillna(False)]
+    return out
+
+
+def legacy_spread_select(df, n, *, random_start=True, seed=None):
+    if df.empty or n <= 0:
+        return df.iloc[0:0]
+    lat_r, lon_r = geo_index.coords_radians(df)
+    chosen = geo_index.farthest_point_positions(lat_r, lon_r, n, random_start=random_start, seed=seed)
+    res = df.iloc[chosen].copy()
+    res["min_dist_to_others_km"] = np.round(geo_index.min_dist_to_others_km(lat_r[chosen], lon_r[chosen]), 3)
+    return res
+
+
+def legacy_select_with_mix(df_city, n, mix_arg, *, random_start=True, seed=None):
+    items = parse_mix(mix_arg)
+    if not items:
+        return legacy_spread_select(df_city.reset_index(drop=True), n, random_start=random_start, seed=seed)
+    mask = None
+    for tok, _ in items:
+        m = inventory_prep.format_mask(df_city["format"], tok)
+        mask = m if mask is None else (mask | m)
+    base_pool = df_city[mask]
+    pool = base_pool.copy()
+    parts, used = [], set()
+    for token, need in _allocate_counts(n, items):
+        if need <= 0 or pool.empty:
+            continue
+        subset = pool[inventory_prep.format_mask(pool["format"], token)]
+        if subset.empty:
+            continue
+        picked = legacy_spread_select(subset.reset_index(drop=True), min(need, len(subset)),
+                                      random_start=random_start, seed=seed)
+        parts.append(picked)
+        used.update(_extract_screen_ids(picked))
+        pool = pool[~pool["screen_id"].astype(str).isin(used)]
+    combined = pd.concat(parts, ignore_index=True) if parts else base_pool.iloc[0:0]
+    remain = n - len(combined)
+    if remain > 0 and not pool.empty:
+        extra = legacy_spread_select(pool.reset_index(drop=True), min(remain, len(pool)),
+                                     random_start=random_start, seed=seed)
+        combined = pd.concat([combined, extra], ignore_index=True)
+    return combined.head(n)
+
+
+def legacy_plan(df, city, n):
+    pool = df.copy()
+    pool = pool[inventory_prep.equals_mask(pool["city"], city)]
+    pool = screen_query.fill_min_bid(pool)
+    parts = [pool[inventory_prep.format_mask(pool["format"], t)] for t in ("BILLBOARD", "SUPERSITE", "CITY_FORMAT")]
+    parts.append(pool[~pool.index.isin(pd.concat(parts).index)])
+    pool = pd.concat(parts, ignore_index=True).head(max(n * 5, n))
+    return legacy_spread_select(pool.reset_index(drop=True), n, seed=1)
+
+
+# ---------- замер ----------
+
+def _timeit(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _measure(fn):
+    """(пик аллокаций, МБ; время, мс; результат). Время — отдельными прогонами: tracemalloc сильно замедляет."""
+    dt = _timeit(fn)
+    tracemalloc.start()
+    res = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, dt * 1000, res
+
+
+def bench_commands(df: pd.DataFrame):
+    inventory_prep.prepare(df)
+    attrs = attr_index.AttrIndex.from_frame(df)
+    geo = geo_index.GridIndex.from_frame(df)
+    geo_index.prime_coords(df, geo.lat_r, geo.lon_r)
+
+    def new(q, base=df):
+        idx = base is df
+        found = screen_query.run(base, q, attrs=attrs if idx else None, geo=geo if idx else None)
+        return screen_query.select(found.frame, q)
+
+    pois = [(55.75, 37.62), (55.80, 37.50), (55.70, 37.70)]
+    q_pick_city = ScreenQuery(city="Москва", formats=("BILLBOARD", "CITY"), owners=("russ",), grp_min=1.0,
+                              strategy="spread", n=50, seed=1)
+    q_pick_at = ScreenQuery(center=(55.75, 37.62), radius_km=10, strategy="mix", n=30,
+                            mix="BILLBOARD:50%,CITY:50%", seed=1)
+    q_plan = ScreenQuery(city="Москва", min_bid=True, prefer_formats=True, strategy="spread", n=20, seed=1)
+    last = new(ScreenQuery(center=(55.75, 37.62), radius_km=3))
+
+    cases = [
+        ("/near", lambda: geo_index.within_radius(df, (55.75, 37.62), 3, index=geo),
+                  lambda: new(ScreenQuery(center=(55.75, 37.62), radius_km=3))),
+        ("/pick_at", lambda: legacy_select_with_mix(
+                         geo_index.within_radius(df, (55.75, 37.62), 10, index=geo).reset_index(drop=True),
+                         30, q_pick_at.mix, seed=1),
+                     lambda: new(q_pick_at)),
+        ("/pick_city", lambda: legacy_spread_select(legacy_apply_filters(
+                           df[inventory_prep.equals_mask(df["city"], "Москва")],
+                           formats=q_pick_city.formats, owners=q_pick_city.owners, grp_min=1.0).reset_index(drop=True),
+                           50, seed=1),
+                       lambda: new(q_pick_city)),
+        ("/plan", lambda: legacy_plan(df, "Москва", 20), lambda: new(q_plan)),
+        ("/near_geo", lambda: legacy_apply_filters(geo_index.radius_join_frame(df, pois, 2.0, index=geo),
+                                                   formats=("BILLBOARD",)),
+                      lambda: new(ScreenQuery(centers=tuple(pois), radius_km=2.0, formats=("BILLBOARD",)))),
+        ("/forecast", lambda: screen_query.fill_min_bid(last.copy()),
+                      lambda: new(ScreenQuery(min_bid=True), base=last)),
+    ]
+    print(f"n={len(df)} (инвентарь {df.memory_usage(deep=True).sum() / 2**20:.0f} МБ)")
+    for name, old_fn, new_fn in cases:
+        m_old, t_old, r_old = _measure(old_fn)
+        m_new, t_new, r_new = _measure(new_fn)
+        same = sorted(map(str, r_old["screen_id"])) == sorted(map(str, r_new["screen_id"]))
+        print(f"{name:<11} copies: peak {m_old:7.1f} MB, {t_old:7.1f} ms | positions: peak {m_new:6.1f} MB, "
+              f"{t_new:6.1f} ms | rows={len(r_new)} same={same}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    bench_commands(synthetic_inventory(n))
@@ -1,9 +1,10 @@
 # ====== imports ======
-import os, io, math, asyncio, logging, time, json, ssl, re, random
+import os, io, math, asyncio, logging, time, json, ssl, re, random, hashlib
 from pathlib import Path
-from datetime import datetime
-from typing import Any
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
 
+import numpy as np
 import pandas as pd
 import aiohttp
 
@@ -20,7 +21,29 @@ try:
 except Exception:
     certifi = None
 
+try:
+    import pyarrow  # Feather (Arrow IPC) для кэша инвентаря; без него — CSV
+except Exception:
+    pyarrow = None
+
 # гео-провайдеры
+import geo_index
+import screen_query
+import selection
+import executors
+import adaptive_http
+import http_client
+import geo_cache
+import city_bbox
+import geo_race
+import overpass_health
+import poi_index
+import nominatim_client
+import inventory_prep
+import inventory_snapshot
+from geo_cache import cached_geocoder
+from detail_cache import DetailCache, DetailEntry
+from selection import _extract_screen_ids
 from geo_ai import find_poi_ai, RUSSIA_BBOX
 from overpass_provider import search_overpass
 
@@ -77,15 +100,34 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_DIR = Path(os.getenv("SCREENS_CACHE_DIR", "/tmp/omnika_cache"))
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
-CACHE_CSV  = CACHE_DIR / "screens_cache.csv"
-CACHE_META = CACHE_DIR / "screens_cache.meta.json"
+CACHE_CSV     = CACHE_DIR / "screens_cache.csv"
+CACHE_FEATHER = CACHE_DIR / "screens_cache.feather"
+CACHE_META    = CACHE_DIR / "screens_cache.meta.json"
+CACHE_SYNC_ROWS = CACHE_DIR / "screens_cache.rows.json"   # id → хэш сырой строки API прошлого синка (delta=1)
+CACHE_GRID_DIR = CACHE_DIR / "screens_grid"   # .npy гео-сетки, открываются через mmap
+CACHE_SCHEMA_VERSION = 1   # поднять при несовместимом изменении формата кэша
 
-SCREENS: pd.DataFrame | None = None
+# инвентарь — только через inventory_snapshot.current(): df + гео-сетка + индекс атрибутов одной версии
 LAST_RESULT: pd.DataFrame | None = None
 LAST_SELECTION_NAME = "last"
 MAX_PLAYS_PER_HOUR = 6
 LAST_SYNC_TS: float | None = None
 
+# /sync_api: сколько страниц инвентаря тянем параллельно и сколько раз повторяем упавшую
+SYNC_PAGE_CONCURRENCY = int(os.getenv("SYNC_PAGE_CONCURRENCY", "6"))
+SYNC_PAGE_RETRIES     = int(os.getenv("SYNC_PAGE_RETRIES", "3"))
+# имя параметра API «изменено после» для /sync_api delta=1 (можно переопределить since=<param>)
+SYNC_SINCE_PARAM      = os.getenv("SYNC_SINCE_PARAM", "").strip()
+# догрузка OTS (ots=1): потолок адаптивной параллельности и число повторов на экран
+OTS_MAX_CONCURRENCY   = int(os.getenv("OTS_MAX_CONCURRENCY", "48"))
+OTS_RETRIES           = int(os.getenv("OTS_RETRIES", "5"))
+# кэш детальных карточек для ots=1: сколько часов запись считается свежей
+DETAIL_CACHE_PATH  = CACHE_DIR / "inventory_details.sqlite"
+DETAIL_CACHE_TTL_S = float(os.getenv("DETAIL_CACHE_TTL_H", "72")) * 3600
+_DETAIL_CACHE: DetailCache | None = None
+# догрузка азимута (azimuth=...): общий бюджет параллельных запросов на все кампании и страницы
+AZIMUTH_CONCURRENCY = int(os.getenv("AZIMUTH_CONCURRENCY", "8"))
+
 # Гео-настройки
 DEFAULT_RADIUS: float = 2.0
 USER_RADIUS: dict[int, float] = {}
@@ -102,7 +144,7 @@ OVERPASS_ENDPOINTS = [
     "https://overpass.kumi.systems/api/interpreter",
     "https://overpass.openstreetmap.ru/api/interpreter",
 ]
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+overpass_health.TRACKER.register(OVERPASS_ENDPOINTS)
 
 # последнее найденное множество POI (для /near_geo без текста)
 LAST_POI: list[dict] = []
@@ -128,6 +170,7 @@ HELP = (
     "• /sync_api [фильтры] — подтянуть инвентарь из API (если настроены переменные окружения)\n"
     "Например: /sync_api city=Москва — подтянуть экраны из API только по Москве\n"
     "Азимут: /sync_api azimuth=6435,6436 — догрузить азимут из impression-inventory-stats для указанных кампаний\n"
+    "Дельта: /sync_api delta=1 [since=updatedFrom] — только изменения с прошлого синка (удалённые экраны убираются)\n"
     "• /export_last — выгрузить последнюю выборку (CSV)\n\n"
     
     "🔎 Выбрать экраны:\n"
@@ -172,15 +215,6 @@ HELP = (
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
-def _extract_screen_ids(frame: pd.DataFrame) -> list[str]:
-    """Безопасно достаёт список screen_id даже при дублированных колонках."""
-    if "screen_id" not in frame.columns:
-        return []
-    ser = frame["screen_id"]
-    if isinstance(ser, pd.DataFrame):   # на случай дубликатов колонок
-        ser = ser.iloc[:, 0]
-    return [s for s in ser.astype(str).tolist() if s and s.lower() != "nan"]
-
 def make_main_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -203,8 +237,107 @@ def _cache_diag() -> str:
     except Exception as e:
         return f"diag_error={e}"
 
-def save_screens_cache(df: pd.DataFrame) -> bool:
-    """Сохраняет кэш на диск (CSV + meta)."""
+def _set_screens(
+    df: pd.DataFrame | None,
+    index: geo_index.GridIndex | None = None,
+    source: str = "",
+) -> inventory_snapshot.Snapshot:
+    """
+    Единая точка замены инвентаря: публикует новый снимок (гео-индекс — готовый index из кэша или пересборка,
+    индекс атрибутов) и сразу, без await, пересчитывает bbox городов по нему. Запросы, уже взявшие старый снимок, доживают на нём.
+    """
+    t0 = time.perf_counter()
+    snap = inventory_snapshot.publish(df, index=index, source=source)
+    city_bbox.RESOLVER.index_screens(snap.df)
+    logging.info(f"Инвентарь опубликован: {snap.describe()}, индексы за {(time.perf_counter() - t0) * 1000:.0f} мс")
+    return snap
+
+def _write_atomic(path: Path, write) -> None:
+    """write(tmp_path) пишет во временный файл рядом, затем os.replace — читатель не увидит полфайла."""
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def _write_cache_frame(df: pd.DataFrame) -> tuple[str, Path]:
+    """Пишет инвентарь в Feather (типы сохраняются), при невозможности — в CSV. Возвращает (формат, путь)."""
+    if pyarrow is not None:
+        frame = df.reset_index(drop=True)
+        for attempt in (1, 2):
+            try:
+                # без сжатия: при чтении числовые колонки отображаются из файла (mmap), а не распаковываются
+                _write_atomic(CACHE_FEATHER, lambda p: frame.to_feather(p, compression="uncompressed"))
+                CACHE_CSV.unlink(missing_ok=True)   # чтобы фолбэк не поднял устаревший CSV
+                return "feather", CACHE_FEATHER
+            except Exception as e:
+                if attempt == 2:
+                    logging.warning(f"Feather-кэш не записан ({e}) — сохраняю CSV")
+                    break
+                # object-колонки со смешанными типами (например, screen_id из XLSX: 123 и "A-1") → строки
+                obj_cols = [c for c in frame.columns if frame[c].dtype == object]
+                frame = frame.astype({c: "string" for c in obj_cols})
+    _write_atomic(CACHE_CSV, lambda p: df.to_csv(p, index=False, encoding="utf-8-sig"))
+    CACHE_FEATHER.unlink(missing_ok=True)
+    return "csv", CACHE_CSV
+
+def _write_cache_grid(df: pd.DataFrame) -> dict | None:
+    """Сохраняет гео-сетку по df в CACHE_GRID_DIR; возвращает описание для meta или None."""
+    if not {"lat", "lon"}.issubset(df.columns):
+        return None
+    try:
+        snap = inventory_snapshot.current()
+        index = snap.geo if (df is snap.df and snap.geo is not None) else geo_index.GridIndex.from_frame(df)
+        index.save(CACHE_GRID_DIR)
+        return {"rows": int(index.size), "cell_deg": index.cell_deg, "coords": geo_index.coords_fingerprint(df)}
+    except Exception as e:
+        logging.warning(f"Гео-сетка в кэш не записана ({e}) — при старте построю заново")
+        return None
+
+def _load_cache_grid(meta: dict, df: pd.DataFrame) -> geo_index.GridIndex | None:
+    """
+    Сетка с диска, если она построена по тем же координатам, что и df: совпадения числа строк мало —
+    после падения между записью сетки и meta или ресинка с тем же числом экранов она была бы чужой.
+    """
+    grid = meta.get("grid") or {}
+    if grid.get("rows") != len(df) or not grid.get("coords"):
+        return None
+    if grid["coords"] != geo_index.coords_fingerprint(df):
+        logging.info("Гео-сетка в кэше построена по другим координатам — строю заново")
+        return None
+    try:
+        return geo_index.GridIndex.load(CACHE_GRID_DIR, cell_deg=float(grid.get("cell_deg", 0.02)))
+    except Exception as e:
+        logging.warning(f"Гео-сетка из кэша не читается ({e}) — строю заново")
+        return None
+
+def _read_feather_mmap(path: Path) -> pd.DataFrame:
+    """Feather через memory_map: числовые колонки без NaN остаются view на страницы файла."""
+    import pyarrow.feather as feather
+    table = feather.read_table(path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+def _read_sync_rows() -> dict[str, str] | None:
+    """Хэши строк прошлого синка (id → digest); None — файла нет или он не читается."""
+    try:
+        return json.loads(CACHE_SYNC_ROWS.read_text(encoding="utf-8")) if CACHE_SYNC_ROWS.exists() else None
+    except Exception as e:
+        logging.warning(f"хэши строк прошлого синка не читаются: {e}")
+        return None
+
+def _read_cache_meta() -> dict:
+    try:
+        return json.loads(CACHE_META.read_text(encoding="utf-8")) if CACHE_META.exists() else {}
+    except Exception as e:
+        logging.warning(f"meta кэша не читается: {e}")
+        return {}
+
+def save_screens_cache(df: pd.DataFrame, sync: dict | None = None, row_hashes: dict[str, str] | None = None) -> bool:
+    """
+    Сохраняет кэш на диск (Feather или CSV + meta). sync — состояние для /sync_api delta=1 (ключ фильтров, ts);
+    row_hashes — хэши строк по id для следующей дельты, отдельным файлом (meta остаётся маленькой).
+    """
     global LAST_SYNC_TS
     try:
         if df is None or df.empty:
@@ -218,40 +351,66 @@ def save_screens_cache(df: pd.DataFrame) -> bool:
             logging.error(f"write_test failed: {e} | {_cache_diag()}")
             return False
 
-        df.to_csv(CACHE_CSV, index=False, encoding="utf-8-sig")
+        fmt, path = _write_cache_frame(df)
+        grid = _write_cache_grid(df)
+        if row_hashes is not None:
+            _write_atomic(CACHE_SYNC_ROWS, lambda p: p.write_text(json.dumps(row_hashes), encoding="utf-8"))
 
         LAST_SYNC_TS = time.time()
-        meta = {"ts": LAST_SYNC_TS, "rows": int(len(df))}
-        CACHE_META.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        meta = {
+            "ts": LAST_SYNC_TS,
+            "rows": int(len(df)),
+            "schema_version": CACHE_SCHEMA_VERSION,
+            "format": fmt,
+            "file": path.name,
+            "dtypes": {str(c): str(t) for c, t in df.dtypes.items()},
+            "grid": grid,
+            "sync": sync,
+        }
+        _write_atomic(CACHE_META, lambda p: p.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8"))
 
-        logging.info(f"💾 Кэш сохранён: {len(df)} строк → {CACHE_CSV} | {_cache_diag()}")
+        logging.info(f"💾 Кэш сохранён: {len(df)} строк → {path} | {_cache_diag()}")
         return True
     except Exception as e:
         logging.error(f"Ошибка при сохранении кэша: {e} | {_cache_diag()}", exc_info=True)
         return False
 
 def load_screens_cache() -> bool:
-    """Пытается поднять инвентарь из CSV. Возвращает True/False."""
-    global SCREENS, LAST_SYNC_TS
+    """Пытается поднять инвентарь из кэша (Feather, иначе CSV). Возвращает True/False."""
+    global LAST_SYNC_TS
     try:
-        if not CACHE_CSV.exists():
-            logging.info(f"Кэш CSV не найден: {CACHE_CSV} | {_cache_diag()}")
+        meta = _read_cache_meta()
+        if meta and meta.get("schema_version", CACHE_SCHEMA_VERSION) != CACHE_SCHEMA_VERSION:
+            logging.info(f"Кэш другой версии схемы ({meta.get('schema_version')} != {CACHE_SCHEMA_VERSION}) — игнорирую")
             return False
 
-        df = pd.read_csv(CACHE_CSV)
+        t0 = time.perf_counter()
+        df = None
+        if meta.get("format") == "feather" and CACHE_FEATHER.exists():
+            if pyarrow is None:
+                logging.warning("Кэш в Feather, но pyarrow не установлен — пробую CSV")
+            else:
+                try:
+                    df = _read_feather_mmap(CACHE_FEATHER)
+                except Exception as e:
+                    logging.warning(f"Feather-кэш не читается ({e}) — пробую CSV")
+        if df is None:
+            if not CACHE_CSV.exists():
+                logging.info(f"Кэш не найден: {CACHE_FEATHER.name} / {CACHE_CSV.name} | {_cache_diag()}")
+                return False
+            df = pd.read_csv(CACHE_CSV)
+
         if df is None or df.empty:
-            logging.warning(f"Кэш CSV пустой: {CACHE_CSV}")
+            logging.warning(f"Кэш пустой: {CACHE_DIR}")
             return False
 
-        SCREENS = df
-
-        if CACHE_META.exists():
-            meta = json.loads(CACHE_META.read_text(encoding="utf-8"))
-            LAST_SYNC_TS = float(meta.get("ts")) if "ts" in meta else None
-        else:
-            LAST_SYNC_TS = None
+        snap = _set_screens(df, index=_load_cache_grid(meta, df), source="cache")
+        LAST_SYNC_TS = float(meta["ts"]) if "ts" in meta else None
 
-        logging.info(f"Loaded screens cache: {len(SCREENS)} rows, ts={LAST_SYNC_TS} | {_cache_diag()}")
+        logging.info(
+            f"Loaded screens cache: {snap.rows} rows, ts={LAST_SYNC_TS}, "
+            f"{(time.perf_counter() - t0) * 1000:.0f} ms | {_cache_diag()}"
+        )
         return True
     except Exception as e:
         logging.error(f"Ошибка при загрузке кэша: {e} | {_cache_diag()}", exc_info=True)
@@ -279,25 +438,8 @@ def _detect_osm_category(q: str):
     return None
 
 async def _nominatim_city_bbox(session: aiohttp.ClientSession, city: str, ssl):
-    """Получаем bbox города через Nominatim: (south, west, north, east)."""
-    params = {
-        "q": city,
-        "format": "jsonv2",
-        "limit": 1,
-        "addressdetails": 0,
-        "polygon_geojson": 0,
-    }
-    headers = {"User-Agent": "omniboard-bot/1.0"}
-    async with session.get(NOMINATIM_URL, params=params, headers=headers, ssl=ssl) as r:
-        data = await r.json()
-    if not data:
-        return None
-    bbox = data[0].get("boundingbox")
-    if not bbox or len(bbox) < 4:
-        return None
-    south, north, west, east = float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3])
-    # Nominatim отдаёт [south, north, west, east]
-    return (south, west, north, east)
+    """bbox города (south, west, north, east): из city_bbox (диск/инвентарь), в Nominatim — только для новых городов."""
+    return city_bbox.as_swne(await city_bbox.RESOLVER.resolve(city, country_hint=""))
 
 def _build_overpass_query(q: str, bbox=None, limit=50):
     """
@@ -332,6 +474,7 @@ out center {limit};
 """
     return ql
 
+@cached_geocoder("overpass:bot")
 async def _overpass_search(session: aiohttp.ClientSession, query: str, city: str | None, limit: int, ssl):
     # Получим bbox города для сужения (если задан city)
     bbox = None
@@ -343,46 +486,41 @@ async def _overpass_search(session: aiohttp.ClientSession, query: str, city: str
 
     ql = _build_overpass_query(query, bbox=bbox, limit=limit)
     headers = {"User-Agent": "omniboard-bot/1.0"}
-    for url in OVERPASS_ENDPOINTS:
-        try:
-            async with session.post(url, data=ql.encode("utf-8"), headers=headers, ssl=ssl, timeout=aiohttp.ClientTimeout(total=40)) as r:
-                if r.status != 200:
-                    continue
-                data = await r.json()
-        except Exception:
-            continue
+    # зеркала — от самого здорового (overpass_health); выбитые circuit breaker'ом пробуем последними
+    _, data = await overpass_health.TRACKER.post(session, OVERPASS_ENDPOINTS, ql, headers=headers, ssl=ssl, timeout_s=40)
+    if data is None:
+        geo_cache.mark_failed()   # все зеркала упали — пустой ответ не кэшируем
 
-        els = data.get("elements", []) if isinstance(data, dict) else []
-        pois = []
-        seen = set()
-        for el in els:
-            tags = el.get("tags", {}) or {}
-            name = tags.get("name") or tags.get("brand") or "(без названия)"
-            lat = el.get("lat")
-            lon = el.get("lon")
-            if lat is None or lon is None:
-                center = el.get("center") or {}
-                lat = center.get("lat")
-                lon = center.get("lon")
-            if lat is None or lon is None:
-                continue
-            key = (round(float(lat), 6), round(float(lon), 6), name)
-            if key in seen:
-                continue
-            seen.add(key)
-            pois.append({
-                "name": name,
-                "lat": float(lat),
-                "lon": float(lon),
-                "provider": "overpass",
-                "raw": {"id": el.get("id"), "type": el.get("type"), "tags": tags}
-            })
-        if pois:
-            # отсортируем по имени для стабильности
-            pois.sort(key=lambda x: x["name"].lower())
-            return pois[:limit]
-    return []
+    els = data.get("elements", []) if isinstance(data, dict) else []
+    pois = []
+    seen = set()
+    for el in els:
+        tags = el.get("tags", {}) or {}
+        name = tags.get("name") or tags.get("brand") or "(без названия)"
+        lat = el.get("lat")
+        lon = el.get("lon")
+        if lat is None or lon is None:
+            center = el.get("center") or {}
+            lat = center.get("lat")
+            lon = center.get("lon")
+        if lat is None or lon is None:
+            continue
+        key = (round(float(lat), 6), round(float(lon), 6), name)
+        if key in seen:
+            continue
+        seen.add(key)
+        pois.append({
+            "name": name,
+            "lat": float(lat),
+            "lon": float(lon),
+            "provider": "overpass",
+            "raw": {"id": el.get("id"), "type": el.get("type"), "tags": tags}
+        })
+    # отсортируем по имени для стабильности
+    pois.sort(key=lambda x: x["name"].lower())
+    return pois[:limit]
 
+@cached_geocoder("nominatim:bot")
 async def _nominatim_search(session: aiohttp.ClientSession, query: str, city: str | None, limit: int, ssl):
     q = f"{query}, {city}" if city else query
     params = {
@@ -391,9 +529,7 @@ async def _nominatim_search(session: aiohttp.ClientSession, query: str, city: st
         "limit": limit,
         "addressdetails": 0,
     }
-    headers = {"User-Agent": "omniboard-bot/1.0"}
-    async with session.get(NOMINATIM_URL, params=params, headers=headers, ssl=ssl, timeout=aiohttp.ClientTimeout(total=30)) as r:
-        data = await r.json()
+    data = await nominatim_client.CLIENT.search(params, ssl=ssl)
 
     pois = []
     seen = set()
@@ -432,7 +568,7 @@ async def geocode_query(query: str, city: str | None = None, limit: int = 10, pr
     provider: 'nominatim' | 'overpass'
     """
     ssl_param = _make_ssl_param_for_aiohttp()
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=45)) as session:
+    async with http_client.client(timeout=aiohttp.ClientTimeout(total=45)) as session:
         prov = (provider or "nominatim").lower().strip()
         if prov == "overpass":
             pois = await _overpass_search(session, query, city, limit, ssl_param)
@@ -459,74 +595,6 @@ def haversine_km(a: tuple[float, float], b: tuple[float, float]) -> float:
     h = math.sin(dlat/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(dlon/2)**2
     return 2 * r * math.asin(math.sqrt(h))
 
-def find_within_radius(df: pd.DataFrame, center: tuple[float,float], radius_km: float) -> pd.DataFrame:
-    rows = []
-    for _, row in df.iterrows():
-        d = haversine_km(center, (row["lat"], row["lon"]))
-        if d <= radius_km:
-            rows.append({
-                "screen_id": row.get("screen_id", ""),
-                "name": row.get("name", ""),
-                "city": row.get("city", ""),
-                "format": row.get("format", ""),
-                "owner": row.get("owner", ""),
-                "lat": row["lat"],
-                "lon": row["lon"],
-                "distance_km": round(d, 3),
-            })
-    out = pd.DataFrame(rows)
-    return out.sort_values("distance_km") if not out.empty else out
-
-def spread_select(df: pd.DataFrame, n: int, *, random_start: bool = True, seed: int | None = None) -> pd.DataFrame:
-    """Жадный k-center (Gonzalez) c рандомным стартом и случайными тай-брейками."""
-    import random as _random
-    if df.empty or n <= 0:
-        return df.iloc[0:0]
-    n = min(n, len(df))
-
-    if seed is not None:
-        _random.seed(seed)
-
-    coords = df[["lat", "lon"]].to_numpy()
-
-    if random_start:
-        start_idx = _random.randrange(len(df))
-    else:
-        lat_med = float(df["lat"].median())
-        lon_med = float(df["lon"].median())
-        start_idx = min(
-            range(len(df)),
-            key=lambda i: haversine_km((lat_med, lon_med), (coords[i][0], coords[i][1]))
-        )
-
-    chosen = [start_idx]
-    dists = [
-        haversine_km((coords[start_idx][0], coords[start_idx][1]), (coords[i][0], coords[i][1]))
-        for i in range(len(df))
-    ]
-
-    while len(chosen) < n:
-        maxd = max(dists)
-        candidates = [i for i, d in enumerate(dists) if d == maxd]
-        next_idx = _random.choice(candidates)
-        chosen.append(next_idx)
-        cx, cy = coords[next_idx]
-        for i in range(len(df)):
-            d = haversine_km((cx, cy), (coords[i][0], coords[i][1]))
-            if d < dists[i]:
-                dists[i] = d
-
-    res = df.iloc[chosen].copy()
-    res["min_dist_to_others_km"] = 0.0
-    cc = res[["lat","lon"]].to_numpy()
-    for i in range(len(res)):
-        mind = min(
-            haversine_km((cc[i][0], cc[i][1]), (cc[j][0], cc[j][1]))
-            for j in range(len(res)) if j != i
-        ) if len(res) > 1 else 0.0
-        res.iat[i, res.columns.get_loc("min_dist_to_others_km")] = round(mind, 3)
-    return res
-
 def parse_kwargs(parts: list[str]) -> dict[str, str]:
     """Парсим хвост команды вида key=value (значения можно брать в кавычки)."""
     out: dict[str,str] = {}
@@ -551,92 +619,54 @@ def parse_list(val: str) -> list[str]:
         val = val.replace(sep, ",")
     return [x.strip() for x in val.split(",") if x.strip()]
 
-def _format_mask(series: pd.Series, token: str) -> pd.Series:
-    col = series.astype(str).str.upper().str.strip()
-    t = token.strip().upper()
-    if t in {"CITY", "CITY_FORMAT", "CITYFORMAT", "CITYLIGHT", "ГИД", "ГИДЫ"}:
-        return col.str.startswith("CITY_FORMAT")
-    if t in {"BILLBOARD", "BB"}:
-        return col == "BILLBOARD"
-    return col == t
-
-def apply_filters(df: pd.DataFrame, kwargs: dict[str, str]) -> pd.DataFrame:
-    out = df.copy()
-
-    # ---------- helpers ----------
-    def _numify_series(s: pd.Series) -> pd.Series:
-        """
-        Приводит к float:
-        '12 345,6' -> 12345.6,  '50k' -> 50000,  '1.2m'/'1,2m' -> 1200000,
-        пустые/мусор -> NaN.
-        """
-        x = s.astype(str).str.strip()
-        x = x.str.replace("\u00A0", "", regex=False).str.replace(" ", "", regex=False)  # убираем пробелы/nbsp
-        x = x.str.replace(",", ".", regex=False)                                        # запятая -> точка
-
-        def _to_float(v: str) -> float | None:
-            if not v or v.lower() in {"nan", "none", "—", "-", ""}:
-                return None
-            mul = 1.0
-            last = v[-1:].lower()
-            if last == "k":
-                v, mul = v[:-1], 1_000.0
-            elif last == "m":
-                v, mul = v[:-1], 1_000_000.0
-            try:
-                return float(v) * mul
-            except Exception:
-                return None
-
-        return pd.to_numeric(x.map(_to_float), errors="coerce")
-
-    # ---------- FORMAT ----------
-    fmt_val = kwargs.get("format") or kwargs.get("formats") or kwargs.get("format_in")
-    if fmt_val and "format" in out.columns:
-        tokens = [t.strip().upper() for t in re.split(r"[;,|]", str(fmt_val)) if t.strip()]
-        col = out["format"].astype(str).str.upper()
-        mask = None
-        for f in tokens:
-            m = col.str.startswith("CITY_FORMAT") if f.lower() in {"city","city_format","cityformat","citylight","гид","гиды"} else (col == f)
-            mask = m if mask is None else (mask | m)
-        if mask is not None:
-            out = out[mask]
-
-    # ---------- OWNER ----------
-    own_val = kwargs.get("owner") or kwargs.get("owners") or kwargs.get("owner_in")
-    if own_val and "owner" in out.columns:
-        owners = [t.strip().lower() for t in re.split(r"[;,|]", str(own_val)) if t.strip()]
-        col = out["owner"].astype(str).str.lower()
-        mask = None
-        for o in owners:
-            m = col.str.contains(re.escape(o), na=False)
-            mask = m if mask is None else (mask | m)
-        if mask is not None:
-            out = out[mask]
-
-    # ---------- GRP_MIN ----------
-    grp_min_raw = kwargs.get("grp_min") or kwargs.get("min_grp")
-    if grp_min_raw and "grp" in out.columns:
-        try:
-            grp_min = float(str(grp_min_raw).replace(" ", "").replace(",", "."))
-        except Exception:
-            grp_min = None
-        if grp_min is not None:
-            grp_num = _numify_series(out["grp"])
-            out = out[grp_num.ge(grp_min).fillna(False)]
-
-    # ---------- OTS_MIN ----------
-    ots_min_raw = kwargs.get("ots_min") or kwargs.get("min_ots")
-    if ots_min_raw and "ots" in out.columns:
-        try:
-            ots_min = float(str(ots_min_raw).replace(" ", "").replace(",", "."))
-        except Exception:
-            ots_min = None
-        if ots_min is not None:
-            ots_num = _numify_series(out["ots"])
-            out = out[ots_num.ge(ots_min).fillna(False)]
+def _parse_threshold(raw: str | None) -> float | None:
+    """grp_min/ots_min: '1 000,5' → 1000.5; пусто или мусор → None (порог не применяется)."""
+    if not raw:
+        return None
+    try:
+        return float(str(raw).replace(" ", "").replace(",", "."))
+    except Exception:
+        return None
 
-    return out
+async def run_query(
+    q: screen_query.ScreenQuery,
+    snap: inventory_snapshot.Snapshot | None = None,
+    *,
+    df: pd.DataFrame | None = None,
+) -> screen_query.QueryResult:
+    """
+    Запрос через screen_query: по снимку инвентаря (его индексы — той же версии, что и df) или по
+    произвольному df (например, LAST_RESULT) без индексов. Снимок хэндлер берёт один раз в начале.
+    """
+    if df is None:
+        snap = snap or inventory_snapshot.current()
+        df, attrs, geo = snap.df, snap.attrs, snap.geo
+    else:
+        attrs = geo = None
+    res = await executors.run_io(screen_query.run, df, q, attrs=attrs, geo=geo)
+    logging.debug(f"query: {res.explain()}")
+    return res
+
+async def run_select(pool: pd.DataFrame, q: screen_query.ScreenQuery) -> pd.DataFrame:
+    """
+    screen_query.select без пиклинга пула в процесс: k-center (spread, top_ots без OTS) получает в пуле
+    процессов только радианы пула; mix/top_ots/all — в пуле потоков (numpy там и так отпускает GIL).
+    """
+    job = await executors.run_io(screen_query.spread_job, pool, q)
+    if job is None:
+        return await executors.run_io(screen_query.select, pool, q)
+    lat_r, lon_r, order = job
+    chosen, mind = await executors.run_cpu(
+        selection.spread_positions_rad, lat_r, lon_r, q.n, random_start=q.random_start, seed=q.seed,
+    )
+    return screen_query.spread_result(pool, order, chosen, mind)
+
+def _xlsx_bytes(df: pd.DataFrame, sheet_name: str = "Sheet1") -> bytes:
+    """DataFrame → XLSX (openpyxl). Синхронная и небыстрая — из хэндлеров звать через executors.run_io."""
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as w:
+        df.to_excel(w, index=False, sheet_name=sheet_name)
+    return buf.getvalue()
 
 # Разбивка длинного ответа на части
 async def send_lines(message: types.Message, lines: list[str], header: str | None = None, chunk: int = 60, parse_mode: str | None = None):
@@ -698,22 +728,15 @@ async def geocode_query(query: str, *, city: str | None = None, limit: int = 5,
 
 async def _gc_nominatim(q: str, *, limit: int = 5) -> list[dict]:
     """
-    Базовый бесплатный вариант. Важно: уважать rate limit.
+    Базовый бесплатный вариант. Rate limit соблюдает общий nominatim_client.
     """
-    url = "https://nominatim.openstreetmap.org/search"
     params = {
         "q": q,
         "limit": max(1, min(int(limit or 5), 25)),
         "format": "jsonv2",
         "addressdetails": 1,
     }
-    headers = {
-        "User-Agent": "omnika-bot/1.0 (contact: admin@example.com)"
-    }
-    async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=20)) as s:
-        async with s.get(url, params=params) as r:
-            r.raise_for_status()
-            data = await r.json()
+    data = await nominatim_client.CLIENT.search(params)
     out = []
     for it in data or []:
         try:
@@ -758,13 +781,21 @@ def _ssl_ctx_certifi() -> ssl.SSLContext:
     ctx.verify_mode = ssl.CERT_REQUIRED
     return ctx
 
+_SSL_PARAM: list = []   # [значение] после первого вызова: один SSLContext на процесс
+
 def _make_ssl_param_for_aiohttp():
     """
-    Возвращает:
+    Возвращает (один раз собирает и дальше отдаёт тот же объект — общий пул соединений
+    переиспользует TLS-соединения только при одинаковом ssl):
       - False  -> отключить проверку (aiohttp примет ssl=False)
       - ssl.SSLContext -> кастомный CA (OBDSP_CA_BUNDLE) или certifi
       - None  -> системные корни
     """
+    if not _SSL_PARAM:
+        _SSL_PARAM.append(_build_ssl_param())
+    return _SSL_PARAM[0]
+
+def _build_ssl_param():
     if OBDSP_SSL_VERIFY in {"0", "false", "no", "off"} or OBDSP_SSL_NO_VERIFY:
         return False
     if OBDSP_CA_BUNDLE:
@@ -818,13 +849,50 @@ def _build_server_query(filters: dict | None) -> dict:
         q[k] = v
     return {k: v for k, v in q.items() if v not in ("", None, [], {})}
 
+_RETRYABLE_HTTP = {429, 500, 502, 503, 504}
+
+async def _fetch_inventory_page(
+    session: aiohttp.ClientSession,
+    root: str,
+    params: dict,
+    headers: dict,
+    ssl_param,
+    retries: int = SYNC_PAGE_RETRIES,
+) -> dict:
+    """Одна страница инвентаря; 429/5xx и сетевые ошибки повторяем с экспоненциальной паузой."""
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(root, headers=headers, params=params, ssl=ssl_param) as resp:
+                text = await resp.text()
+                if resp.status == 200:
+                    try:
+                        return json.loads(text)
+                    except Exception:
+                        raise RuntimeError(f"Не удалось распарсить JSON: {text[:500]}")
+                if resp.status not in _RETRYABLE_HTTP or attempt == retries:
+                    raise RuntimeError(f"API {resp.status} (page={params.get('page')}): {text[:300]}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise RuntimeError(f"page={params.get('page')}: {e!r}") from e
+        await asyncio.sleep(min(10.0, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+    raise RuntimeError(f"page={params.get('page')}: попытки исчерпаны")
+
 async def _fetch_inventories(
     pages_limit: int | None = None,
     page_size: int = 500,
     total_limit: int | None = None,
     m: types.Message | None = None,
     filters: dict | None = None,
-) -> list[dict]:
+    concurrency: int = SYNC_PAGE_CONCURRENCY,
+    on_page: Callable[[int, list[dict]], Awaitable[Any]] | None = None,
+) -> list:
+    """
+    Страница 0 → из неё totalPages → остальные страницы параллельно (не больше concurrency сразу).
+    Результат склеивается в порядке страниц. Если API не сообщает totalPages — листаем по одной, как раньше.
+    on_page(page, content) — корутина, обрабатывает страницу сразу по приходу, внутри задачи этой страницы
+    (например, нормализует в DataFrame через executors.run_io — не на event loop); тогда сырой JSON страницы
+    не хранится, а функция возвращает список результатов on_page по порядку страниц.
+    """
     base = (OBDSP_BASE or "https://proddsp.omniboard360.io").rstrip("/")
     root = f"{base}/api/v1.0/clients/inventories"
     headers = {**_auth_headers(), "Accept": "application/json"}
@@ -832,60 +900,148 @@ async def _fetch_inventories(
     ssl_param = _make_ssl_param_for_aiohttp()
     server_q = _build_server_query(filters)
 
-    items: list[dict] = []
-    page = 0
-    pages_fetched = 0
+    def _params(page: int) -> dict[str, Any]:
+        params: dict[str, Any] = {"page": page, "size": page_size}
+        params.update(server_q)
+        return params
 
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        while True:
-            params: dict[str, Any] = {"page": page, "size": page_size}
-            params.update(server_q)
-            async with session.get(root, headers=headers, params=params, ssl=ssl_param) as resp:
-                text = await resp.text()
-                if resp.status != 200:
-                    raise RuntimeError(f"API {resp.status}: {text[:300]}")
-                try:
-                    data = await resp.json()
-                except Exception:
-                    raise RuntimeError(f"Не удалось распарсить JSON: {text[:500]}")
+    def _is_last(data: dict, page: int) -> bool:
+        if data.get("last") is True:
+            return True
+        if data.get("totalPages") is not None and page + 1 >= int(data["totalPages"]):
+            return True
+        return data.get("numberOfElements") == 0
 
-                page_items = data.get("content") or []
-                items.extend(page_items)
+    async def _progress(pages_fetched: int, n_items: int):
+        if m and (pages_fetched % 5 == 0):
+            try:
+                await m.answer(f"…загружено страниц: {pages_fetched}, всего позиций: {n_items}")
+            except Exception:
+                pass
 
-                pages_fetched += 1
+    pages: dict[int, Any] = {}
+
+    async def _keep(page: int, data: dict) -> int:
+        content = data.get("content") or []
+        if total_limit is not None:
+            content = content[:max(0, total_limit - page * page_size)]
+        pages[page] = (await on_page(page, content)) if on_page is not None else content
+        return len(content)
+
+    async with http_client.client(timeout=timeout) as session:
+        first = await _fetch_inventory_page(session, root, _params(0), headers, ssl_param)
+        n_first = await _keep(0, first)
+
+        n_pages = 1
+        if not _is_last(first, 0):
+            n_pages = int(first["totalPages"]) if first.get("totalPages") is not None else None
+            if pages_limit is not None:
+                n_pages = min(n_pages, pages_limit) if n_pages is not None else pages_limit
+            if total_limit is not None:
+                need = max(1, -(-total_limit // max(1, page_size)))
+                n_pages = min(n_pages, need) if n_pages is not None else need
+
+        if n_pages is None:
+            # totalPages неизвестен — последовательно до last/пустой страницы
+            page, n_items = 0, n_first
+            data = first
+            while not _is_last(data, page):
                 page += 1
+                data = await _fetch_inventory_page(session, root, _params(page), headers, ssl_param)
+                n_items += await _keep(page, data)
+                await _progress(page + 1, n_items)
+        elif n_pages > 1:
+            sem = asyncio.Semaphore(max(1, concurrency))
+            done = [1, n_first]
+
+            async def _grab(page: int):
+                async with sem:
+                    data = await _fetch_inventory_page(session, root, _params(page), headers, ssl_param)
+                n = await _keep(page, data)
+                done[0] += 1
+                done[1] += n
+                await _progress(done[0], done[1])
 
-                if total_limit is not None and len(items) >= total_limit:
-                    items = items[:total_limit]
-                    break
-                if pages_limit is not None and pages_fetched >= pages_limit:
-                    break
-                if data.get("last") is True:
-                    break
-                if data.get("totalPages") is not None and page >= int(data["totalPages"]):
-                    break
-                if data.get("numberOfElements") == 0:
-                    break
+            tasks = [asyncio.create_task(_grab(p)) for p in range(1, n_pages)]
+            try:
+                await asyncio.gather(*tasks)
+            except Exception:
+                for t in tasks:
+                    t.cancel()
+                raise
 
-                if m and (pages_fetched % 5 == 0):
-                    try:
-                        await m.answer(f"…загружено страниц: {pages_fetched}, всего позиций: {len(items)}")
-                    except Exception:
-                        pass
+    if on_page is not None:
+        return [pages[page] for page in sorted(pages)]
+    items: list[dict] = []
+    for page in sorted(pages):
+        items.extend(pages[page])
     return items
 
+_API_COLUMNS = [
+    "id","screen_id","name","format","placement","installation",
+    "owner_id","owner","city","address","lat","lon",
+    "width_mm","height_mm","width_px","height_px",
+    "phys_width_px","phys_height_px",
+    "sspProvider","sspTypes","minBid","ots","grp","meta_format",
+    "estimated_ots","interpolated_ots","ssp_ots",
+    "azimuth",
+    "image_url","image_preview"
+]
+
+def _concat_api_chunks(chunks: list[pd.DataFrame]) -> pd.DataFrame:
+    """Склейка постраничных результатов _normalize_api_to_df в один инвентарь (один concat в конце)."""
+    chunks = [c for c in chunks if c is not None and not c.empty]
+    if not chunks:
+        return pd.DataFrame(columns=_API_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
+
+def _page_digest(content: list[dict]) -> str:
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def _row_digest(item: dict) -> str:
+    """Короткий хэш одной сырой строки API (для delta=1: сравнение по id, а не по номеру страницы)."""
+    raw = json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=8).hexdigest()
+
+def _sync_key(server_q: dict, page_size: int) -> str:
+    """Отпечаток запроса синка: дельту можно считать только против кэша с теми же фильтрами и size."""
+    return _page_digest([{"q": server_q, "size": page_size}])
+
+def _id_keys(ids: pd.Series) -> pd.Series:
+    """
+    id как строки для сравнения кэша со свежим JSON: после Feather/CSV колонка бывает int, float, object
+    или string, а в JSON — int. 123 / 123.0 / "123" → "123"; пусто — <NA>.
+    """
+    if pd.api.types.is_float_dtype(ids.dtype):
+        try:
+            ids = ids.astype("Int64")
+        except (TypeError, ValueError):
+            pass   # дробные id — оставляем как есть
+    return ids.astype("string")
+
+def _deleted_ids(base: pd.DataFrame, seen_ids) -> set[str]:
+    """id из base (кэш прошлого синка), которых нет среди seen_ids (id всех строк свежей выгрузки) — строками."""
+    seen = {str(i) for i in seen_ids if i is not None}
+    return set(_id_keys(base["id"]).dropna()) - seen
+
+def _merge_delta(base: pd.DataFrame, changed: pd.DataFrame, deleted_ids, *, replace_unkeyed: bool = False) -> pd.DataFrame:
+    """
+    Upsert по id: строки base с id из changed заменяются, deleted_ids выкидываются, новые добавляются в конец.
+    id сравниваются строками (_id_keys), deleted_ids — тоже строки. replace_unkeyed — строки base без id
+    тоже выкинуть (API отдал их заново в changed: сопоставить не по чему).
+    """
+    base_ids = _id_keys(base["id"])
+    drop = base_ids.isin(_id_keys(changed["id"]).dropna()) if not changed.empty else pd.Series(False, index=base.index)
+    if deleted_ids:
+        drop |= base_ids.isin([str(i) for i in deleted_ids])
+    if replace_unkeyed:
+        drop |= base_ids.isna()
+    drop = drop.fillna(False).astype(bool)
+    return _concat_api_chunks([base.loc[~drop], changed])
+
 def _normalize_api_to_df(items: list[dict]) -> pd.DataFrame:
     if not items:
-        return pd.DataFrame(columns=[
-            "id","screen_id","name","format","placement","installation",
-            "owner_id","owner","city","address","lat","lon",
-            "width_mm","height_mm","width_px","height_px",
-            "phys_width_px","phys_height_px",
-            "sspProvider","sspTypes","minBid","ots","grp","meta_format",
-            "estimated_ots","interpolated_ots","ssp_ots",
-            "azimuth",
-            "image_url","image_preview"
-        ])
+        return pd.DataFrame(columns=_API_COLUMNS)
 
     def g(obj, path, default=None):
         try:
@@ -972,7 +1128,7 @@ async def _fetch_impression_shots(
     ssl_param = _make_ssl_param_for_aiohttp()
     timeout = aiohttp.ClientTimeout(total=180)
 
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    async with http_client.client(timeout=timeout) as session:
         if want_zip:
             url = f"{base}/api/v1.0/campaigns/{campaign_id}/impression-shots/export"
             payload = {"shotCountPerInventoryCreative": per if per > 0 else 0}
@@ -1118,23 +1274,6 @@ def _parse_hours_windows(s: str | None) -> int | None:
                 pass
     return total or None
 
-def _fill_min_bid(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    src_col = None
-    for cand in ("minBid", "min_bid", "min_bid_rub", "min_bid_rur"):
-        if cand in out.columns:
-            src_col = cand
-            break
-    if src_col:
-        vals = pd.to_numeric(out[src_col], errors="coerce")
-        median = float(vals.median()) if not vals.dropna().empty else None
-        out["min_bid_used"] = vals.fillna(median if median else 0)
-        out["min_bid_source"] = src_col
-    else:
-        out["min_bid_used"] = None
-        out["min_bid_source"] = None
-    return out
-
 def _distribute_slots_evenly(n_items: int, total_slots: int) -> list[int]:
     if n_items <= 0 or total_slots <= 0:
         return [0] * max(0, n_items)
@@ -1292,7 +1431,10 @@ from aiogram.types import BufferedInputFile
 @geo_router.message(Command("geo"))
 async def cmd_geo(m: types.Message):
     """
-    /geo <запрос> [city=...] [limit=5] [provider=auto|nominatim|overpass|openai]
+    /geo <запрос> [city=...] [limit=5] [provider=auto|local|nominatim|overpass|openai] [hedge=1|0|off]
+    Категории («аптека», «тц», «школа»…) при auto/local сначала ищутся в локальном индексе OSM (poi_index);
+    явный сетевой provider (overpass/nominatim/openai) идёт сразу в сеть.
+    auto — провайдеры наперегонки: следующий стартует через hedge секунд (0 — все сразу, off — по очереди).
     Примеры:
       /geo Твой дом city=Москва
       /geo стадион city=Химки provider=overpass
@@ -1302,7 +1444,7 @@ async def cmd_geo(m: types.Message):
     text = (m.text or "").strip()
     parts = text.split()[1:]
     if not parts:
-        await m.answer("Формат: /geo <запрос> [city=...] [limit=5] [provider=auto|nominatim|overpass|openai]")
+        await m.answer("Формат: /geo <запрос> [city=...] [limit=5] [provider=auto|local|nominatim|overpass|openai] [hedge=1|0|off]")
         return
 
     # --- разбор аргументов ---
@@ -1324,8 +1466,16 @@ async def cmd_geo(m: types.Message):
     except Exception:
         limit = 5
     provider = (kv.get("provider") or "auto").lower()
-    if provider not in {"auto", "nominatim", "overpass", "openai"}:
+    if provider not in {"auto", "local", "nominatim", "overpass", "openai"}:
         provider = "auto"
+    hedge_raw = (kv.get("hedge") or "").strip().lower()
+    if hedge_raw in {"off", "seq", "no"}:
+        hedge_s = float("inf")
+    else:
+        try:
+            hedge_s = max(0.0, float(hedge_raw.replace(",", "."))) if hedge_raw else geo_race.GEO_HEDGE_S
+        except ValueError:
+            hedge_s = geo_race.GEO_HEDGE_S
 
     await m.answer(f"🔎 Ищу точки «{query}»" + (f" в {city}" if city else "") + (f" через {provider}…" if provider != "auto" else "…"))
 
@@ -1387,6 +1537,20 @@ async def cmd_geo(m: types.Message):
         find_poi_ai = None  # type: ignore
 
     try:
+        # категория + город → локальный индекс OSM, без сети; имена/бренды — дальше к провайдерам.
+        # Явно заданный сетевой provider индекс не трогает — пользователь просил именно его.
+        if provider in {"auto", "local"}:
+            t0 = time.perf_counter()
+            local = await poi_index.search_local(query, city, limit)
+            if local:
+                await m.answer(f"📦 Локальный индекс OSM ({len(local)} точек, {(time.perf_counter() - t0) * 1000:.0f} мс)")
+                await _send(local)
+                return
+            if provider == "local":
+                await m.answer("📦 Локальный индекс OSM: " + (
+                    "запрос не категорийный или нет города/индекса" if local is None else "в этом городе пусто"))
+                return
+
         if provider == "nominatim":
             pois = await geocode_query(query, city=city, limit=limit)
             await m.answer(f"🌍 Nominatim ({len(pois)} точек)")
@@ -1414,44 +1578,22 @@ async def cmd_geo(m: types.Message):
         else:  # auto
             # для категорий: Overpass → Nominatim → OpenAI
             # для брендов/названий: Nominatim → Overpass → OpenAI
-            if _is_category(query):
-                pois = await search_overpass(query, city=city, limit=limit)
-                await m.answer(f"🗺️ Overpass ({len(pois)} точек)")
-                if pois:
-                    await _send(pois)
-                    return
-
-                pois = await geocode_query(query, city=city, limit=limit)
-                await m.answer(f"🌍 Nominatim ({len(pois)} точек)")
-                if pois:
-                    await _send(pois)
-                    return
-
-                if find_poi_ai:
-                    pois = await find_poi_ai(query=query, city=city, limit=limit, country_hint="Россия")
-                    await m.answer(f"🧠 OpenAI ({len(pois)} точек)")
-                    if pois:
-                        await _send(pois)
-                        return
-            else:
-                pois = await geocode_query(query, city=city, limit=limit)
-                await m.answer(f"🌍 Nominatim ({len(pois)} точек)")
-                if pois:
-                    await _send(pois)
-                    return
-
-                pois = await search_overpass(query, city=city, limit=limit)
-                await m.answer(f"🗺️ Overpass ({len(pois)} точек)")
-                if pois:
-                    await _send(pois)
-                    return
-
-                if find_poi_ai:
-                    pois = await find_poi_ai(query=query, city=city, limit=limit, country_hint="Россия")
-                    await m.answer(f"🧠 OpenAI ({len(pois)} точек)")
-                    if pois:
-                        await _send(pois)
-                        return
+            # провайдеры стартуют «лесенкой» через hedge секунд, берём лучший по приоритету непустой ответ
+            by_name = {
+                "Overpass": lambda: search_overpass(query, city=city, limit=limit),
+                "Nominatim": lambda: geocode_query(query, city=city, limit=limit),
+            }
+            order = ["Overpass", "Nominatim"] if _is_category(query) else ["Nominatim", "Overpass"]
+            candidates = [(n, by_name[n]) for n in order]
+            if find_poi_ai:
+                candidates.append(("OpenAI", lambda: find_poi_ai(query=query, city=city, limit=limit, country_hint="Россия")))
+
+            res = await geo_race.race(candidates, hedge_s=hedge_s)
+            if res.winner:
+                await m.answer(f"🏁 {res.winner}: {len(res.pois)} точек за {res.elapsed_s:.1f} с ({res.summary()})")
+                await _send(res.pois)
+                return
+            await m.answer(f"🤷 Ничего не нашлось за {res.elapsed_s:.1f} с ({res.summary()})")
 
     except Exception as e:
         await m.answer(f"🚫 Ошибка поиска: {e}")
@@ -1467,7 +1609,12 @@ async def cmd_geo_diag(m: types.Message):
         "🔧 Диагностика:\n"
         f"• OPENAI_API_KEY: {'✅' if have_key else '❌'}\n"
         f"• Overpass endpoints: {', '.join(OVERPASS_URLS)}\n"
-        "• Nominatim UA задан (в коде): ✅\n"
+        f"• Зеркала Overpass (лучшие сверху, гонка топ-{overpass_health.OVERPASS_RACE_TOP}):\n"
+        f"{overpass_health.TRACKER.table()}\n"
+        f"• Nominatim: {nominatim_client.CLIENT.summary()}\n"
+        f"• Кэш геокодинга: {geo_cache.CACHE.summary()}\n"
+        f"• Границы городов: {city_bbox.RESOLVER.summary()}\n"
+        f"• Локальный индекс POI: {poi_index.summary()}\n"
         "Подсказка: для брендов чаще срабатывает Nominatim; для категорий — Overpass."
     )
 
@@ -1514,8 +1661,9 @@ async def cmd_near_geo(m: types.Message):
       1) сначала /geo ... ; потом /near_geo 2 format=BILLBOARD owner=russ
       2) сразу: /near_geo 2 query="Твой дом" city=Москва limit=5 format=pvz_screen
     """
-    global SCREENS, LAST_RESULT, LAST_POI
-    if SCREENS is None or SCREENS.empty:
+    global LAST_RESULT, LAST_POI
+    snap = inventory_snapshot.current()
+    if snap.empty:
         await m.answer("Сначала загрузите инвентарь (CSV/XLSX или /sync_api).")
         return
 
@@ -1552,8 +1700,15 @@ async def cmd_near_geo(m: types.Message):
             limit = 5
         provider = (kv.get("provider") or "nominatim").lower()
         await m.answer(f"🔎 Ищу точки «{q}»" + (f" в {city}" if city else "") + "…")
+        local = None
+        if "provider" not in kv or provider in {"auto", "overpass", "local"}:
+            local = await poi_index.search_local(q, city, limit)
         try:
-            LAST_POI = await geocode_query(q, city=city, limit=limit, provider=provider)
+            if local:
+                LAST_POI = local
+                await m.answer(f"📦 Локальный индекс OSM: {len(local)} точек")
+            else:
+                LAST_POI = await geocode_query(q, city=city, limit=limit, provider=provider)
         except Exception as e:
             await m.answer(f"⚠️ Геокодер {provider} вернул ошибку: {e}. Пробую альтернативу…")
             # fallback на OpenAI
@@ -1577,60 +1732,39 @@ async def cmd_near_geo(m: types.Message):
 
     await m.answer(f"🧭 Подбираю экраны в радиусе {radius_km} км вокруг {len(pois)} точек…")
 
-    # экраны вокруг всех POI
-    frames = []
-    for p in pois:
-        df = find_within_radius(SCREENS, (p["lat"], p["lon"]), radius_km)
-        if df is not None and not df.empty:
-            df = df.copy()
-            df["poi_name"] = p.get("name","")
-            df["poi_lat"]  = p.get("lat")
-            df["poi_lon"]  = p.get("lon")
-            frames.append(df)
-
-    if not frames:
-        await m.answer("В выбранных радиусах подходящих экранов не нашлось.")
-        return
-
-    res = pd.concat(frames, ignore_index=True)
-
-    # ---- НОВОЕ: применяем фильтры по формату/владельцу/прочим ----
-    # Если у тебя есть apply_filters/parse_kwargs — используем их
-    filter_kwargs = {}
-    for k in ("format", "owner", "type", "placement", "installation", "city"):
-        if k in kv and kv[k]:
-            filter_kwargs[k] = kv[k]
-    if filter_kwargs:
+    # экраны вокруг всех POI — один батч-джойн «экраны × точки»;
+    # dedup=1 → каждый экран один раз, при ближайшей точке
+    def _coord(v):
         try:
-            # предпочтительно: твоя функция умного парсинга (поддержка A,B | A;B | A|B, алиасы и т.п.)
-            res = apply_filters(res, filter_kwargs)
-        except Exception:
-            # fallback: простая фильтрация
-            if "format" in filter_kwargs and "format" in res.columns:
-                fmts = re.split(r"[;,|]", filter_kwargs["format"])
-                fmts = [f.strip().lower() for f in fmts if f.strip()]
-                if fmts:
-                    res = res[res["format"].astype(str).str.lower().isin(fmts)]
-            if "owner" in filter_kwargs and "owner" in res.columns:
-                owners = re.split(r"[;,|]", filter_kwargs["owner"])
-                owners = [o.strip().lower() for o in owners if o.strip()]
-                if owners:
-                    mask = False
-                    col = res["owner"].astype(str).str.lower()
-                    for o in owners:
-                        mask = mask | col.str.contains(o, na=False)
-                    res = res[mask]
-            if "city" in filter_kwargs and "city" in res.columns:
-                c = filter_kwargs["city"].strip().lower()
-                res = res[res["city"].astype(str).str.lower() == c]
+            return float(v)
+        except (TypeError, ValueError):
+            return float("nan")
+
+    centers = tuple((_coord(p.get("lat")), _coord(p.get("lon"))) for p in pois)
+    # город/формат/владелец — позиции из индекса атрибутов, ими сразу ограничиваем джойн
+    q = screen_query.ScreenQuery(
+        centers=centers, radius_km=radius_km, nearest_only=dedup, city=kv.get("city"),
+        formats=tuple(parse_list(kv.get("format") or "")), owners=tuple(parse_list(kv.get("owner") or "")),
+    )
+    try:
+        found = await run_query(q, snap)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
+    res = found.frame
 
     if res.empty:
-        await m.answer("После применения фильтров ничего не осталось. Попробуйте ослабить условия.")
+        if found.empty_at in {"city", "format", "owner"}:
+            await m.answer("После применения фильтров ничего не осталось. Попробуйте ослабить условия.")
+        else:
+            await m.answer("В выбранных радиусах подходящих экранов не нашлось.")
         return
 
-    # удаляем дубликаты экранов при необходимости
-    if dedup and "screen_id" in res.columns:
-        res = res.drop_duplicates(subset=["screen_id"]).reset_index(drop=True)
+    poi_idx = res.pop("center_idx").to_numpy()
+    res["poi_name"] = [pois[i].get("name", "") for i in poi_idx]
+    res["poi_lat"]  = [pois[i].get("lat") for i in poi_idx]
+    res["poi_lon"]  = [pois[i].get("lon") for i in poi_idx]
+    res = res.reset_index(drop=True)
 
     LAST_RESULT = res
 
@@ -1685,7 +1819,8 @@ async def cmd_near_geo(m: types.Message):
 # ---------- базовые команды ----------
 @router.message(Command("start"))
 async def start_cmd(m: Message):
-    status = f"Экранов загружено: {len(SCREENS)}." if (SCREENS is not None and not SCREENS.empty) else "Экранов ещё нет — пришлите CSV/XLSX."
+    snap = inventory_snapshot.current()
+    status = f"Экранов загружено: {snap.rows}." if not snap.empty else "Экранов ещё нет — пришлите CSV/XLSX."
     await m.answer(
         "Привет! 💖 Я готова помочь с подбором экранов.\n"
         f"{status}\n\n"
@@ -1701,12 +1836,19 @@ async def ping_cmd(m: Message):
 @router.message(Command("cache_info"))
 async def cache_info(m: Message):
     try:
+        meta = _read_cache_meta()
         lines = [
             f"CACHE_DIR: {CACHE_DIR}",
             f"exists: {CACHE_DIR.exists()}",
             f"writable: {os.access(CACHE_DIR, os.W_OK)}",
+            f"CACHE_FEATHER exists: {CACHE_FEATHER.exists()} (pyarrow: {'✅' if pyarrow is not None else '❌'})",
             f"CACHE_CSV exists: {CACHE_CSV.exists()}",
             f"CACHE_META exists: {CACHE_META.exists()}",
+            f"detail cache: {_detail_cache().stats(DETAIL_CACHE_TTL_S) if _detail_cache() is not None else '—'}",
+            f"meta: format={meta.get('format', '—')}, schema={meta.get('schema_version', '—')}, rows={meta.get('rows', '—')}",
+            f"grid (mmap): {CACHE_GRID_DIR.exists()}, rows={(meta.get('grid') or {}).get('rows', '—')}, "
+            f"in use: {isinstance(getattr(inventory_snapshot.current().geo, 'lat_r', None), np.memmap)}",
+            f"snapshot: {inventory_snapshot.current().describe()}",
             f"diag: {_cache_diag()}",
         ]
         await m.answer("\n".join(lines))
@@ -1719,16 +1861,23 @@ async def cache_info(m: Message):
 async def cmd_status(m: types.Message):
     base = (OBDSP_BASE or "").strip()
     tok  = (OBDSP_TOKEN or "").strip()
-    screens_count = len(SCREENS) if SCREENS is not None else 0
+    snap = inventory_snapshot.current()
+    screens_count = snap.rows
     text = [
         "📊 *OmniDSP Bot Status*",
         f"• API Base: `{base or '—'}`",
         f"• Token: {'✅' if tok else '❌ отсутствует'}",
         f"• Загружено экранов: *{screens_count}*",
+        f"• Снимок инвентаря: {snap.describe()}",
     ]
-    if screens_count and "city" in SCREENS.columns:
+    attrs = snap.attrs
+    if screens_count and attrs is not None and attrs.has("city"):
+        # счётчики по городам — длины постингов индекса, без прохода по строкам
+        top = ", ".join(f"{c} ({k})" for c, k in attrs.top("city", 5))
+        text.append(f"• Городов: {attrs.distinct('city')}, крупнейшие: {top}")
+    elif screens_count and "city" in snap.df.columns:
         try:
-            sample_cities = ", ".join(SCREENS['city'].dropna().astype(str).unique()[:5])
+            sample_cities = ", ".join(str(c) for c in snap.df['city'].dropna().unique()[:5])
             text.append(f"• Пример городов: {sample_cities}")
         except Exception:
             pass
@@ -1759,7 +1908,7 @@ async def diag_whoami_force(m: types.Message):
         url = f"{base}/api/v1.0/users/current"
         headers = {"Authorization": f"Bearer {tok}", "Accept": "application/json"}
         timeout = aiohttp.ClientTimeout(total=20)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with http_client.client(timeout=timeout) as session:
             async with session.get(url, headers=headers, ssl=_make_ssl_param_for_aiohttp()) as resp:
                 text = await resp.text()
                 await m.answer(
@@ -1827,6 +1976,8 @@ async def cmd_sync_api(m: types.Message):
 
     # ots=1 -> enrich metadata.otsInfo.* via detail endpoint
     enrich_ots = _get_opt("ots", int, 0) == 1 or (_get_opt("enrich", str, "").strip().lower() in {"ots", "estimatedots"})
+    # ots_refresh=1 -> не доверять свежести кэша карточек, перепроверить все (условные GET)
+    ots_refresh = _get_opt("ots_refresh", int, 0) == 1
 
     # azimuth=<campaign_id1,campaign_id2> -> enrich azimuth from impression-inventory-stats
     azimuth_raw = _get_opt("azimuth", str, "").strip()
@@ -1843,6 +1994,13 @@ async def cmd_sync_api(m: types.Message):
     # azimuth_debug=1 -> dump first raw entry from impression-inventory-stats to chat
     azimuth_debug = _get_opt("azimuth_debug", int, 0) == 1
 
+    # delta=1 -> инкрементальный синк поверх кэша: с since=<param> (или SYNC_SINCE_PARAM) API отдаёт только
+    # изменённое после прошлого синка; без него сравниваем хэш каждой строки с прошлым синком по id и удаления
+    # видим по id. Во втором режиме страницы всё равно выкачиваются целиком — экономим только нормализацию и
+    # объём «изменённого», не сеть.
+    delta = _get_opt("delta", int, 0) == 1
+    since_param = _get_opt("since", str, "").strip() or SYNC_SINCE_PARAM
+
     raw_api = {}
     for p in parts:
         if p.startswith("api.") and "=" in p:
@@ -1859,29 +2017,111 @@ async def cmd_sync_api(m: types.Message):
     if enrich_ots: pretty.append("ots=1")
     if azimuth_campaign_ids: pretty.append(f"azimuth={','.join(str(c) for c in azimuth_campaign_ids)}")
     hint = (" (фильтры: " + ", ".join(pretty) + ")") if pretty else ""
+
+    sync_key = _sync_key(_build_server_query(filters), page_size)
+    prev_sync = _read_cache_meta().get("sync") or {}
+    base = inventory_snapshot.current().df
+    prev_rows = _read_sync_rows() if delta else None
+    if delta:
+        why = None
+        if enrich_ots or azimuth_campaign_ids:
+            why = "догрузкам ots=/azimuth= нужен полный список"
+        elif pages_limit is not None or total_limit is not None:
+            why = "с pages=/limit= не отличить удалённые экраны от необкачанных"
+        elif base is None or base.empty or "id" not in base.columns:
+            why = "в памяти нет инвентаря из API"
+        elif prev_sync.get("key") != sync_key or not prev_sync.get("ts"):
+            why = "прошлый синк был с другими фильтрами/size"
+        elif prev_rows is None and not since_param:
+            why = "нет хэшей строк прошлого синка"
+        if why:
+            await m.answer(f"ℹ️ delta=1: {why} — делаю полный синк.")
+            delta = False
+    if delta and since_param:
+        since_iso = datetime.fromtimestamp(float(prev_sync["ts"]), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        filters = {**filters, "api_params": {**raw_api, since_param: since_iso}}
+        hint += f" [delta: {since_param}={since_iso}]"
+    elif delta:
+        hint += " [delta: по хэшам строк]"
     await m.answer("⏳ Тяну инвентарь из внешнего API…" + hint)
 
+    # без догрузок нормализуем каждую страницу по приходу: сырой JSON не копится в памяти;
+    # догрузкам OTS/азимута нужны сырые items целиком — для них старый путь
+    stream = not enrich_ots and not azimuth_campaign_ids
+    started_ts = time.time()
+    row_hashes: dict[str, str] = {}
+    prev_rows = (prev_rows or {}) if delta else {}
+
+    def _process_page(page: int, content: list[dict]):
+        # сравнение по id, а не по номеру страницы: вставка/удаление в начале списка не «меняет» все страницы после
+        ids, fresh = [], []
+        for it in content:
+            key = it.get("id")
+            ids.append(key)
+            d = _row_digest(it)
+            if key is not None:
+                row_hashes[str(key)] = d
+            if key is None or prev_rows.get(str(key)) != d:
+                fresh.append(it)   # новая/изменённая строка (или без id — сопоставить не с чем)
+        return ids, (_normalize_api_to_df(fresh) if fresh else None)
+
+    async def _on_page(page: int, content: list[dict]):
+        # sha1 по JSON и нормализация — в пуле потоков: при параллельной выкачке страниц loop не блокируется
+        return await executors.run_io(_process_page, page, content)
+
     try:
-        items = await _fetch_inventories(
+        fetched = await _fetch_inventories(
             pages_limit=pages_limit,
             page_size=page_size,
             total_limit=total_limit,
             m=m,
             filters=filters,
+            on_page=_on_page if stream else None,
         )
     except Exception as e:
         logging.exception("sync_api failed")
         await m.answer(f"🚫 Не удалось синкнуть: {e}")
         return
 
-    if not items:
+    sync_state = None
+    changed = None
+    try:
+        if stream:
+            df = await executors.run_io(_concat_api_chunks, [chunk for _, chunk in fetched])
+            items = None
+            sync_state = {"key": sync_key, "ts": started_ts}
+            if delta and since_param:
+                row_hashes = {**prev_rows, **row_hashes}   # API отдал только изменённое — остальные хэши прежние
+            if delta:
+                changed = df
+                if since_param:
+                    deleted = set()
+                else:
+                    # строками с обеих сторон (как ключи row_hashes): dtype id в кэше не обязан совпадать с JSON
+                    deleted = _deleted_ids(base, (i for ids, _ in fetched for i in ids))
+                added = int((~_id_keys(changed["id"]).isin(_id_keys(base["id"]).dropna())).sum()) if not changed.empty else 0
+                sync_state["last_delta"] = {
+                    "mode": f"since:{since_param}" if since_param else "rows",
+                    "changed": int(len(changed)) - added,
+                    "added": added,
+                    "deleted": len(deleted),
+                    "deleted_ids": sorted(deleted, key=str)[:500],
+                }
+                df = await executors.run_io(_merge_delta, base, changed, deleted, replace_unkeyed=not since_param)
+        else:
+            df, items = None, fetched
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
+
+    if df is None and not items:
         await m.answer("API вернул пустой список.")
         return
 
     if enrich_ots:
         try:
             await m.answer("🧠 Догружаю OTS (metadata.otsInfo.estimatedOts) по каждому экрану…")
-            items = await _enrich_items_with_ots_info(items, m=m)
+            items = await _enrich_items_with_ots_info(items, m=m, refresh=ots_refresh)
         except Exception as e:
             logging.exception("enrich ots failed")
             await m.answer(f"⚠️ Догрузка OTS частично не удалась: {e}")
@@ -1894,22 +2134,44 @@ async def cmd_sync_api(m: types.Message):
             logging.exception("enrich azimuth failed")
             await m.answer(f"⚠️ Догрузка азимута частично не удалась: {e}")
 
-    df = _normalize_api_to_df(items)
+    if df is None:
+        try:
+            df = await executors.run_io(_normalize_api_to_df, items)
+        except executors.JobTimeout as e:
+            await m.answer(f"⏳ {e}")
+            return
+        items = None
     if df.empty:
         await m.answer("Список пришёл, но после нормализации пусто (проверь маппинг полей).")
         return
 
     # В память + кэш
-    global SCREENS
-    SCREENS = df
+    _set_screens(df, source="sync")
     try:
-        if save_screens_cache(df):
+        if save_screens_cache(df, sync=sync_state, row_hashes=row_hashes if sync_state is not None else None):
             await m.answer(f"💾 Кэш сохранён на диск: {len(df)} строк.")
         else:
             await m.answer("⚠️ Не удалось сохранить кэш на диск.")
     except Exception as e:
         await m.answer(f"⚠️ Ошибка при сохранении кэша: {e}")
 
+    if changed is not None:
+        st = sync_state["last_delta"]
+        if not changed.empty:
+            try:
+                await m.bot.send_document(
+                    m.chat.id,
+                    BufferedInputFile(changed.to_csv(index=False).encode("utf-8-sig"), filename="inventories_delta.csv"),
+                    caption=f"Изменённые/новые экраны: {len(changed)} (CSV)"
+                )
+            except Exception as e:
+                await m.answer(f"⚠️ Не удалось отправить CSV: {e}")
+        await m.answer(
+            f"✅ Дельта-синк ок: новых {st['added']}, изменено {st['changed']}, удалено {st['deleted']}. "
+            f"Всего экранов: {len(df)}."
+        )
+        return
+
     # Файлы пользователю
     try:
         csv_bytes = df.to_csv(index=False).encode("utf-8-sig")
@@ -1922,13 +2184,10 @@ async def cmd_sync_api(m: types.Message):
         await m.answer(f"⚠️ Не удалось отправить CSV: {e}")
 
     try:
-        xlsx_buf = io.BytesIO()
-        with pd.ExcelWriter(xlsx_buf, engine="openpyxl") as writer:
-            df.to_excel(writer, index=False, sheet_name="inventories")
-        xlsx_buf.seek(0)
+        xlsx_bytes = await executors.run_io(_xlsx_bytes, df, "inventories")
         await m.bot.send_document(
             m.chat.id,
-            BufferedInputFile(xlsx_buf.getvalue(), filename="inventories_sync.xlsx"),
+            BufferedInputFile(xlsx_bytes, filename="inventories_sync.xlsx"),
             caption=f"Инвентарь из API: {len(df)} строк (XLSX)"
         )
     except Exception as e:
@@ -1938,6 +2197,17 @@ async def cmd_sync_api(m: types.Message):
 
 
 # ---------- Enrich OTS info from detail endpoint ----------
+def _detail_cache() -> DetailCache | None:
+    """Ленивое открытие SQLite-кэша карточек; если диск недоступен — работаем без кэша."""
+    global _DETAIL_CACHE
+    if _DETAIL_CACHE is None:
+        try:
+            _DETAIL_CACHE = DetailCache(DETAIL_CACHE_PATH)
+        except Exception as e:
+            logging.warning(f"detail cache недоступен ({DETAIL_CACHE_PATH}): {e}")
+            return None
+    return _DETAIL_CACHE
+
 DETAIL_URL_TMPL = "https://proddsp.omniboard360.io/api/v1.0/clients/inventories/{inv_id}"
 
 async def _enrich_items_with_ots_info(
@@ -1945,12 +2215,17 @@ async def _enrich_items_with_ots_info(
     m: types.Message | None = None,
     concurrency: int = 12,
     timeout_s: int = 20,
+    refresh: bool = False,
 ) -> list[dict]:
-    import asyncio
-    import aiohttp
-    import random
-
-    sem = asyncio.Semaphore(concurrency)
+    """
+    Догружает otsInfo/outDoorAzimuth из детальной карточки каждого экрана.
+    Карточки кэшируются в SQLite (DETAIL_CACHE_PATH): свежие (моложе DETAIL_CACHE_TTL_S) берём без запроса,
+    протухшие перепроверяем условным GET по ETag/Last-Modified; refresh=True — перепроверить все.
+    concurrency — стартовая параллельность: дальше её ведёт AIMDLimiter (растёт, пока API отвечает быстро,
+    сжимается на 429/5xx), упавшие запросы повторяются с паузой (Retry-After, если сервер его прислал).
+    """
+    limiter = adaptive_http.AIMDLimiter(initial=concurrency, max_limit=max(concurrency, OTS_MAX_CONCURRENCY))
+    stats = adaptive_http.RunStats()
 
     def _extract_id(it: dict):
         v = it.get("id") or it.get("inventoryId") or it.get("inventory_id") or it.get("inventorId")
@@ -1980,53 +2255,79 @@ async def _enrich_items_with_ots_info(
         inv_id = _extract_id(it)
         if inv_id is not None:
             ids.append(inv_id)
+    ids = list(dict.fromkeys(ids))
 
-    total = len(ids)
+    cache = _detail_cache()
+    cached = await executors.run_io(cache.get_many, ids) if cache is not None else {}
+    now = time.time()
+    results: dict[int, dict] = {}
+    if not refresh:
+        for inv_id, entry in cached.items():
+            if entry.is_fresh(DETAIL_CACHE_TTL_S, now):
+                results[inv_id] = _extract_ots_info(entry.payload)
+    to_fetch = [i for i in ids if i not in results]
+
+    total = len(to_fetch)
     if m:
-        await m.answer(f"📌 Экранов для догрузки OTS: {total}")
+        await m.answer(f"📌 Экранов для догрузки OTS: {len(ids)} (из кэша: {len(results)}, запрашиваю: {total})")
+
+    fetched: dict[int, DetailEntry] = {}
+    revalidated: list[int] = []
+    stale_used = 0
 
     async def _fetch_one(session: aiohttp.ClientSession, inv_id: int):
-        url = root.format(inv_id=inv_id)
-        async with sem:
-            # небольшой джиттер, чтобы не бить API ровными очередями
-            await asyncio.sleep(random.random() * 0.05)
-            try:
-                async with session.get(url, headers=headers, ssl=ssl_param, timeout=aiohttp.ClientTimeout(total=timeout_s)) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        return inv_id, _extract_ots_info(data), None
-
-                    # мягкая обработка rate limit / временных ошибок
-                    txt = await resp.text()
-                    if resp.status in (429, 500, 502, 503, 504):
-                        return inv_id, None, f"retryable HTTP {resp.status}: {txt[:120]}"
-                    return inv_id, None, f"HTTP {resp.status}: {txt[:120]}"
-            except Exception as e:
-                return inv_id, None, str(e)
+        nonlocal stale_used
+        entry = cached.get(inv_id)
+        res = await adaptive_http.fetch_json(
+            session, root.format(inv_id=inv_id),
+            limiter=limiter, stats=stats,
+            headers={**headers, **entry.validators()} if entry else headers,
+            ssl=ssl_param, timeout_s=timeout_s, retries=OTS_RETRIES,
+        )
+        if res.data is not None:
+            fetched[inv_id] = DetailEntry(res.data, time.time(), res.headers.get("etag"), res.headers.get("last-modified"))
+            return inv_id, _extract_ots_info(res.data), None
+        if entry is not None and res.status == 304:
+            revalidated.append(inv_id)
+            return inv_id, _extract_ots_info(entry.payload), None
+        if entry is not None and (res.status == 0 or res.status in adaptive_http.RETRYABLE_HTTP):
+            # API перегружен/недоступен — лучше протухшая карточка, чем дыра
+            stale_used += 1
+            return inv_id, _extract_ots_info(entry.payload), None
+        return inv_id, None, res.error
+
+    async def _flush():
+        if cache is None or not (fetched or revalidated):
+            return
+        batch, touched = dict(fetched), list(revalidated)
+        fetched.clear(); revalidated.clear()
+        try:
+            await executors.run_io(cache.put_many, batch)
+            await executors.run_io(cache.touch_many, touched)
+        except Exception as e:
+            logging.warning(f"detail cache: запись не удалась: {e}")
 
-    results: dict[int, dict] = {}
     errors = 0
-    retryable = 0
 
-    timeout = aiohttp.ClientTimeout(total=max(180, timeout_s))
-    connector = aiohttp.TCPConnector(limit=concurrency * 2, ssl=False)
+    timeout = aiohttp.ClientTimeout(total=None)
 
-    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-        tasks = [_fetch_one(session, inv_id) for inv_id in ids]
+    async with http_client.client(timeout=timeout) as session:
+        tasks = [_fetch_one(session, inv_id) for inv_id in to_fetch]
         done = 0
         for coro in asyncio.as_completed(tasks):
             inv_id, ots_info, err = await coro
             if ots_info is None:
                 errors += 1
-                if err and err.startswith("retryable"):
-                    retryable += 1
                 results[inv_id] = {"estimatedOts": None, "interpolatedOts": None, "sspOts": None}
             else:
                 results[inv_id] = ots_info
 
             done += 1
+            if len(fetched) >= 1000:
+                await _flush()
             if m and done % 200 == 0:
-                await m.answer(f"…OTS: {done}/{total} (ошибок: {errors}, из них ретраебл: {retryable})")
+                await m.answer(f"…OTS: {done}/{total} (ошибок: {errors}, параллельность: {int(limiter.limit)})")
+    await _flush()
 
     # merge back to items
     for it in items:
@@ -2045,8 +2346,13 @@ async def _enrich_items_with_ots_info(
             if it.get("azimuth") is None:
                 it["azimuth"] = info.get("outDoorAzimuth")
 
+    logging.info(f"OTS enrichment: {len(ids) - total} из кэша, протухших вместо ошибки {stale_used} | {stats.summary(limiter)}")
     if m:
-        await m.answer(f"✅ OTS догружен. Ошибок: {errors}/{total} (ретраебл: {retryable})")
+        await m.answer(
+            f"✅ OTS догружен. Ошибок: {errors}/{total}, из кэша: {len(ids) - total}"
+            + (f", устаревших вместо ошибки: {stale_used}" if stale_used else "")
+            + f"\n{stats.summary(limiter)}"
+        )
 
     return items
 
@@ -2066,7 +2372,7 @@ async def _enrich_items_with_azimuth(
     tok = OBDSP_STATS_TOKEN or OBDSP_TOKEN
     headers = {"Authorization": f"Bearer {tok}", "Accept": "application/json"}
     ssl_param = _make_ssl_param_for_aiohttp()
-    timeout = aiohttp.ClientTimeout(total=180)
+    timeout = aiohttp.ClientTimeout(total=None)
 
     azimuth_map: dict[int, Any] = {}
 
@@ -2084,52 +2390,72 @@ async def _enrich_items_with_azimuth(
         # 3. inventory.azimuth (direct field)
         return inv.get("azimuth")
 
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        for cid in campaign_ids:
-            url = f"{base}/api/v1.0/clients/campaigns/{cid}/impression-inventory-stats"
-            page = 0
-            first_page = True
-            while True:
-                params: dict[str, Any] = {"page": page, "size": page_size}
-                try:
-                    async with session.get(url, headers=headers, params=params, ssl=ssl_param) as resp:
-                        if resp.status != 200:
-                            txt = await resp.text()
-                            if m:
-                                try: await m.answer(f"⚠️ Кампания {cid}: HTTP {resp.status}: {txt[:120]}")
-                                except: pass
-                            break
-                        data = await resp.json()
-                except Exception as e:
-                    if m:
-                        try: await m.answer(f"⚠️ Кампания {cid}: ошибка: {e}")
-                        except: pass
-                    break
+    # все кампании и их страницы делят один бюджет параллельности
+    limiter = adaptive_http.AIMDLimiter(initial=AZIMUTH_CONCURRENCY, max_limit=AZIMUTH_CONCURRENCY)
+    stats = adaptive_http.RunStats()
+    pages_by_campaign: dict[int, dict[int, list]] = {cid: {} for cid in campaign_ids}
 
-                if isinstance(data, list):
-                    page_items = data
-                    is_last = True
-                else:
-                    page_items = data.get("content") or []
-                    is_last = data.get("last", True)
-
-                # debug: dump first entry's raw JSON so we can see the real field path
-                if debug and first_page and page_items and m:
-                    sample = json.dumps(page_items[0], ensure_ascii=False, indent=2)[:1500]
-                    try: await m.answer(f"🔍 Пример записи (кампания {cid}):\n<pre>{sample}</pre>", parse_mode="HTML")
-                    except: pass
-                first_page = False
-
-                for entry in page_items:
-                    inv = entry.get("inventory") or {}
-                    inv_id = inv.get("id")
-                    azimuth = _extract_azimuth(entry)
-                    if inv_id is not None:
-                        azimuth_map[int(inv_id)] = azimuth
-
-                if is_last or not page_items:
-                    break
-                page += 1
+    async def _warn(text: str):
+        if m:
+            try: await m.answer(text)
+            except: pass
+
+    async def _page(session: aiohttp.ClientSession, cid: int, page: int):
+        url = f"{base}/api/v1.0/clients/campaigns/{cid}/impression-inventory-stats?page={page}&size={page_size}"
+        res = await adaptive_http.fetch_json(
+            session, url, limiter=limiter, stats=stats, headers=headers, ssl=ssl_param, timeout_s=60,
+        )
+        if res.data is None:
+            await _warn(f"⚠️ Кампания {cid}, страница {page}: {res.error}")
+        return res.data
+
+    async def _campaign(session: aiohttp.ClientSession, cid: int):
+        data = await _page(session, cid, 0)
+        if data is None:
+            return
+        page_items = data if isinstance(data, list) else (data.get("content") or [])
+        pages_by_campaign[cid][0] = page_items
+
+        # debug: dump first entry's raw JSON so we can see the real field path
+        if debug and page_items and m:
+            sample = json.dumps(page_items[0], ensure_ascii=False, indent=2)[:1500]
+            try: await m.answer(f"🔍 Пример записи (кампания {cid}):\n<pre>{sample}</pre>", parse_mode="HTML")
+            except: pass
+
+        if isinstance(data, list) or data.get("last", True) or not page_items:
+            return
+        if data.get("totalPages") is not None:
+            rest = range(1, int(data["totalPages"]))
+            got = await asyncio.gather(*[_page(session, cid, p) for p in rest])
+            for p, d in zip(rest, got):
+                if d is not None:
+                    pages_by_campaign[cid][p] = (d if isinstance(d, list) else d.get("content")) or []
+            return
+        # totalPages нет — листаем по одной
+        page = 0
+        while True:
+            page += 1
+            d = await _page(session, cid, page)
+            if d is None:
+                return
+            page_items = (d if isinstance(d, list) else d.get("content")) or []
+            pages_by_campaign[cid][page] = page_items
+            if isinstance(d, list) or d.get("last", True) or not page_items:
+                return
+
+    async with http_client.client(timeout=timeout) as session:
+        await asyncio.gather(*[_campaign(session, cid) for cid in campaign_ids])
+
+    # склейка в исходном порядке кампаний и страниц: при пересечении побеждает последняя кампания, как раньше
+    for cid in campaign_ids:
+        pages = pages_by_campaign[cid]
+        for page in sorted(pages):
+            for entry in pages[page]:
+                inv = entry.get("inventory") or {}
+                inv_id = inv.get("id")
+                if inv_id is not None:
+                    azimuth_map[int(inv_id)] = _extract_azimuth(entry)
+    logging.info(f"azimuth enrichment ({len(campaign_ids)} кампаний): {stats.summary(limiter)}")
 
     if m:
         filled = sum(1 for v in azimuth_map.values() if v is not None)
@@ -2237,13 +2563,10 @@ async def cmd_shots(m: types.Message):
             await m.answer(f"⚠️ Не удалось отправить CSV: {e}")
 
         try:
-            xbuf = io.BytesIO()
-            with pd.ExcelWriter(xbuf, engine="openpyxl") as w:
-                df.to_excel(w, index=False, sheet_name="shots")
-            xbuf.seek(0)
+            xlsx_bytes = await executors.run_io(_xlsx_bytes, df, "shots")
             await m.bot.send_document(
                 m.chat.id,
-                BufferedInputFile(xbuf.getvalue(), filename=f"shots_{campaign_id}.xlsx"),
+                BufferedInputFile(xlsx_bytes, filename=f"shots_{campaign_id}.xlsx"),
                 caption=f"Фотоотчёт кампании {campaign_id}: {len(df)} строк (XLSX)"
             )
         except Exception as e:
@@ -2261,7 +2584,7 @@ async def cmd_shots(m: types.Message):
 
         zip_buf = io.BytesIO()
         import zipfile
-        async with aiohttp.ClientSession(timeout=timeout) as session, zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        async with http_client.client(timeout=timeout) as session, zipfile.ZipFile(zip_buf, "w", zipfile.ZIP_DEFLATED) as zf:
             sem = asyncio.Semaphore(8)
             async def grab(i, url):
                 async with sem:
@@ -2315,8 +2638,11 @@ async def cmd_forecast(m: types.Message):
     if hours_per_day is None:
         hours_per_day = (win_hours if (win_hours is not None) else 8)
 
-    base = LAST_RESULT.copy()
-    base = _fill_min_bid(base)
+    try:
+        base = (await run_query(screen_query.ScreenQuery(min_bid=True), df=LAST_RESULT)).frame
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
     mb_valid = pd.to_numeric(base["min_bid_used"], errors="coerce").dropna()
     if mb_valid.empty:
         await m.answer("Не удалось оценить ставку: ни у одного экрана нет minBid (и нечего подставить).")
@@ -2335,7 +2661,7 @@ async def cmd_forecast(m: types.Message):
 
     per_screen = _distribute_slots_evenly(n_screens, total_slots)
 
-    base = base.reset_index(drop=True)
+    base.reset_index(drop=True, inplace=True)   # base — уже своя копия (min_bid), второй не нужно
     base["planned_slots"] = per_screen
     base["planned_cost"]  = base["planned_slots"] * pd.to_numeric(base["min_bid_used"], errors="coerce").fillna(avg_min)
 
@@ -2359,13 +2685,10 @@ async def cmd_forecast(m: types.Message):
         await m.answer(f"⚠️ Не удалось отправить CSV: {e}")
 
     try:
-        xbuf = io.BytesIO()
-        with pd.ExcelWriter(xbuf, engine="openpyxl") as w:
-            plan_df.to_excel(w, index=False, sheet_name="forecast")
-        xbuf.seek(0)
+        xlsx_bytes = await executors.run_io(_xlsx_bytes, plan_df, "forecast")
         await m.bot.send_document(
             m.chat.id,
-            BufferedInputFile(xbuf.getvalue(), filename=f"forecast_{LAST_SELECTION_NAME}.xlsx"),
+            BufferedInputFile(xlsx_bytes, filename=f"forecast_{LAST_SELECTION_NAME}.xlsx"),
             caption=f"Прогноз (подробно): дни={days}, часы/день={hours_per_day}, max {MAX_PLAYS_PER_HOUR}/час"
         )
     except Exception as e:
@@ -2382,42 +2705,12 @@ def _priority_mask_by_formats(df: pd.DataFrame, tokens: list[str]) -> pd.DataFra
     """Оставить в df только строки, у которых format попадает в tokens (учёт CITY алиасов)."""
     if "format" not in df.columns or not tokens:
         return df.copy()
-    col = df["format"].astype(str).str.upper()
-    mask = None
-    for tok in tokens:
-        if tok.lower() in {"city","city_format","cityformat","citylight","гид","гиды"}:
-            m = col.str.startswith("CITY_FORMAT")
-        else:
-            m = (col == tok.upper())
-        mask = m if mask is None else (mask | m)
-    return df[mask].copy()
-
-def _prefer_formats(df: pd.DataFrame, n: int) -> pd.DataFrame:
-    """Если формат не задан пользователем: сначала BILLBOARD, потом SUPERSITE, потом CITY_FORMAT*, затем остальное.
-       Возвращает пул из не более n*3-4 строк (чтобы было из чего равномерно выбирать)."""
-    if "format" not in df.columns or df.empty:
-        return df
-    wanted = []
-    # 1) BILLBOARD
-    bb = df[df["format"].astype(str).str.upper().eq("BILLBOARD")]
-    wanted.append(bb)
-    # 2) SUPERSITE
-    ss = df[df["format"].astype(str).str.upper().eq("SUPERSITE")]
-    wanted.append(ss)
-    # 3) CITY_*
-    cc = df[df["format"].astype(str).str.upper().str.startswith("CITY_FORMAT")]
-    wanted.append(cc)
-    # 4) Остальное
-    other = df[~df.index.isin(pd.concat(wanted, ignore_index=False).index)]
-    wanted.append(other)
-    # склеим, но чуть ограничим размер, чтобы spread_select работал шустрее
-    pool = pd.concat(wanted, ignore_index=True)
-    return pool.head(max(n * 5, n))  # небольшой запас
+    return df[inventory_prep.format_mask(df["format"], tokens)].copy()
 
 @router.message(Command("plan"))
 async def cmd_plan(m: types.Message):
-    global SCREENS
-    if SCREENS is None or SCREENS.empty:
+    snap = inventory_snapshot.current()
+    if snap.empty:
         await m.answer("Сначала загрузите инвентарь (CSV/XLSX) или выполните /sync_api.")
         return
 
@@ -2484,31 +2777,24 @@ async def cmd_plan(m: types.Message):
     )
 
     # ---- формируем пул ----
-    pool = SCREENS.copy()
-
-    # По городу
-    if city and "city" in pool.columns:
-        pool = pool[pool["city"].astype(str).str.strip().str.lower() == city.strip().lower()]
+    # город/формат/владелец/пороги → minBid → (без format) приоритет BB→SUPERSITE→CITY→остальные с запасом
+    q = screen_query.ScreenQuery(
+        city=city, formats=tuple(formats), owners=tuple(owners), grp_min=grp_min, ots_min=ots_min,
+        min_bid=True, prefer_formats=True, strategy="top_ots" if want_top else "spread", n=n,
+        random_start=True, seed=None,
+    )
+    try:
+        found = await run_query(q, snap)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
+    pool = found.frame
 
-    if pool.empty:
+    if found.empty_at == "city":
         await m.answer("По заданному городу нет экранов (с учётом вводных).")
         return
 
-    # Собираем kwargs для apply_filters
-    filter_kwargs: dict[str, str] = {}
-    if formats:
-        filter_kwargs["format"] = ",".join(formats)
-    if owners:
-        filter_kwargs["owner"] = ",".join(owners)
-    if grp_min is not None:
-        filter_kwargs["grp_min"] = str(grp_min)
-    if ots_min is not None:
-        filter_kwargs["ots_min"] = str(ots_min)
-
-    if filter_kwargs:
-        pool = apply_filters(pool, filter_kwargs)
-
-    if pool.empty:
+    if pool.empty and found.empty_at != "prefer":
         pieces = []
         if formats: pieces.append(f"format={','.join(formats)}")
         if owners:  pieces.append(f"owner={','.join(owners)}")
@@ -2518,29 +2804,16 @@ async def cmd_plan(m: types.Message):
         await m.answer("После применения фильтров экранов не осталось" + hint + ".")
         return
 
-    # minBid обогащение
-    pool = _fill_min_bid(pool)
-
-    # Если формат не указан — предпочтём BB→SUPERSITE→CITY→остальные (с запасом)
-    if not formats:
-        pool = _prefer_formats(pool, n)
-
     if pool.empty:
         await m.answer("После приоритезации форматов экранов не осталось.")
         return
 
     # ---- выбор экранов: top по OTS (если просили) или равномерно ----
-    if want_top and "ots" in pool.columns:
-        try:
-            ots_vals = pd.to_numeric(pool["ots"], errors="coerce")
-            if ots_vals.dropna().empty:
-                raise ValueError("empty ots")
-            pool = pool.assign(_ots=ots_vals).sort_values("_ots", ascending=False)
-            selected = pool.head(n).drop(columns=["_ots"])
-        except Exception:
-            selected = spread_select(pool.reset_index(drop=True), n, random_start=True, seed=None)
-    else:
-        selected = spread_select(pool.reset_index(drop=True), n, random_start=True, seed=None)
+    try:
+        selected = await run_select(pool, q)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
 
     if selected.empty:
         await m.answer("Не удалось выбрать экраны (слишком строгие ограничения?).")
@@ -2574,7 +2847,7 @@ async def cmd_plan(m: types.Message):
     total_slots = slots_per_day * int(days)
     planned_cost = total_slots * mb
 
-    out = selected.copy()
+    out = selected   # свежая выборка из select() (n строк), не общий инвентарь — дописываем колонки прямо в неё
     out["budget_per_day"] = round(budget_per_day_per_screen, 2)
     out["min_bid_used"] = mb
     out["planned_slots_per_day"] = slots_per_day
@@ -2603,13 +2876,10 @@ async def cmd_plan(m: types.Message):
         await m.answer(f"⚠️ Не удалось отправить CSV: {e}")
 
     try:
-        xbuf = io.BytesIO()
-        with pd.ExcelWriter(xbuf, engine="openpyxl") as w:
-            out.to_excel(w, index=False, sheet_name="plan")
-        xbuf.seek(0)
+        xlsx_bytes = await executors.run_io(_xlsx_bytes, out, "plan")
         await m.bot.send_document(
             m.chat.id,
-            BufferedInputFile(xbuf.getvalue(), filename="plan.xlsx"),
+            BufferedInputFile(xlsx_bytes, filename="plan.xlsx"),
             caption="План (XLSX)"
         )
     except Exception as e:
@@ -2631,8 +2901,9 @@ async def set_radius(m: types.Message):
 
 @router.message(Command("near"))
 async def cmd_near(m: types.Message):
-    global LAST_RESULT, SCREENS
-    if SCREENS is None or SCREENS.empty:
+    global LAST_RESULT
+    snap = inventory_snapshot.current()
+    if snap.empty:
         await m.answer("Сначала загрузите файл экранов (CSV/XLSX) или /sync_api.")
         return
 
@@ -2657,7 +2928,11 @@ async def cmd_near(m: types.Message):
         await m.answer("Пример: /near 55.714349 37.553834 2 fields=screen_id")
         return
 
-    res = find_within_radius(SCREENS, (lat, lon), radius)
+    try:
+        res = (await run_query(screen_query.ScreenQuery(center=(lat, lon), radius_km=radius), snap)).frame
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
     if res is None or res.empty:
         await m.answer(f"В радиусе {radius} км ничего не найдено.")
         return
@@ -2733,14 +3008,15 @@ async def pick_city(m: types.Message):
     /pick_city Город N [format=...] [owner=...] [shuffle=1] [fixed=1] [seed=42]
 
     - выбирает N экранов в заданном городе (равномерно spread_select)
-    - может фильтровать по format/owner/другим полям через apply_filters
+    - может фильтровать по format/owner/grp_min/ots_min (запрос через screen_query)
     - при успешном выполнении отправляет ТОЛЬКО XLSX с колонкой screen_id
     """
 
-    global LAST_RESULT, SCREENS
+    global LAST_RESULT
 
-    # 1. Проверяем, что инвентарь загружен
-    if SCREENS is None or SCREENS.empty:
+    # 1. Берём текущий снимок инвентаря (до конца запроса — он, даже если параллельно пришёл /sync_api)
+    snap = inventory_snapshot.current()
+    if snap.empty:
         await m.answer("Сначала загрузите инвентарь (CSV/XLSX или /sync_api).")
         return
 
@@ -2777,34 +3053,35 @@ async def pick_city(m: types.Message):
         return
 
     # 3. Проверяем наличие столбца city
-    if "city" not in SCREENS.columns:
+    if "city" not in snap.df.columns:
         await m.answer("В данных нет столбца city. Используйте /near или /sync_api с нормализацией.")
         return
 
-    # 4. Фильтрация по городу и дополнительным фильтрам
-    subset = SCREENS[
-        SCREENS["city"].astype(str).str.strip().str.lower()
-        == city.strip().lower()
-    ]
-
-    if kwargs:
-        subset = apply_filters(subset, kwargs) if not subset.empty else subset
+    # 4. Фильтрация по городу и дополнительным фильтрам (город/формат/владелец — по индексу атрибутов)
+    q = screen_query.ScreenQuery(
+        city=city,
+        formats=tuple(parse_list(kwargs.get("format") or kwargs.get("formats") or kwargs.get("format_in") or "")),
+        owners=tuple(parse_list(kwargs.get("owner") or kwargs.get("owners") or kwargs.get("owner_in") or "")),
+        grp_min=_parse_threshold(kwargs.get("grp_min") or kwargs.get("min_grp")),
+        ots_min=_parse_threshold(kwargs.get("ots_min") or kwargs.get("min_ots")),
+        strategy="spread", n=n, shuffle=shuffle_flag, random_start=not fixed, seed=seed,
+    )
+    try:
+        subset = (await run_query(q, snap)).frame
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
 
     if subset.empty:
         await m.answer(f"Не нашёл экранов в городе: {city} (с учётом фильтров).")
         return
 
-    # 5. Перемешивание перед spread_select (если нужно)
-    if shuffle_flag:
-        subset = subset.sample(frac=1, random_state=None).reset_index(drop=True)
-
-    # 6. Основной выбор экранов
-    res = spread_select(
-        subset.reset_index(drop=True),
-        n,
-        random_start=not fixed,
-        seed=seed,
-    )
+    # 5–6. Перемешивание (shuffle=1) и основной выбор экранов (в пуле процессов, чтобы не блокировать бота)
+    try:
+        res = await run_select(subset, q)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
     LAST_RESULT = res
 
     # 7. Никакого текстового списка — сразу шлём файл с screen_id
@@ -2815,123 +3092,13 @@ async def pick_city(m: types.Message):
         caption=f"GID по городу «{city}» (XLSX)",
     )
 
-# ---------- pick_at ----------
-def parse_mix(val: str) -> list[tuple[str, str]]:
-    if not isinstance(val, str) or not val.strip():
-        return []
-    s = val.replace("|", ",").replace(";", ",")
-    items = []
-    for part in s.split(","):
-        part = part.strip()
-        if not part or ":" not in part:
-            continue
-        token, v = part.split(":", 1)
-        items.append((token.strip(), v.strip()))
-    return items
-
-def _allocate_counts(total_n: int, mix_items: list[tuple[str, str]]) -> list[tuple[str, int]]:
-    fixed: list[tuple[str, int]] = []
-    perc:  list[tuple[str, float]] = []
-    for token, v in mix_items:
-        if v.endswith("%"):
-            try: perc.append((token, float(v[:-1])))
-            except: pass
-        else:
-            try: fixed.append((token, int(v)))
-            except: pass
-    fixed_sum = sum(cnt for _, cnt in fixed)
-    remaining = max(0, total_n - fixed_sum)
-    out: list[tuple[str, int]] = fixed[:]
-    if remaining > 0 and perc:
-        p_total = sum(p for _, p in perc) or 1.0
-        raw = [(tok, remaining * p / p_total) for tok, p in perc]
-        base = [(tok, int(x)) for tok, x in raw]
-        used = sum(cnt for _, cnt in base)
-        rem  = remaining - used
-        fracs = sorted(((x - int(x), tok) for tok, x in raw), reverse=True)
-        extra: dict[str,int] = {}
-        for i in range(rem):
-            _, tok = fracs[i % len(fracs)]
-            extra[tok] = extra.get(tok, 0) + 1
-        for tok, cnt in base:
-            out.append((tok, cnt + extra.get(tok, 0)))
-    total = sum(cnt for _, cnt in out)
-    if total > total_n:
-        delta = total - total_n
-        trimmed = []
-        for tok, cnt in out:
-            take = max(0, cnt - delta)
-            delta -= (cnt - take)
-            trimmed.append((tok, take))
-            if delta <= 0:
-                trimmed.extend(out[len(trimmed):])
-                break
-        out = trimmed
-    return out
-
-def _select_with_mix(df_city: pd.DataFrame, n: int, mix_arg: str | None,
-                     *, random_start: bool = True, seed: int | None = None) -> pd.DataFrame:
-    if not mix_arg:
-        return spread_select(df_city.reset_index(drop=True), n, random_start=random_start, seed=seed)
-    items = parse_mix(mix_arg)
-    if not items:
-        return spread_select(df_city.reset_index(drop=True), n, random_start=random_start, seed=seed)
-
-    allowed_tokens = [tok for tok, _ in items]
-
-    if "format" not in df_city.columns:
-        base_pool = df_city.copy()
-    else:
-        mask_allowed = None
-        col = df_city["format"]
-        for tok in allowed_tokens:
-            m = _format_mask(col, tok)
-            mask_allowed = m if mask_allowed is None else (mask_allowed | m)
-        base_pool = df_city[mask_allowed] if mask_allowed is not None else df_city.copy()
-
-    if base_pool.empty:
-        return spread_select(df_city.reset_index(drop=True), n, random_start=random_start, seed=seed)
-
-    targets = _allocate_counts(n, items)
-    selected_parts: list[pd.DataFrame] = []
-    used_ids: set[str] = set()
-    pool = base_pool.copy()
-
-    for token, need in targets:
-        if need <= 0 or pool.empty:
-            continue
-        mask = _format_mask(pool["format"], token) if "format" in pool.columns else pd.Series([True]*len(pool), index=pool.index)
-        subset = pool[mask]
-        if subset.empty:
-            continue
-        pick_n = min(need, len(subset))
-        picked = spread_select(subset.reset_index(drop=True), pick_n, random_start=random_start, seed=seed)
-        selected_parts.append(picked)
-
-        if "screen_id" in pool.columns and "screen_id" in picked.columns:
-            chosen_ids = _extract_screen_ids(picked)
-            used_ids.update(chosen_ids)
-            pool = pool[~pool["screen_id"].astype(str).isin(used_ids)]
-        else:
-            coords = set((float(a), float(b)) for a, b in picked[["lat","lon"]].itertuples(index=False, name=None))
-            pool = pool[~((pool["lat"].astype(float).round(7).isin([x for x, _ in coords])) &
-                          (pool["lon"].astype(float).round(7).isin([y for _, y in coords])))]
-        if pool.empty:
-            break
-
-    combined = pd.concat(selected_parts, ignore_index=True) if selected_parts else base_pool.iloc[0:0]
-    remain = n - len(combined)
-    if remain > 0 and not pool.empty:
-        extra = spread_select(pool.reset_index(drop=True), min(remain, len(pool)), random_start=random_start, seed=seed)
-        combined = pd.concat([combined, extra], ignore_index=True)
-    return combined.head(n)
-
 # ---------- pick_at ----------
 
 @router.message(Command("pick_at"))
 async def pick_at(m: types.Message):
-    global LAST_RESULT, SCREENS
-    if SCREENS is None or SCREENS.empty:
+    global LAST_RESULT
+    snap = inventory_snapshot.current()
+    if snap.empty:
         await m.answer("Сначала загрузите файл экранов (CSV/XLSX) или /sync_api.")
         return
 
@@ -2954,40 +3121,31 @@ async def pick_at(m: types.Message):
         await m.answer("Пример: /pick_at 55.75 37.62 30 15 format=BILLBOARD")
         return
 
-    # 1. Базовый круг по радиусу
-    circle = find_within_radius(SCREENS, (lat, lon), radius)
-    if circle.empty:
-        await m.answer(f"В радиусе {radius} км нет экранов.")
+    # 1–2. Круг по радиусу и format=... (несколько токенов через , ; | — как в mix) — одним запросом
+    q = screen_query.ScreenQuery(
+        center=(lat, lon), radius_km=radius, formats=tuple(parse_list(str(fmt_arg or ""))),
+        strategy="mix", n=n, mix=mix_arg, random_start=not fixed, seed=seed,
+    )
+    try:
+        found = await run_query(q, snap)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
         return
-
-    # 2. Если передан format=..., явно отфильтруем по формату
-    if fmt_arg and "format" in circle.columns:
-        # поддержим несколько токенов, через , ; |, как в mix
-        raw = str(fmt_arg)
-        tokens = [t.strip() for t in raw.replace("|", ",").replace(";", ",").split(",") if t.strip()]
-        if tokens:
-            col = circle["format"].astype(str)
-            mask = None
-            for tok in tokens:
-                # если у тебя есть _format_mask — используем её,
-                # чтобы совпадало поведение с mix / _select_with_mix
-                m_tok = _format_mask(col, tok)
-                mask = m_tok if mask is None else (mask | m_tok)
-            if mask is not None:
-                circle = circle[mask]
-
+    circle = found.frame
     if circle.empty:
-        await m.answer(f"В радиусе {radius} км нет экранов с форматом {fmt_arg!r}.")
+        # атрибуты фильтруются до радиуса, поэтому empty_at == "radius" и тогда, когда формат есть, но не в круге
+        if q.formats:
+            await m.answer(f"В радиусе {radius} км нет экранов с форматом {fmt_arg!r}.")
+        else:
+            await m.answer(f"В радиусе {radius} км нет экранов.")
         return
 
     # 3. Выбор с mix (если указан) или обычный spread_select
-    res = _select_with_mix(
-        circle.reset_index(drop=True),
-        n,
-        mix_arg,
-        random_start=not fixed,
-        seed=seed,
-    )
+    try:
+        res = await run_select(circle, q)
+    except executors.JobTimeout as e:
+        await m.answer(f"⏳ {e}")
+        return
     LAST_RESULT = res
 
     # 4. Текстовый список (как был) + GID-файл
@@ -3019,13 +3177,10 @@ async def pick_at(m: types.Message):
 # ---------- Export last ----------
 async def send_gid_xlsx(chat_id: int, ids: list[str], *, filename: str = "screen_ids.xlsx", caption: str = "GID список (XLSX)"):
     df = pd.DataFrame({"GID": [str(x) for x in ids]})
-    bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False)
-    bio.seek(0)
+    xlsx_bytes = await executors.run_io(_xlsx_bytes, df)
     await bot.send_document(
         chat_id,
-        BufferedInputFile(bio.read(), filename=filename),
+        BufferedInputFile(xlsx_bytes, filename=filename),
         caption=caption,
     )
 
@@ -3100,17 +3255,16 @@ async def on_file(m: types.Message):
             if col not in df.columns:
                 df[col] = ""
 
-        global SCREENS
-        SCREENS = df[["screen_id","name","lat","lon","city","format","owner"]].reset_index(drop=True)
+        snap = _set_screens(df[["screen_id","name","lat","lon","city","format","owner"]].reset_index(drop=True), source="file")
 
         # сохранить кэш
         try:
-            save_screens_cache(SCREENS)
+            save_screens_cache(snap.df)
         except Exception:
             pass
 
         await m.answer(
-            f"Загружено экранов: {len(SCREENS)}.\n"
+            f"Загружено экранов: {snap.rows}.\n"
             "Теперь можно: отправить геолокацию 📍, /near lat lon [R], /pick_city Город N, /pick_at lat lon N [R]."
         )
     except Exception as e:
@@ -3165,31 +3319,7 @@ def _parse_int(s: str) -> int | None:
     return int(m.group(1)) if m else None
 
 def _normalize_city_token(raw: str) -> str:
-    t = (raw or "").strip(" .,!?:;\"'()").lower()
-    t = re.sub(r"^(?:город|г\.)\s+", "", t)
-    specials = {
-        "мск": "Москва", "москва": "Москва", "в москве": "Москва", "по москве": "Москва", "из москвы": "Москва", "москве": "Москва",
-        "спб": "Санкт-Петербург", "питер": "Санкт-Петербург", "питере": "Санкт-Петербург",
-        "санкт-петербург": "Санкт-Петербург", "санкт петербург": "Санкт-Петербург",
-        "санкт-петербурге": "Санкт-Петербург", "санкт петербурге": "Санкт-Петербург",
-        "петербург": "Санкт-Петербург", "в спб": "Санкт-Петербург", "в питере": "Санкт-Петербург",
-        "казань": "Казань", "в казани": "Казань", "казани": "Казань",
-        "новосибирск": "Новосибирск", "в новосибирске": "Новосибирск", "новосибирске": "Новосибирск",
-        "екатеринбург": "Екатеринбург", "в екатеринбурге": "Екатеринбург", "екатеринбурге": "Екатеринбург",
-        "нижний новгород": "Нижний Новгород", "в нижнем новгороде": "Нижний Новгород", "нижнем новгороде": "Нижний Новгород",
-        "тверь": "Тверь", "в твери": "Тверь", "твери": "Тверь",
-        "самара": "Самара", "в самаре": "Самара", "самаре": "Самара",
-        "ростов-на-дону": "Ростов-на-Дону", "в ростове-на-дону": "Ростов-на-Дону", "ростове-на-дону": "Ростов-на-Дону",
-        "воронеж": "Воронеж", "в воронеже": "Воронеж", "воронеже": "Воронеж",
-        "пермь": "Пермь", "в перми": "Пермь", "перми": "Пермь",
-        "уфа": "Уфа", "в уфе": "Уфа", "уфе": "Уфа",
-    }
-    if t in specials:
-        return specials[t]
-    if t.endswith("е") and len(t) >= 4:
-        t = t[:-1] + "а"
-    t = re.sub(r"\s{2,}", " ", t).strip()
-    return t.capitalize() if t else ""
+    return city_bbox.normalize_city_token(raw)
 
 def _extract_city(text: str) -> str | None:
     m = re.search(r"(?:^|\s)(?:в|по|из)\s+([А-ЯA-ZЁ][\w\- ]{1,40})", text or "", flags=re.IGNORECASE)
@@ -3422,6 +3552,18 @@ async def main():
     # Подгруzim intents KB (без этого kb_router может вернуть пусто)
     await load_kb_intents()
 
+    # Пулы для тяжёлых задач (выборка, XLSX) — прогреваем до старта поллинга
+    executors.start()
+
+    # Инвентарь с прошлого запуска (если кэш есть)
+    load_screens_cache()
+
+    # Локальный индекс POI (если собран): первая категория в /geo не ждёт чтения с диска
+    poi_index.get_index()
+
+    # Общий пул HTTP-соединений для всех исходящих запросов (API, геокодеры, OpenAI, Notion)
+    await http_client.start()
+
     # Порядок подключения важен:
     dp.include_router(kb_router)      # 1) KB: "как загрузить крео" и т.п.
     dp.include_router(nlu_router)    # 2) NLU-подсказки по свободному тексту
@@ -3446,7 +3588,13 @@ async def main():
 
     # Чистим вебхук (на всякий) и запускаем поллинг
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)  # ← ЭТО главное: запускает обработку апдейтов
+    try:
+        await dp.start_polling(bot)  # ← ЭТО главное: запускает обработку апдейтов
+    finally:
+        executors.shutdown()
+        await http_client.close()
+        if _DETAIL_CACHE is not None:
+            _DETAIL_CACHE.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
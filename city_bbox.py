@@ -0,0 +1,256 @@
+# city_bbox.py
+# Границы городов для Overpass/фильтров: (min_lon, min_lat, max_lon, max_lat).
+# Источники по приоритету:
+#   1) сохранённые на диск (Nominatim, встроенные) — city_bbox.json в каталоге кэша;
+#   2) посчитанные офлайн по инвентарю (min/max lat/lon экранов города + отступ);
+#   3) Nominatim — один запрос на город, результат сохраняется и больше не запрашивается;
+#      «не найден»/ошибка помнится CITY_BBOX_MISS_TTL_MIN минут, чтобы не стучать в лимитер на каждый /geo.
+# Названия приводятся к одному ключу: «мск», «в Москве», «Moscow» → «москва».
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from nominatim_client import CLIENT as NOMINATIM
+
+BBox = Tuple[float, float, float, float]   # (min_lon, min_lat, max_lon, max_lat)
+
+CITY_BBOX_PATH = Path(os.getenv("SCREENS_CACHE_DIR", "/tmp/omnika_cache")) / "city_bbox.json"
+SCREENS_BBOX_PAD_KM = float(os.getenv("SCREENS_BBOX_PAD_KM", "2"))
+CITY_BBOX_MISS_TTL_S = float(os.getenv("CITY_BBOX_MISS_TTL_MIN", "10")) * 60
+
+# Разговорные формы → каноническое название (как пишет пользователь в /geo, NLU, фильтрах)
+CITY_ALIASES: Dict[str, str] = {
+    "мск": "Москва", "москва": "Москва", "в москве": "Москва", "по москве": "Москва", "из москвы": "Москва", "москве": "Москва",
+    "moscow": "Москва",
+    "спб": "Санкт-Петербург", "питер": "Санкт-Петербург", "питере": "Санкт-Петербург",
+    "санкт-петербург": "Санкт-Петербург", "санкт петербург": "Санкт-Петербург",
+    "санкт-петербурге": "Санкт-Петербург", "санкт петербурге": "Санкт-Петербург",
+    "петербург": "Санкт-Петербург", "в спб": "Санкт-Петербург", "в питере": "Санкт-Петербург",
+    "saint petersburg": "Санкт-Петербург", "st petersburg": "Санкт-Петербург",
+    "казань": "Казань", "в казани": "Казань", "казани": "Казань",
+    "новосибирск": "Новосибирск", "в новосибирске": "Новосибирск", "новосибирске": "Новосибирск",
+    "екатеринбург": "Екатеринбург", "в екатеринбурге": "Екатеринбург", "екатеринбурге": "Екатеринбург",
+    "нижний новгород": "Нижний Новгород", "в нижнем новгороде": "Нижний Новгород", "нижнем новгороде": "Нижний Новгород",
+    "тверь": "Тверь", "в твери": "Тверь", "твери": "Тверь",
+    "самара": "Самара", "в самаре": "Самара", "самаре": "Самара",
+    "ростов-на-дону": "Ростов-на-Дону", "в ростове-на-дону": "Ростов-на-Дону", "ростове-на-дону": "Ростов-на-Дону",
+    "воронеж": "Воронеж", "в воронеже": "Воронеж", "воронеже": "Воронеж",
+    "пермь": "Пермь", "в перми": "Пермь", "перми": "Пермь",
+    "уфа": "Уфа", "в уфе": "Уфа", "уфе": "Уфа",
+}
+
+# Стартовый набор (раньше — overpass_provider.CITY_BBOX); на диске может быть уточнён
+_BUILTIN: Dict[str, BBox] = {
+    "москва": (37.2, 55.4, 37.95, 56.05),
+    "санкт-петербург": (29.4, 59.65, 31.0, 60.3),
+    "химки": (37.30, 55.84, 37.57, 56.02),
+    "воронеж": (39.0, 51.5, 39.5, 51.9),
+    "казань": (48.9, 55.65, 49.3, 55.95),
+}
+
+
+def normalize_city_token(raw: str) -> str:
+    """«в Москве» → «Москва», «спб» → «Санкт-Петербург», «туле» → «Тула» (грубая эвристика по падежу)."""
+    t = (raw or "").strip(" .,!?:;\"'()").lower()
+    t = re.sub(r"^(?:город|г\.)\s+", "", t)
+    if t in CITY_ALIASES:
+        return CITY_ALIASES[t]
+    if t.endswith("е") and len(t) >= 4:
+        t = t[:-1] + "а"
+    t = re.sub(r"\s{2,}", " ", t).strip()
+    return t.capitalize() if t else ""
+
+
+def city_key(city: Optional[str]) -> str:
+    """Ключ для хранилища: алиас → каноническое имя, нижний регистр, ё→е."""
+    raw = (city or "").strip().lower().replace("ё", "е")
+    raw = re.sub(r"\s{2,}", " ", raw)
+    if not raw:
+        return ""
+    canon = CITY_ALIASES.get(raw)
+    return (canon or raw).lower().replace("ё", "е")
+
+
+def as_swne(bbox: Optional[BBox]) -> Optional[Tuple[float, float, float, float]]:
+    """(min_lon, min_lat, max_lon, max_lat) → (south, west, north, east) — порядок Overpass QL."""
+    if bbox is None:
+        return None
+    w, s, e, n = bbox
+    return (s, w, n, e)
+
+
+class CityBBoxResolver:
+    def __init__(self, path: Path = CITY_BBOX_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stored: Dict[str, dict] = {}      # key -> {"bbox": [...], "source": ..., "ts": ...}
+        self._screens: Dict[str, BBox] = {}     # посчитанные по текущему инвентарю
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._missing: Dict[str, float] = {}    # key -> до какого времени не спрашивать Nominatim снова
+        self.stats = {"stored": 0, "screens": 0, "fetched": 0, "missing": 0}
+        for k, b in _BUILTIN.items():
+            self._stored[k] = {"bbox": list(b), "source": "builtin", "ts": 0}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            if self.path.exists():
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                for k, v in (data or {}).items():
+                    if isinstance(v, dict) and isinstance(v.get("bbox"), list) and len(v["bbox"]) == 4:
+                        self._stored[k] = v
+        except Exception as e:
+            logging.warning(f"city_bbox: {self.path} не читается: {e}")
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with self._lock:
+                payload = {k: v for k, v in self._stored.items() if v.get("source") != "builtin"}
+            tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=1), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.warning(f"city_bbox: не удалось сохранить {self.path}: {e}")
+
+    def lookup(self, city: Optional[str]) -> Optional[BBox]:
+        """Только локальные источники, без сети."""
+        key = city_key(city)
+        if not key:
+            return None
+        with self._lock:
+            rec = self._stored.get(key)
+            if rec is not None:
+                self.stats["stored"] += 1
+                return tuple(rec["bbox"])
+            b = self._screens.get(key)
+        if b is not None:
+            self.stats["screens"] += 1
+        return b
+
+    def put(self, city: str, bbox: BBox, source: str = "manual") -> None:
+        key = city_key(city)
+        if not key:
+            return
+        with self._lock:
+            self._stored[key] = {"bbox": [float(x) for x in bbox], "source": source, "ts": time.time()}
+        self._save()
+
+    def index_screens(self, df: Optional[pd.DataFrame], pad_km: float = SCREENS_BBOX_PAD_KM) -> int:
+        """Офлайн-bbox по каждому городу инвентаря: min/max координат экранов + pad_km со всех сторон."""
+        if df is None or df.empty or not {"city", "lat", "lon"}.issubset(df.columns):
+            with self._lock:
+                self._screens = {}
+            return 0
+        lat = pd.to_numeric(df["lat"], errors="coerce")
+        lon = pd.to_numeric(df["lon"], errors="coerce")
+        # city_key — по разу на различное значение, не на строку; разные написания одного города → один номер
+        codes, uniques = pd.factorize(df["city"])   # NaN → -1
+        key_codes, key_names = pd.factorize(pd.Series([city_key(str(u)) for u in uniques], dtype=object))
+        row_key = np.append(key_codes, -1)[codes]   # -1 (NaN-город) берёт последний элемент — тоже -1
+        key_names = list(key_names)
+        if "" in key_names:
+            row_key[row_key == key_names.index("")] = -1
+        frame = pd.DataFrame({"k": row_key, "lat": lat, "lon": lon}).dropna()
+        frame = frame[frame["k"] >= 0]
+        if frame.empty:
+            with self._lock:
+                self._screens = {}
+            return 0
+        agg = frame.groupby("k", sort=False).agg(
+            min_lat=("lat", "min"), max_lat=("lat", "max"), min_lon=("lon", "min"), max_lon=("lon", "max"),
+        )
+        dlat = pad_km / 111.0
+        out: Dict[str, BBox] = {}
+        for k, r in agg.iterrows():
+            coslat = max(math.cos(math.radians((r.min_lat + r.max_lat) / 2)), 0.05)
+            dlon = dlat / coslat
+            out[key_names[k]] = (
+                float(max(-180.0, r.min_lon - dlon)), float(max(-90.0, r.min_lat - dlat)),
+                float(min(180.0, r.max_lon + dlon)), float(min(90.0, r.max_lat + dlat)),
+            )
+        with self._lock:
+            self._screens = out
+        return len(out)
+
+    async def resolve(self, city: Optional[str], *, country_hint: str = "Россия", fetch: bool = True) -> Optional[BBox]:
+        """Локально, иначе (fetch=True) один запрос в Nominatim; одновременные запросы по городу склеиваются."""
+        b = self.lookup(city)
+        if b is not None or not fetch:
+            return b
+        key = city_key(city)
+        if not key:
+            return None
+        if self._missing.get(key, 0.0) > time.time():
+            return None
+        task = self._inflight.get(key)
+        if task is None:
+            # запрос — отдельной задачей: отмена того, кто его начал (проигравший в гонке /geo),
+            # не оставляет остальных ждать вечно и не срывает сохранение bbox
+            task = asyncio.ensure_future(self._fetch_and_store(city, country_hint))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()   # помечаем как полученное, даже если все ожидающие ушли
+
+    async def _fetch_and_store(self, city: str, country_hint: str) -> Optional[BBox]:
+        key = city_key(city)
+        try:
+            b = await self._fetch_nominatim(city, country_hint)
+        except Exception as e:
+            logging.warning(f"city_bbox: Nominatim для «{city}» не ответил: {e}")
+            b = None
+        if b is not None:
+            self.stats["fetched"] += 1
+            self._missing.pop(key, None)
+            self.put(city, b, source="nominatim")
+        else:
+            self.stats["missing"] += 1
+            self._missing[key] = time.time() + CITY_BBOX_MISS_TTL_S
+        return b
+
+    async def _fetch_nominatim(self, city: str, country_hint: str) -> Optional[BBox]:
+        params = {
+            "q": f"{city}, {country_hint}" if country_hint else city,
+            "format": "jsonv2",
+            "limit": 1,
+            "addressdetails": 0,
+            "polygon_geojson": 0,
+        }
+        data = await NOMINATIM.search(params)
+        if not data:
+            return None
+        bb = data[0].get("boundingbox")
+        if not bb or len(bb) != 4:
+            return None
+        # Nominatim: [south, north, west, east]
+        south, north, west, east = map(float, bb)
+        return (west, south, east, north)
+
+    def summary(self) -> str:
+        with self._lock:
+            n_stored = len(self._stored)
+            n_screens = len(self._screens)
+        s = self.stats
+        return (f"сохранено {n_stored}, по инвентарю {n_screens} | попаданий: диск {s['stored']}, "
+                f"инвентарь {s['screens']}; Nominatim: {s['fetched']} новых, {s['missing']} не найдено")
+
+
+RESOLVER = CityBBoxResolver()
@@ -0,0 +1,107 @@
+# detail_cache.py
+# Локальный кэш детальных карточек инвентаря (/clients/inventories/{id}) в SQLite.
+# Хранит JSON карточки, время получения и валидаторы сервера (ETag / Last-Modified):
+# свежие записи отдаём без запроса, протухшие перепроверяем условным GET (304 — берём из кэша).
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional
+
+
+class DetailEntry(NamedTuple):
+    payload: dict
+    fetched_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+    def is_fresh(self, ttl_s: float, now: Optional[float] = None) -> bool:
+        return ((now or time.time()) - self.fetched_at) < ttl_s
+
+    def validators(self) -> dict:
+        """Заголовки условного запроса для перепроверки записи."""
+        h = {}
+        if self.etag:
+            h["If-None-Match"] = self.etag
+        if self.last_modified:
+            h["If-Modified-Since"] = self.last_modified
+        return h
+
+
+class DetailCache:
+    """
+    id → DetailEntry. Соединение одно на объект, доступ под локом: методы зовутся из пула потоков
+    (executors.run_io), чтобы не блокировать event loop на больших пачках.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS details ("
+            " inv_id INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT)"
+        )
+        self._conn.commit()
+
+    def get_many(self, ids: Iterable[int], chunk: int = 500) -> dict[int, DetailEntry]:
+        ids = list(ids)
+        out: dict[int, DetailEntry] = {}
+        with self._lock:
+            for a in range(0, len(ids), chunk):
+                part = ids[a:a + chunk]
+                q = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT inv_id, payload, fetched_at, etag, last_modified FROM details WHERE inv_id IN ({q})", part
+                ).fetchall()
+                for inv_id, payload, fetched_at, etag, lm in rows:
+                    try:
+                        out[inv_id] = DetailEntry(json.loads(payload), fetched_at, etag, lm)
+                    except ValueError:
+                        continue
+        return out
+
+    def put_many(self, entries: dict[int, DetailEntry]) -> None:
+        rows = [
+            (inv_id, json.dumps(e.payload, ensure_ascii=False), e.fetched_at, e.etag, e.last_modified)
+            for inv_id, e in entries.items()
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO details (inv_id, payload, fetched_at, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def touch_many(self, ids: Iterable[int], ts: Optional[float] = None) -> None:
+        """Продлить свежесть записей (сервер ответил 304)."""
+        ts = ts or time.time()
+        rows = [(ts, i) for i in ids]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("UPDATE details SET fetched_at = ? WHERE inv_id = ?", rows)
+            self._conn.commit()
+
+    def stats(self, ttl_s: float) -> dict:
+        with self._lock:
+            total, fresh = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(fetched_at > ?), 0) FROM details", (time.time() - ttl_s,)
+            ).fetchone()
+        return {"rows": int(total), "fresh": int(fresh), "bytes": self.path.stat().st_size if self.path.exists() else 0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
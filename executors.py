@@ -0,0 +1,106 @@
+# executors.py
+# Вынос тяжёлой работы из event loop aiogram:
+#   run_io  — пул потоков (pandas I/O: XLSX/CSV, нормализация, фильтры);
+#   run_cpu — пул процессов (выборка/геометрия). Функция и аргументы должны пикаться,
+#             поэтому сюда передаём только функции из «чистых» модулей (selection, geo_index).
+# Таймаут отдаёт ответ пользователю, но уже запущенную задачу не убивает — она доработает в фоне.
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+WORKER_THREADS   = _env_int("WORKER_THREADS", 4)
+WORKER_PROCESSES = _env_int("WORKER_PROCESSES", 2)     # 0 → CPU-задачи тоже в пул потоков
+try:
+    JOB_TIMEOUT_S = float(os.getenv("JOB_TIMEOUT_S", "120"))
+except Exception:
+    JOB_TIMEOUT_S = 120.0
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+class JobTimeout(RuntimeError):
+    """Задача не уложилась в таймаут."""
+
+
+def _threads() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=max(1, WORKER_THREADS), thread_name_prefix="bot-io")
+    return _thread_pool
+
+
+def _processes() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    if WORKER_PROCESSES <= 0:
+        return None
+    if _process_pool is None:
+        # spawn: не форкаем процесс с живым event loop и потоками aiohttp
+        ctx = multiprocessing.get_context("spawn")
+        _process_pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=ctx)
+    return _process_pool
+
+
+async def _await_job(fut, timeout: Optional[float], name: str) -> Any:
+    limit = JOB_TIMEOUT_S if timeout is None else timeout
+    try:
+        return await asyncio.wait_for(fut, timeout=limit if limit and limit > 0 else None)
+    except asyncio.TimeoutError:
+        raise JobTimeout(f"{name}: не уложились в {limit:g} с, попробуйте сузить запрос") from None
+
+
+async def run_io(fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """Выполнить fn(*args, **kwargs) в пуле потоков с таймаутом."""
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_threads(), functools.partial(fn, *args, **kwargs))
+    return await _await_job(fut, timeout, getattr(fn, "__name__", "job"))
+
+
+async def run_cpu(fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """Выполнить fn(*args, **kwargs) в пуле процессов (или в потоке, если процессы выключены/упали)."""
+    global _process_pool
+    pool = _processes()
+    if pool is None:
+        return await run_io(fn, *args, timeout=timeout, **kwargs)
+    loop = asyncio.get_running_loop()
+    try:
+        fut = loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        return await _await_job(fut, timeout, getattr(fn, "__name__", "job"))
+    except BrokenProcessPool:
+        logging.exception("process pool broken — пересоздаю, задачу выполняю в потоке")
+        _process_pool = None
+        return await run_io(fn, *args, timeout=timeout, **kwargs)
+
+
+def start() -> None:
+    """Поднять пулы заранее: spawn-воркеры импортируют pandas/numpy секунды, пусть это будет до первого запроса."""
+    _threads()
+    pool = _processes()
+    if pool is not None:
+        pool.submit(os.getpid)
+
+
+def shutdown() -> None:
+    """Закрыть пулы (вызывается при остановке бота)."""
+    global _thread_pool, _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
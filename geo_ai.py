@@ -7,6 +7,9 @@ import os, json, math, asyncio
 from typing import Any, Dict, List, Optional, Tuple, Callable, Awaitable
 import aiohttp
 
+import http_client
+from geo_cache import cached_geocoder, mark_failed
+
 OPENAI_URL   = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
 OPENAI_KEY   = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
@@ -64,13 +67,14 @@ async def _post_openai(payload: Dict[str, Any], timeout_sec: int) -> Optional[Di
     if not OPENAI_KEY: return None
     headers = {"Authorization": f"Bearer {OPENAI_KEY}", "Content-Type": "application/json"}
     timeout = aiohttp.ClientTimeout(total=timeout_sec)
-    async with aiohttp.ClientSession(timeout=timeout) as sess:
+    async with http_client.client(timeout=timeout) as sess:
         async with sess.post(OPENAI_URL, headers=headers, json=payload) as resp:
             if resp.status >= 400:
                 _ = await resp.text()
                 return None
             return await resp.json()
 
+@cached_geocoder("openai")
 async def find_poi_ai(
     query: str,
     city: Optional[str] = None,
@@ -104,6 +108,7 @@ async def find_poi_ai(
 
     data = await _post_openai(payload, timeout_sec)
     if not data:
+        mark_failed()   # HTTP-ошибка OpenAI — пустой ответ не кэшируем
         return []
 
     # --- парсинг ответа ---
@@ -111,6 +116,7 @@ async def find_poi_ai(
         content = (data["choices"][0]["message"]["content"] or "").strip()
         parsed = json.loads(content)
     except Exception:
+        mark_failed()
         return []
 
     # достаём массив из объекта (берём первый value-список, если ключ неизвестен)
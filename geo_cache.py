@@ -0,0 +1,221 @@
+# geo_cache.py
+# Общий кэш результатов геокодинга для всех провайдеров (Nominatim, Overpass, OpenAI).
+# Ключ: (провайдер, нормализованный запрос, город, limit + прочие параметры поиска).
+# Память: LRU на GEOCODE_CACHE_MAX записей; TTL для найденного и (короче) для «ничего не найдено».
+# Пустой ответ из-за ошибки (не-200, все зеркала Overpass упали, OpenAI не ответил) не кэшируется вовсе:
+# провайдер зовёт mark_failed(), и декоратор такой результат не запоминает.
+# Диск: опционально SQLite в каталоге кэша инвентаря — кэш переживает рестарт воркера; из декоратора
+# чтение и запись идут через executors.run_io, event loop на диске не стоит.
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+import executors
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+GEOCODE_CACHE_MAX       = int(_env_float("GEOCODE_CACHE_MAX", 2000))
+GEOCODE_CACHE_TTL_S     = _env_float("GEOCODE_CACHE_TTL_H", 24 * 7) * 3600
+GEOCODE_CACHE_NEG_TTL_S = _env_float("GEOCODE_CACHE_NEG_TTL_MIN", 10) * 60
+GEOCODE_CACHE_PERSIST   = (os.getenv("GEOCODE_CACHE_PERSIST", "1") or "1").strip().lower() in {"1", "true", "yes", "on"}
+GEOCODE_CACHE_PATH      = Path(os.getenv("SCREENS_CACHE_DIR", "/tmp/omnika_cache")) / "geocode_cache.sqlite"
+
+
+def normalize_text(s: Optional[str]) -> str:
+    """Регистр, ё→е, кавычки и лишние пробелы не влияют на ключ."""
+    t = (s or "").strip().lower().replace("ё", "е")
+    t = re.sub(r"[«»\"'`]", "", t)
+    return re.sub(r"\s+", " ", t)
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        max_entries: int = GEOCODE_CACHE_MAX,
+        ttl_s: float = GEOCODE_CACHE_TTL_S,
+        negative_ttl_s: float = GEOCODE_CACHE_NEG_TTL_S,
+        path: Optional[Path] = GEOCODE_CACHE_PATH if GEOCODE_CACHE_PERSIST else None,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.negative_ttl_s = float(negative_ttl_s)
+        self._mem: "OrderedDict[str, tuple[float, list]]" = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            try:
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(str(path), check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM geocode WHERE expires_at < ?", (time.time(),))
+                self._db.commit()
+            except Exception as e:
+                logging.warning(f"geocode cache: SQLite недоступен ({path}): {e} — только память")
+                self._db = None
+
+    @staticmethod
+    def make_key(provider: str, query: str, city: Optional[str], limit: Any, extra: Optional[dict] = None) -> str:
+        parts = [provider, normalize_text(query), normalize_text(city), str(limit)]
+        if extra:
+            parts.append(json.dumps(extra, sort_keys=True, ensure_ascii=False, default=repr))
+        return "\x1f".join(parts)
+
+    @property
+    def persistent(self) -> bool:
+        return self._db is not None
+
+    def get(self, key: str) -> Optional[list]:
+        """Память, затем SQLite (синхронно — для скриптов; в боте см. cached_geocoder)."""
+        hit = self.get_mem(key)
+        return hit if hit is not None else self.get_disk(key)
+
+    def get_mem(self, key: str) -> Optional[list]:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._mem.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return hit[1]
+                del self._mem[key]
+        return None
+
+    def get_disk(self, key: str) -> Optional[list]:
+        """SQLite-часть get (блокирующая — из async-кода только через executors.run_io); промах считается здесь."""
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM geocode WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.stats["disk_hits"] += 1
+                    return value
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: list) -> None:
+        self.put_disk(key, value, self.put_mem(key, value))
+
+    def put_mem(self, key: str, value: list) -> float:
+        """Запомнить в памяти; возвращает expires_at (для put_disk)."""
+        expires_at = time.time() + (self.ttl_s if value else self.negative_ttl_s)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.stats["stores"] += 1
+        return expires_at
+
+    def put_disk(self, key: str, value: list, expires_at: float) -> None:
+        """Записать в SQLite (только непустые ответы; блокирующая — из async-кода через executors.run_io)."""
+        if self._db is None or not value:
+            return
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False, default=str), expires_at),
+                )
+                self._db.commit()
+            except Exception as e:
+                logging.warning(f"geocode cache: запись в SQLite не удалась: {e}")
+
+    def _remember(self, key: str, expires_at: float, value: list) -> None:
+        self._mem[key] = (expires_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM geocode")
+                self._db.commit()
+
+    def summary(self) -> str:
+        s = self.stats
+        lookups = s["hits"] + s["disk_hits"] + s["misses"]
+        rate = (s["hits"] + s["disk_hits"]) / lookups * 100 if lookups else 0.0
+        return (f"hit {s['hits']} (+диск {s['disk_hits']}), miss {s['misses']}, hit-rate {rate:.0f}% | "
+                f"в памяти {len(self._mem)}/{self.max_entries}, вытеснено {s['evictions']}, "
+                f"SQLite: {'✅' if self._db is not None else '—'}")
+
+
+CACHE = GeocodeCache()
+
+# ячейка текущего вызова cached_geocoder: {"failed": bool}; провайдер отмечает в ней ошибку через mark_failed()
+_CALL: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("geo_cache_call", default=None)
+
+
+def mark_failed() -> None:
+    """Пустой (или неполный) ответ — из-за ошибки, а не «ничего не найдено»: текущий вызов не кэшировать."""
+    cell = _CALL.get()
+    if cell is not None:
+        cell["failed"] = True
+
+
+def cached_geocoder(provider: str, *, ignore: tuple = ("session", "ssl", "timeout_sec")):
+    """
+    Декоратор для async-функций поиска вида f(query, city, limit, ...) -> list[dict].
+    Остальные аргументы (кроме ignore — транспорт/таймауты) входят в ключ.
+    Пустой результат кэшируется на короткий negative TTL; если провайдер позвал mark_failed() — не кэшируется.
+    """
+    def deco(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            try:
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                a = dict(bound.arguments)
+                extra = {k: v for k, v in a.items() if k not in ("query", "city", "limit") and k not in ignore}
+                if any(callable(v) for v in extra.values()):
+                    return await fn(*args, **kwargs)   # колбэки (geocode_backfill) в ключ не положить
+                key = GeocodeCache.make_key(provider, a.get("query"), a.get("city"), a.get("limit"), extra)
+            except TypeError:
+                return await fn(*args, **kwargs)
+            hit = CACHE.get_mem(key)
+            if hit is None:
+                hit = await executors.run_io(CACHE.get_disk, key) if CACHE.persistent else CACHE.get_disk(key)
+            if hit is not None:
+                return [dict(p) for p in hit]
+            cell = {"failed": False}
+            token = _CALL.set(cell)
+            try:
+                res = await fn(*args, **kwargs)
+            finally:
+                _CALL.reset(token)
+            if isinstance(res, list) and not cell["failed"]:
+                value = [dict(p) for p in res if isinstance(p, dict)]
+                expires_at = CACHE.put_mem(key, value)
+                if value and CACHE.persistent:
+                    await executors.run_io(CACHE.put_disk, key, value, expires_at)
+            return res
+
+        wrapper.uncached = fn
+        return wrapper
+    return deco
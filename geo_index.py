@@ -0,0 +1,416 @@
+# geo_index.py
+# Векторизованная гео-математика по инвентарю экранов (numpy, без циклов по строкам).
+# Модуль не зависит от aiogram/BOT_TOKEN — его можно импортировать из бенчмарков и воркеров.
+from __future__ import annotations
+
+import hashlib
+import os
+import random
+import weakref
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+
+# колонки, которые within_radius отдаёт наружу (порядок важен)
+RADIUS_COLUMNS = ["screen_id", "name", "city", "format", "owner", "lat", "lon", "distance_km"]
+
+# кэш радиан для последнего df: (weakref на df, lat_rad, lon_rad)
+_RAD_CACHE: Optional[Tuple[weakref.ref, np.ndarray, np.ndarray]] = None
+
+
+def haversine_rad(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Haversine в км; все координаты — в радианах, любые broadcast-совместимые формы."""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def coords_radians(df: pd.DataFrame, *, cache: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    lat/lon df в радианах (float64). Для одного и того же объекта df считаем один раз:
+    SCREENS меняется только целиком (sync/файл/кэш), поэтому кэшируем по identity.
+    cache=False — для разовых выборок: не вытеснять из кэша радианы инвентаря.
+    """
+    global _RAD_CACHE
+    if _RAD_CACHE is not None:
+        ref, lat_r, lon_r = _RAD_CACHE
+        if ref() is df and len(lat_r) == len(df):
+            return lat_r, lon_r
+
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    if not cache:
+        return lat_r, lon_r
+    try:
+        _RAD_CACHE = (weakref.ref(df), lat_r, lon_r)
+    except TypeError:
+        pass
+    return lat_r, lon_r
+
+
+def coords_fingerprint(df: pd.DataFrame) -> str:
+    """sha1 по lat/lon df (float64, NaN как есть): сетка на диске годится, только если отпечаток совпал."""
+    h = hashlib.sha1()
+    for col in ("lat", "lon"):
+        arr = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+def prime_coords(df: pd.DataFrame, lat_r: np.ndarray, lon_r: np.ndarray) -> None:
+    """Подставить готовые радианы для df (например, из mmap сетки), чтобы coords_radians их не пересчитывал."""
+    global _RAD_CACHE
+    if len(lat_r) != len(df) or len(lon_r) != len(df):
+        return
+    try:
+        _RAD_CACHE = (weakref.ref(df), lat_r, lon_r)
+    except TypeError:
+        pass
+
+
+def distances_from(df: pd.DataFrame, center: Tuple[float, float]) -> np.ndarray:
+    """Расстояние (км) от center=(lat, lon) до каждой строки df; NaN для строк без координат."""
+    lat_r, lon_r = coords_radians(df)
+    clat, clon = np.radians(float(center[0])), np.radians(float(center[1]))
+    return haversine_rad(clat, clon, lat_r, lon_r)
+
+
+def radius_positions(df: pd.DataFrame, center: Tuple[float, float], radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Позиции строк df в радиусе и их расстояния (без сортировки)."""
+    d = distances_from(df, center)
+    pos = np.flatnonzero(d <= float(radius_km))
+    return pos, d[pos]
+
+
+class GridIndex:
+    """
+    Равномерная сетка lat/lon (ячейка cell_deg градусов) над позициями строк инвентаря.
+    Ключ ячейки = iy * n_cols + ix; позиции отсортированы по ключу, поэтому строка сетки
+    в диапазоне ix — это один непрерывный срез (два searchsorted).
+    Строится один раз на каждый новый SCREENS; запрос смотрит только ячейки вокруг круга.
+    """
+
+    # если кругу нужно больше ячеек, чем это, полный векторный проход дешевле
+    MAX_CELLS = 4096
+
+    def __init__(self, lat_deg: np.ndarray, lon_deg: np.ndarray, cell_deg: float = 0.02):
+        self.cell_deg = float(cell_deg)
+        self.n_cols = int(np.ceil(360.0 / self.cell_deg)) + 1
+        self.size = len(lat_deg)
+        self.lat_r = np.radians(lat_deg)
+        self.lon_r = np.radians(lon_deg)
+
+        valid = np.flatnonzero(np.isfinite(lat_deg) & np.isfinite(lon_deg))
+        keys = self._cell_keys(lat_deg[valid], lon_deg[valid])
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.positions = valid[order]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, cell_deg: float = 0.02) -> "GridIndex":
+        lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        return cls(lat, lon, cell_deg=cell_deg)
+
+    # файлы сетки на диске: np.save/np.load(mmap_mode="r") — страницы делятся между воркерами через page cache
+    _ARRAY_FILES = ("lat_r", "lon_r", "keys", "positions")
+
+    def save(self, directory) -> None:
+        """Сохраняет массивы сетки как .npy в directory (каждый файл — атомарно, через .tmp)."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in self._ARRAY_FILES:
+            path = directory / f"{name}.npy"
+            tmp = directory / f"{name}.tmp.npy"
+            np.save(tmp, np.ascontiguousarray(getattr(self, name)))
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory, cell_deg: float = 0.02, mmap_mode: Optional[str] = "r") -> "GridIndex":
+        """Поднимает сетку из .npy без пересчёта; по умолчанию массивы только отображаются в память (read-only)."""
+        directory = Path(directory)
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in cls._ARRAY_FILES}
+        if not (len(arrays["lat_r"]) == len(arrays["lon_r"]) and len(arrays["keys"]) == len(arrays["positions"])):
+            raise ValueError(f"GridIndex: несогласованные массивы в {directory}")
+        self = cls.__new__(cls)
+        self.cell_deg = float(cell_deg)
+        self.n_cols = int(np.ceil(360.0 / self.cell_deg)) + 1
+        self.size = len(arrays["lat_r"])
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        return self
+
+    def freeze(self) -> "GridIndex":
+        """Массивы сетки → read-only (у mmap из load они такие и так): индекс делят все запросы снимка."""
+        for name in self._ARRAY_FILES:
+            arr = getattr(self, name)
+            if arr.flags.writeable:
+                arr.flags.writeable = False
+        return self
+
+    def _cell_keys(self, lat_deg: np.ndarray, lon_deg: np.ndarray) -> np.ndarray:
+        iy = np.floor((lat_deg + 90.0) / self.cell_deg).astype(np.int64)
+        ix = np.floor((lon_deg + 180.0) / self.cell_deg).astype(np.int64)
+        return iy * self.n_cols + ix
+
+    def candidates(self, center: Tuple[float, float], radius_km: float) -> Optional[np.ndarray]:
+        """Позиции из ячеек, покрывающих круг; None — если круг слишком велик/у полюса/через 180°."""
+        clat, clon = float(center[0]), float(center[1])
+        dlat = float(radius_km) / (np.pi * EARTH_RADIUS_KM / 180.0)
+        coslat = np.cos(np.radians(min(abs(clat) + dlat, 90.0)))
+        if coslat < 1e-6:
+            return None
+        dlon = dlat / coslat
+        lat0, lat1 = clat - dlat, clat + dlat
+        lon0, lon1 = clon - dlon, clon + dlon
+        if lat0 < -90 or lat1 > 90 or lon0 < -180 or lon1 > 180:
+            return None
+
+        iy0 = int(np.floor((lat0 + 90.0) / self.cell_deg))
+        iy1 = int(np.floor((lat1 + 90.0) / self.cell_deg))
+        ix0 = int(np.floor((lon0 + 180.0) / self.cell_deg))
+        ix1 = int(np.floor((lon1 + 180.0) / self.cell_deg))
+        if (iy1 - iy0 + 1) * (ix1 - ix0 + 1) > self.MAX_CELLS:
+            return None
+
+        rows = np.arange(iy0, iy1 + 1, dtype=np.int64) * self.n_cols
+        lo = np.searchsorted(self.keys, rows + ix0, side="left")
+        hi = np.searchsorted(self.keys, rows + ix1, side="right")
+        parts = [self.positions[a:b] for a, b in zip(lo, hi) if b > a]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        # по возрастанию позиции — тот же порядок, что у полного прохода
+        return np.sort(np.concatenate(parts))
+
+    def query(self, center: Tuple[float, float], radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Позиции строк в радиусе и расстояния до них (км)."""
+        clat, clon = np.radians(float(center[0])), np.radians(float(center[1]))
+        cand = self.candidates(center, radius_km)
+        if cand is None:
+            d = haversine_rad(clat, clon, self.lat_r, self.lon_r)
+            pos = np.flatnonzero(d <= float(radius_km))
+            return pos, d[pos]
+        d = haversine_rad(clat, clon, self.lat_r[cand], self.lon_r[cand])
+        keep = d <= float(radius_km)
+        return cand[keep], d[keep]
+
+
+def _column_or_blank(df: pd.DataFrame, col: str, pos: np.ndarray):
+    if col not in df.columns:
+        return np.full(len(pos), "", dtype=object)
+    ser = df[col]
+    if isinstance(ser, pd.DataFrame):  # дубликаты колонок
+        ser = ser.iloc[:, 0]
+    # .array, а не .to_numpy(): category/строковые колонки остаются кодами, без object-массива на каждую строку
+    return ser.take(pos).array
+
+
+def _radius_frame(df: pd.DataFrame, pos: np.ndarray, dist_km: np.ndarray) -> pd.DataFrame:
+    data = {c: _column_or_blank(df, c, pos) for c in RADIUS_COLUMNS[:-1]}
+    data["distance_km"] = np.round(dist_km, 3)
+    return pd.DataFrame(data)
+
+
+def frame_from_positions(df: pd.DataFrame, pos: np.ndarray, dist_km: np.ndarray) -> pd.DataFrame:
+    """Собирает выдачу within_radius из позиций и расстояний, сортирует по distance_km."""
+    if len(pos) == 0:
+        return pd.DataFrame(columns=RADIUS_COLUMNS)
+    return _radius_frame(df, pos, dist_km).sort_values("distance_km", kind="stable")
+
+
+def radius_join(
+    df: pd.DataFrame,
+    centers,
+    radius_km: float,
+    *,
+    index: Optional[GridIndex] = None,
+    nearest_only: bool = True,
+    chunk_cells: int = 2_000_000,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Джойн «много центров × много экранов» за один проход.
+    centers — последовательность (lat, lon); битые координаты пропускаются.
+    Возвращает тройки (позиция экрана, индекс центра, км).
+    nearest_only=True — каждый экран один раз, к ближайшему центру (при равенстве — к первому).
+    С index считаются только пары «центр × экраны из ячеек вокруг него»; без индекса (или для
+    слишком больших кругов) — матрица расстояний чанками по ~chunk_cells элементов.
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype="float64"))
+    c = np.asarray(list(centers), dtype="float64").reshape(-1, 2)
+    center_ids = np.flatnonzero(np.isfinite(c).all(axis=1))
+    c = c[center_ids]
+    if df is None or df.empty or len(c) == 0:
+        return empty
+
+    r = float(radius_km)
+    if index is not None and index.size == len(df):
+        pairs = _index_pairs(index, c, r)
+        if pairs is not None:
+            pos, ctr = pairs
+            dist = haversine_rad(index.lat_r[pos], index.lon_r[pos],
+                                 np.radians(c[ctr, 0]), np.radians(c[ctr, 1]))
+            keep = dist <= r
+            pos, ctr, dist = pos[keep], ctr[keep], dist[keep]
+            if nearest_only and len(pos):
+                # по каждому экрану — минимальная дистанция, при равенстве меньший индекс центра
+                order = np.lexsort((ctr, dist, pos))
+                pos, ctr, dist = pos[order], ctr[order], dist[order]
+                first = np.ones(len(pos), dtype=bool)
+                first[1:] = pos[1:] != pos[:-1]
+                pos, ctr, dist = pos[first], ctr[first], dist[first]
+            return pos, center_ids[ctr], dist
+        lat_r, lon_r = index.lat_r, index.lon_r
+    else:
+        lat_r, lon_r = coords_radians(df)
+
+    clat = np.radians(c[:, 0])[None, :]
+    clon = np.radians(c[:, 1])[None, :]
+    step = max(1, int(chunk_cells) // len(c))
+    out_pos, out_ctr, out_d = [], [], []
+    for a in range(0, len(df), step):
+        rows = np.arange(a, min(a + step, len(df)), dtype=np.int64)
+        dist = haversine_rad(lat_r[rows][:, None], lon_r[rows][:, None], clat, clon)
+        if nearest_only:
+            dist = np.where(np.isnan(dist), np.inf, dist)
+            j = np.argmin(dist, axis=1)
+            dj = dist[np.arange(len(rows)), j]
+            keep = dj <= r
+            out_pos.append(rows[keep]); out_ctr.append(j[keep]); out_d.append(dj[keep])
+        else:
+            ri, cj = np.nonzero(dist <= r)
+            out_pos.append(rows[ri]); out_ctr.append(cj); out_d.append(dist[ri, cj])
+
+    pos = np.concatenate(out_pos)
+    return pos, center_ids[np.concatenate(out_ctr)], np.concatenate(out_d)
+
+
+def _index_pairs(index: GridIndex, centers: np.ndarray, radius_km: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Пары (позиция, номер центра) из ячеек сетки вокруг каждого центра; None — нужен полный проход."""
+    pos_parts, ctr_parts = [], []
+    for i, (la, lo) in enumerate(centers):
+        got = index.candidates((la, lo), radius_km)
+        if got is None:
+            return None
+        pos_parts.append(got)
+        ctr_parts.append(np.full(len(got), i, dtype=np.int64))
+    if not pos_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pos_parts), np.concatenate(ctr_parts)
+
+
+def in_sorted(values: np.ndarray, sorted_arr: np.ndarray) -> np.ndarray:
+    """values ∈ sorted_arr (bool на каждый элемент values), через searchsorted."""
+    if len(sorted_arr) == 0:
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(sorted_arr, values)
+    idx[idx == len(sorted_arr)] = 0
+    return sorted_arr[idx] == values
+
+
+def radius_join_frame(
+    df: pd.DataFrame,
+    centers,
+    radius_km: float,
+    *,
+    index: Optional[GridIndex] = None,
+    nearest_only: bool = True,
+    within: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """
+    radius_join в виде таблицы: колонки within_radius + center_idx.
+    Порядок — по центрам, внутри центра по distance_km (как склейка ответов по каждой точке).
+    within — отсортированные позиции df, которыми ограничить выдачу (например, из attr_index).
+    """
+    pos, ctr, dist = radius_join(df, centers, radius_km, index=index, nearest_only=nearest_only)
+    if within is not None and len(pos):
+        keep = in_sorted(pos, within)
+        pos, ctr, dist = pos[keep], ctr[keep], dist[keep]
+    if len(pos) == 0:
+        return pd.DataFrame(columns=RADIUS_COLUMNS + ["center_idx"])
+    order = np.lexsort((np.round(dist, 3), ctr))
+    out = _radius_frame(df, pos[order], dist[order])
+    out["center_idx"] = ctr[order]
+    return out
+
+
+def within_radius(
+    df: pd.DataFrame,
+    center: Tuple[float, float],
+    radius_km: float,
+    index: Optional[GridIndex] = None,
+) -> pd.DataFrame:
+    """
+    Векторизованный аналог построчного обхода: те же колонки, сортировка по distance_km.
+    index — GridIndex, построенный именно по этому df (иначе полный векторный проход).
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=RADIUS_COLUMNS)
+    if index is not None and index.size == len(df):
+        pos, dist = index.query(center, radius_km)
+    else:
+        pos, dist = radius_positions(df, center, radius_km)
+    return frame_from_positions(df, pos, dist)
+
+
+def farthest_point_positions(
+    lat_r: np.ndarray,
+    lon_r: np.ndarray,
+    n: int,
+    *,
+    random_start: bool = True,
+    seed: Optional[int] = None,
+    rng=random,
+) -> list[int]:
+    """
+    Жадный k-center (Gonzalez): держим массив «расстояние до ближайшего выбранного»
+    и обновляем его одним векторным haversine на каждый выбор.
+    Вызовы rng (randrange на старт, choice среди равных максимумов) идут в том же порядке,
+    что и в построчной версии, поэтому seed= даёт те же выборки.
+    """
+    size = len(lat_r)
+    if size == 0 or n <= 0:
+        return []
+    n = min(n, size)
+
+    if seed is not None:
+        rng.seed(seed)
+
+    if random_start:
+        start_idx = rng.randrange(size)
+    else:
+        lat_med = np.radians(np.nanmedian(np.degrees(lat_r)))
+        lon_med = np.radians(np.nanmedian(np.degrees(lon_r)))
+        start_idx = int(np.nanargmin(haversine_rad(lat_med, lon_med, lat_r, lon_r)))
+
+    chosen = [start_idx]
+    dists = haversine_rad(lat_r[start_idx], lon_r[start_idx], lat_r, lon_r)
+    dists = np.where(np.isnan(dists), -np.inf, dists)
+
+    while len(chosen) < n:
+        maxd = dists.max()
+        candidates = np.flatnonzero(dists == maxd).tolist()
+        next_idx = rng.choice(candidates)
+        chosen.append(next_idx)
+        # fmin: NaN от строки без координат не затирает расстояния (иначе max() → NaN и кандидатов нет)
+        np.fmin(dists, haversine_rad(lat_r[next_idx], lon_r[next_idx], lat_r, lon_r), out=dists)
+    return chosen
+
+
+def min_dist_to_others_km(lat_r: np.ndarray, lon_r: np.ndarray, chunk_rows: int = 1024) -> np.ndarray:
+    """Для каждой точки — расстояние (км) до ближайшей другой точки набора; 0.0 для одной точки."""
+    size = len(lat_r)
+    if size < 2:
+        return np.zeros(size, dtype="float64")
+    out = np.empty(size, dtype="float64")
+    for a in range(0, size, chunk_rows):
+        b = min(a + chunk_rows, size)
+        d = haversine_rad(lat_r[a:b, None], lon_r[a:b, None], lat_r[None, :], lon_r[None, :])
+        d[np.arange(b - a), np.arange(a, b)] = np.inf
+        out[a:b] = d.min(axis=1)
+    return out
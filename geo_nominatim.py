@@ -1,20 +1,14 @@
 # geo_nominatim.py
-import aiohttp
+from geo_cache import cached_geocoder
+from nominatim_client import CLIENT as NOMINATIM
 from typing import List, Dict, Optional
 
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
-NOMINATIM_UA = "OmnikaBot/1.0 (+https://example.com; contact: youremail@example.com)"
-
+@cached_geocoder("nominatim")
 async def geocode_query(query: str, city: Optional[str] = None, limit: int = 5) -> List[Dict]:
     if not query: return []
     q = query if not city else f"{query}, {city}"
     params = {"q": q, "format": "jsonv2", "addressdetails": 1, "limit": min(max(int(limit or 5), 1), 50), "accept-language": "ru,en"}
-    async with aiohttp.ClientSession(headers={"User-Agent": NOMINATIM_UA}, timeout=aiohttp.ClientTimeout(total=20)) as sess:
-        async with sess.get(NOMINATIM_URL, params=params) as r:
-            if r.status != 200:
-                _ = await r.text()
-                return []
-            data = await r.json()
+    data = await NOMINATIM.search(params)   # общий лимит 1 rps, одинаковые запросы склеиваются
     out: List[Dict] = []
     for it in data or []:
         try:
@@ -0,0 +1,145 @@
+# geo_race.py
+# «Гонка» провайдеров геопоиска для /geo в режиме auto.
+# Провайдеры идут в порядке приоритета и стартуют с шагом hedge_s (0 — все сразу, inf — строго
+# по очереди, как раньше). Побеждает первый непустой ответ с учётом приоритета: если раньше
+# ответил менее приоритетный, ждём более приоритетных ещё не дольше grace_s. Проигравших отменяем.
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+GEO_HEDGE_S        = _env_float("GEO_HEDGE_S", 1.0)         # шаг запуска следующего провайдера
+GEO_RACE_GRACE_S   = _env_float("GEO_RACE_GRACE_S", 1.0)    # сколько ждём более приоритетных
+GEO_RACE_TIMEOUT_S = _env_float("GEO_RACE_TIMEOUT_S", 60.0)
+
+Candidate = Tuple[str, Callable[[], Awaitable[list]]]   # (имя, фабрика корутины поиска)
+
+
+class ProviderRun(NamedTuple):
+    name: str
+    status: str               # ok | empty | error | cancelled | skipped
+    count: int
+    elapsed_s: Optional[float]
+    error: Optional[str]
+
+
+class RaceResult(NamedTuple):
+    winner: Optional[str]
+    pois: list
+    elapsed_s: float
+    runs: List[ProviderRun]
+
+    def summary(self) -> str:
+        labels = {"ok": "{n} шт.", "empty": "пусто", "error": "ошибка", "cancelled": "отменён", "skipped": "не запускался"}
+        parts = []
+        for r in self.runs:
+            s = labels[r.status].format(n=r.count)
+            if r.elapsed_s is not None and r.status in {"ok", "empty", "error"}:
+                s += f", {r.elapsed_s:.1f} с"
+            parts.append(f"{r.name}: {s}")
+        return "; ".join(parts)
+
+
+async def race(
+    candidates: Sequence[Candidate],
+    *,
+    hedge_s: float = GEO_HEDGE_S,
+    grace_s: float = GEO_RACE_GRACE_S,
+    timeout_s: float = GEO_RACE_TIMEOUT_S,
+) -> RaceResult:
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    deadline = t0 + timeout_s
+    tasks: List[asyncio.Task] = []
+    started: List[float] = []
+    finished: dict = {}        # индекс -> время завершения
+    next_at = t0
+    hold_until: Optional[float] = None
+    win: Optional[int] = None
+
+    def _result(i: int) -> Optional[list]:
+        t = tasks[i]
+        if not t.done() or t.cancelled() or t.exception() is not None:
+            return None
+        res = t.result()
+        return res if isinstance(res, list) else None
+
+    try:
+        while True:
+            now = loop.time()
+            for i, t in enumerate(tasks):
+                if t.done() and i not in finished:
+                    finished[i] = now
+
+            # первый по приоритету, кто ещё в игре: не завершён или вернул непустое
+            ready = [i for i in range(len(tasks)) if _result(i)]
+            head = next((i for i, t in enumerate(tasks) if not t.done() or _result(i)), None)
+            if head is not None and head in ready:
+                win = head
+                break
+            if ready:
+                hold_until = hold_until or (now + grace_s)
+                if now >= hold_until:
+                    win = ready[0]
+                    break
+            if len(tasks) == len(candidates) and all(t.done() for t in tasks):
+                break
+            if now >= deadline:
+                win = ready[0] if ready else None
+                break
+
+            # запуск следующего: по расписанию или сразу, если все запущенные уже ответили пусто
+            if len(tasks) < len(candidates) and (now >= next_at or all(t.done() for t in tasks)):
+                _, factory = candidates[len(tasks)]
+                tasks.append(asyncio.ensure_future(factory()))
+                started.append(now)
+                next_at = now + hedge_s
+                continue
+
+            wake = [deadline]
+            if len(tasks) < len(candidates):
+                wake.append(next_at)
+            if hold_until is not None:
+                wake.append(hold_until)
+            pending = [t for t in tasks if not t.done()]
+            timeout = max(0.0, min(wake) - now)
+            if pending:
+                await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout)
+    finally:
+        losers = [t for t in tasks if not t.done()]
+        for t in losers:
+            t.cancel()
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    runs: List[ProviderRun] = []
+    for i, (name, _) in enumerate(candidates):
+        if i >= len(tasks):
+            runs.append(ProviderRun(name, "skipped", 0, None, None))
+            continue
+        t = tasks[i]
+        elapsed = finished[i] - started[i] if i in finished else None
+        if t.cancelled():
+            runs.append(ProviderRun(name, "cancelled", 0, None, None))
+        elif t.exception() is not None:
+            err = repr(t.exception())
+            logging.warning(f"geo race: {name} упал: {err}")
+            runs.append(ProviderRun(name, "error", 0, elapsed, err))
+        else:
+            res = _result(i) or []
+            runs.append(ProviderRun(name, "ok" if res else "empty", len(res), elapsed, None))
+
+    pois = (_result(win) or []) if win is not None else []
+    return RaceResult(candidates[win][0] if win is not None else None, pois, loop.time() - t0, runs)
@@ -0,0 +1,92 @@
+# http_client.py
+# Один пул HTTP-соединений на процесс: keep-alive, лимиты на хост, DNS-кэш.
+# Вместо `async with aiohttp.ClientSession(...)` на каждый вызов модули берут `http_client.client(...)`:
+# таймаут и заголовки задаются так же, но TCP/TLS-соединения переиспользуются между запросами.
+# Сессия создаётся в main() (start) и закрывается при остановке (close); если модуль вызван вне бота
+# (скрипт, бенчмарк) — сессия поднимется лениво при первом запросе.
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import os
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except Exception:
+        return default
+
+
+HTTP_POOL_LIMIT    = _env_int("HTTP_POOL_LIMIT", 200)      # всего соединений
+HTTP_POOL_PER_HOST = _env_int("HTTP_POOL_PER_HOST", 64)    # на один host:port (0 — без лимита)
+HTTP_DNS_TTL_S     = _env_int("HTTP_DNS_TTL_S", 300)
+HTTP_KEEPALIVE_S   = _env_int("HTTP_KEEPALIVE_S", 30)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def session() -> aiohttp.ClientSession:
+    """Общая сессия процесса (создаётся при первом обращении внутри event loop)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL_S,
+            keepalive_timeout=HTTP_KEEPALIVE_S,
+        )
+        # таймаут сессии не задаём (остаётся дефолт aiohttp, как у прежних ClientSession() без timeout=):
+        # у каждого вызова свой — через client(timeout=...) или timeout= в самом запросе
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+class SharedClient:
+    """
+    Обёртка над общей сессией с «своими» таймаутом и заголовками по умолчанию —
+    поведение как у отдельной ClientSession(timeout=..., headers=...), но без своего пула.
+    """
+
+    def __init__(self, timeout: Optional[aiohttp.ClientTimeout] = None, headers: Optional[dict] = None):
+        self._session = session()
+        self._timeout = timeout
+        self._headers = headers or {}
+
+    def request(self, method: str, url: str, **kwargs):
+        if self._headers:
+            kwargs["headers"] = {**self._headers, **(kwargs.get("headers") or {})}
+        if self._timeout is not None:
+            kwargs.setdefault("timeout", self._timeout)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def client(
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+    headers: Optional[dict] = None,
+) -> AsyncIterator[SharedClient]:
+    """`async with http_client.client(timeout=..., headers=...) as s:` — замена временной ClientSession."""
+    yield SharedClient(timeout=timeout, headers=headers)
+
+
+async def start() -> None:
+    session()
+
+
+async def close() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        # даём SSL-транспортам закрыться, иначе aiohttp пишет "Unclosed connection" при выходе
+        await asyncio.sleep(0.25)
+    _session = None
@@ -0,0 +1,141 @@
+# inventory_prep.py
+# Подготовка инвентаря один раз на снимок (inventory_snapshot.build) — чтобы фильтры не разбирали строки
+# на каждый запрос:
+#   • format/owner/city → pandas category: значения те же (экспорт CSV/XLSX не меняется), но сравнение идёт
+#     по десяткам уникальных значений, а по строкам — только выборка маски по кодам;
+#   • grp/ots/minBid строками → float (разбор «12 345,6», «50k», «1,2m» — векторно, без Python-цикла по ячейкам).
+#     Это меняет выгрузки: в кэше (Feather/CSV), /export и XLSX вместо «50k» окажется 50000.0. Колонки,
+#     которые уже числовые (int/float), не трогаются — int-овые ots/minBid так и остаются int.
+# prepare меняет переданный df на месте (тот же объект, без копии на сотни тысяч строк): вызывающий
+# (inventory_snapshot.build ← bot._set_screens из /sync_api, загрузки файла и кэша) отдаёт df насовсем.
+# Маски ниже работают и с неподготовленными колонками (загрузка из файла, срезы со своими dtype) — просто медленнее.
+# Модуль без aiogram/BOT_TOKEN, как selection/geo_index.
+from __future__ import annotations
+
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ("format", "owner", "city")
+NUMERIC_COLUMNS = ("grp", "ots", "minBid")
+
+CITY_FORMAT_ALIASES = {"CITY", "CITY_FORMAT", "CITYFORMAT", "CITYLIGHT", "ГИД", "ГИДЫ"}
+BILLBOARD_ALIASES = {"BILLBOARD", "BB"}
+
+_NUM_MULT = {"": 1.0, "k": 1_000.0, "m": 1_000_000.0}
+
+
+def _parse_number_strings(x: pd.Series) -> pd.Series:
+    x = x.astype("string").str.strip()
+    x = x.str.replace("\u00A0", "", regex=False).str.replace(" ", "", regex=False).str.replace(",", ".", regex=False)
+    parts = x.str.extract(r"^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)([kKmM]?)$")
+    num = pd.to_numeric(parts[0], errors="coerce").astype("float64")
+    mult = parts[1].fillna("").str.lower().map(_NUM_MULT).astype("float64")
+    return num * mult
+
+
+def _is_blank(x: pd.Series) -> np.ndarray:
+    return (x.isna() | x.astype("string").str.strip().isin(["", "nan", "None", "—", "-"]).fillna(True)).to_numpy(dtype=bool)
+
+
+def parse_numbers(s: pd.Series, *, strict: bool = False) -> Optional[pd.Series]:
+    """
+    float-версия колонки: '12 345,6' -> 12345.6, '50k' -> 50000, '1.2m'/'1,2m' -> 1200000, мусор -> NaN.
+    Числовые колонки возвращаются как есть (astype float). Строки разбираются по уникальным значениям
+    (в инвентаре их обычно на порядки меньше, чем строк). strict=True: None, если что-то непустое не разобралось.
+    """
+    if pd.api.types.is_numeric_dtype(s.dtype) and not pd.api.types.is_bool_dtype(s.dtype):
+        return s.astype("float64")
+    codes, uniq = pd.factorize(s, sort=False)
+    uniq = pd.Series(uniq, dtype=object)
+    parsed = _parse_number_strings(uniq).to_numpy(dtype="float64", na_value=np.nan)
+    if strict and not bool((~np.isnan(parsed) | _is_blank(uniq)).all()):
+        return None
+    values = np.append(parsed, np.nan)[codes]   # код -1 (NaN) → NaN
+    return pd.Series(values, index=s.index, name=s.name)
+
+
+def prepare(df: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """
+    Приводит колонки НА МЕСТЕ (тот же объект df, копии нет): category для format/owner/city,
+    float для строковых grp/ots/minBid. Уже числовые колонки не меняются.
+    """
+    if df is None or df.empty:
+        return df
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns and not isinstance(df[c], pd.DataFrame) and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+    for c in NUMERIC_COLUMNS:
+        if c in df.columns and not isinstance(df[c], pd.DataFrame) and not pd.api.types.is_numeric_dtype(df[c].dtype):
+            # заменяем, только если ничего не теряем: всё непустое распарсилось
+            parsed = parse_numbers(df[c], strict=True)
+            if parsed is not None:
+                df[c] = parsed
+    return df
+
+
+def _level_mask(series: pd.Series, key: Callable[[pd.Index], np.ndarray], hit: Callable[[np.ndarray], np.ndarray]) -> pd.Series:
+    """
+    Маска по уникальным значениям: key нормализует категории (upper/lower/strip), hit → bool на каждую.
+    Для category — сразу по кодам; иначе колонка факторизуется (одна проходка хэшем, без .str по строкам).
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        cats = series.cat.categories
+        codes = series.cat.codes.to_numpy()
+    else:
+        codes, cats = pd.factorize(series, sort=False)
+        cats = pd.Index(cats)
+    if len(cats) == 0:
+        return pd.Series(np.zeros(len(series), dtype=bool), index=series.index)
+    level = np.asarray(hit(key(cats)), dtype=bool)
+    level = np.append(level, False)   # код -1 (NaN) → последний элемент
+    return pd.Series(level[codes], index=series.index)
+
+
+def _upper(cats: pd.Index) -> np.ndarray:
+    return cats.astype(str).str.upper().str.strip().to_numpy(dtype=object)
+
+
+def _lower(cats: pd.Index) -> np.ndarray:
+    return cats.astype(str).str.lower().str.strip().to_numpy(dtype=object)
+
+
+def format_level_hit(keys: np.ndarray, token: str) -> np.ndarray:
+    """Какие нормализованные (UPPER) значения format подходят под токен (CITY-алиасы, BB)."""
+    t = token.strip().upper()
+    if t in CITY_FORMAT_ALIASES:
+        return np.array([k.startswith("CITY_FORMAT") for k in keys], dtype=bool)
+    if t in BILLBOARD_ALIASES:
+        return keys == "BILLBOARD"
+    return keys == t
+
+
+def format_mask(series: pd.Series, tokens: Iterable[str] | str) -> pd.Series:
+    """format совпадает с любым из токенов (без учёта регистра; CITY* — семейство CITY_FORMAT*)."""
+    toks = [tokens] if isinstance(tokens, str) else [t for t in tokens if t and t.strip()]
+
+    def hit(keys):
+        out = np.zeros(len(keys), dtype=bool)
+        for t in toks:
+            out |= format_level_hit(keys, t)
+        return out
+
+    return _level_mask(series, _upper, hit)
+
+
+def owner_mask(series: pd.Series, needles: Iterable[str]) -> pd.Series:
+    """owner содержит любую из подстрок (без учёта регистра)."""
+    needles = [n.strip().lower() for n in needles if n and n.strip()]
+    return _level_mask(series, _lower, lambda keys: np.array([any(n in k for n in needles) for k in keys], dtype=bool))
+
+
+def equals_mask(series: pd.Series, value: str) -> pd.Series:
+    """Точное совпадение без учёта регистра и крайних пробелов (город)."""
+    v = (value or "").strip().lower()
+    return _level_mask(series, _lower, lambda keys: keys == v)
+
+
+def numeric(series: pd.Series) -> pd.Series:
+    """float-колонка: подготовленная берётся как есть, иначе разбирается parse_numbers."""
+    return parse_numbers(series)
@@ -0,0 +1,107 @@
+# inventory_snapshot.py
+# Неизменяемый снимок инвентаря: df + всё, что из него посчитано (гео-сетка, радианы, индекс атрибутов),
+# и номер версии. Раньше SCREENS / SCREENS_INDEX / SCREENS_ATTRS были тремя глобалами, которые /sync_api
+# и загрузка файла меняли по очереди, — хэндлер посреди await мог взять df от новой выгрузки, а индекс
+# от старой. Теперь:
+#   • publish() строит снимок целиком (prepare + индексы) и только потом одной ссылкой делает его текущим;
+#   • хэндлер берёт current() один раз в начале запроса и до конца работает с ним, что бы ни пришло следом;
+#   • производные кэши (city_bbox по инвентарю) пересчитываются синхронно сразу после publish(), до следующего await.
+# df снимка наружу не отдаётся: выборки — take по позициям, а «весь пул» — view() (copy-on-write вид или копия),
+# так что дописанные хэндлером колонки в снимок не попадают; массивы индексов заморожены (read-only).
+# Модуль без aiogram/BOT_TOKEN, как geo_index/attr_index.
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+import attr_index
+import geo_index
+import inventory_prep
+
+
+class Snapshot(NamedTuple):
+    version: int                              # 0 — инвентаря ещё нет; каждая публикация +1
+    df: Optional[pd.DataFrame]
+    geo: Optional[geo_index.GridIndex]        # None — нет lat/lon
+    attrs: Optional[attr_index.AttrIndex]     # city/format/owner → позиции строк df
+    source: str = ""                          # откуда пришёл: cache / sync / file
+    published_at: float = 0.0
+
+    @property
+    def empty(self) -> bool:
+        return self.df is None or self.df.empty
+
+    @property
+    def rows(self) -> int:
+        return 0 if self.df is None else len(self.df)
+
+    def describe(self) -> str:
+        if self.version == 0:
+            return "v0 (пусто)"
+        age = time.time() - self.published_at
+        return f"v{self.version} ({self.source or '—'}, {self.rows} строк, {age:.0f} с назад)"
+
+
+# pandas ≥ 3 — copy-on-write всегда; в 2.x — если его включили опцией
+_COW = int(pd.__version__.split(".", 1)[0]) >= 3
+
+
+def view(df: pd.DataFrame) -> pd.DataFrame:
+    """df для выдачи наружу: при copy-on-write — неглубокая копия (данные общие, пока их не меняют), иначе полная."""
+    cow = _COW or pd.get_option("mode.copy_on_write") is True
+    return df.copy(deep=not cow)
+
+
+_EMPTY = Snapshot(version=0, df=None, geo=None, attrs=None)
+_CURRENT: Snapshot = _EMPTY
+_VERSIONS = itertools.count(1)
+_PUBLISH_LOCK = threading.Lock()
+
+
+def build(
+    df: Optional[pd.DataFrame],
+    *,
+    index: Optional[geo_index.GridIndex] = None,
+) -> Tuple[Optional[geo_index.GridIndex], Optional[attr_index.AttrIndex]]:
+    """
+    Всё производное для df: (geo, attrs). index — готовая сетка (например, из mmap кэша), если совпадает
+    по числу строк; иначе строится заново. Долгая часть публикации — идёт до захвата блокировки.
+    """
+    if df is None or df.empty:
+        return None, None
+    inventory_prep.prepare(df)   # category для format/owner/city, float для grp/ots/minBid — один раз, не в каждом фильтре
+    attrs = attr_index.AttrIndex.from_frame(df).freeze()
+
+    geo = None
+    if {"lat", "lon"}.issubset(df.columns):
+        geo = index if index is not None and index.size == len(df) else geo_index.GridIndex.from_frame(df)
+        geo.freeze()
+        geo_index.prime_coords(df, geo.lat_r, geo.lon_r)
+    return geo, attrs
+
+
+def publish(
+    df: Optional[pd.DataFrame],
+    *,
+    index: Optional[geo_index.GridIndex] = None,
+    source: str = "",
+) -> Snapshot:
+    """Построить снимок для df и сделать его текущим. Читатели видят либо старый снимок, либо новый целиком."""
+    global _CURRENT
+    geo, attrs = build(df, index=index)
+    with _PUBLISH_LOCK:
+        snap = Snapshot(
+            version=next(_VERSIONS), df=df, geo=geo, attrs=attrs,
+            source=source, published_at=time.time(),
+        )
+        _CURRENT = snap
+    return snap
+
+
+def current() -> Snapshot:
+    """Текущий снимок; брать один раз в начале запроса и дальше передавать его, а не звать current() снова."""
+    return _CURRENT
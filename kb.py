@@ -5,6 +5,8 @@ from typing import List, Dict, Any, Tuple
 import aiohttp, yaml
 from rapidfuzz import process, fuzz
 
+import http_client
+
 NOTION_TOKEN = os.getenv("NOTION_TOKEN", "")
 NOTION_DB_ID = os.getenv("NOTION_DB_ID", "")
 NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://ad-tech.notion.site/1dcc52c57a324e6d9501faca612e56b5")
@@ -57,7 +59,7 @@ async def _notion_search_raw(query: str) -> List[Dict[str, Any]]:
     }
     payload = {"query": query, "page_size": 10}
     try:
-        async with aiohttp.ClientSession() as sess:
+        async with http_client.client() as sess:
             async with sess.post("https://api.notion.com/v1/search", headers=headers, json=payload) as resp:
                 if resp.status >= 400:
                     _ = await resp.text()
@@ -0,0 +1,165 @@
+# nominatim_client.py
+# Единый клиент Nominatim для всего бота (geo_nominatim, bot._nominatim_search/_gc_nominatim, city_bbox).
+# Политика публичного сервера — не больше 1 запроса в секунду с узнаваемым User-Agent, поэтому:
+#   • token bucket на процесс (NOMINATIM_RPS, для своего инстанса можно поднять);
+#   • одинаковые запросы «в полёте» склеиваются в один (single-flight);
+#   • очередь ожидания ограничена по длине и времени — при наплыве быстро отвечаем NominatimBusy,
+#     вызывающий код переходит к другому провайдеру, а не копит запросы и не ловит 429;
+#   • 429/503 с Retry-After ставят паузу всему клиенту.
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+import geo_cache
+import http_client
+from adaptive_http import retry_after_seconds
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+NOMINATIM_URL             = os.getenv("NOMINATIM_URL") or "https://nominatim.openstreetmap.org/search"
+NOMINATIM_UA              = os.getenv("NOMINATIM_UA") or "OmnikaBot/1.0 (+https://example.com; contact: youremail@example.com)"
+NOMINATIM_RPS             = _env_float("NOMINATIM_RPS", 1.0)
+NOMINATIM_BURST           = _env_float("NOMINATIM_BURST", 1)
+NOMINATIM_QUEUE_MAX       = int(_env_float("NOMINATIM_QUEUE_MAX", 20))
+NOMINATIM_QUEUE_TIMEOUT_S = _env_float("NOMINATIM_QUEUE_TIMEOUT_S", 15)
+NOMINATIM_TIMEOUT_S       = _env_float("NOMINATIM_TIMEOUT_S", 20)
+
+
+class NominatimBusy(RuntimeError):
+    """Запрос не отправлен: очередь полна, ждали дольше таймаута или сервер попросил паузу."""
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе; ожидающие обслуживаются по очереди (FIFO)."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = max(float(rate), 1e-3)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def pause(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._refill(now)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0 and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep(max(wait, (1.0 - self._tokens) / self.rate, 0.01))
+
+
+class NominatimClient:
+    def __init__(
+        self,
+        url: str = NOMINATIM_URL,
+        user_agent: str = NOMINATIM_UA,
+        rps: float = NOMINATIM_RPS,
+        burst: float = NOMINATIM_BURST,
+        queue_max: int = NOMINATIM_QUEUE_MAX,
+        queue_timeout_s: float = NOMINATIM_QUEUE_TIMEOUT_S,
+        timeout_s: float = NOMINATIM_TIMEOUT_S,
+    ):
+        self.url = url
+        self.user_agent = user_agent
+        self.bucket = TokenBucket(rps, burst)
+        self.queue_max = max(1, int(queue_max))
+        self.queue_timeout_s = float(queue_timeout_s)
+        self.timeout_s = float(timeout_s)
+        self._waiting = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"requests": 0, "coalesced": 0, "rejected": 0, "timeouts": 0, "throttled": 0, "errors": 0}
+
+    async def search(self, params: Dict[str, Any], *, ssl: Any = None) -> list:
+        """GET /search с params → JSON-список ([] на не-200). NominatimBusy — если не дождались очереди."""
+        key = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._queued(params, ssl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        # shield: отмена одного ожидающего (проигравший в гонке /geo) не срывает запрос остальным
+        data = await asyncio.shield(task)
+        if data is None:
+            geo_cache.mark_failed()   # [] от ошибки HTTP — не «ничего не найдено», в кэш геокодинга не кладём
+            return []
+        return data
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()   # помечаем как полученное, даже если все ожидающие ушли
+
+    async def _queued(self, params: Dict[str, Any], ssl: Any) -> Optional[list]:
+        if self._waiting >= self.queue_max:
+            self.stats["rejected"] += 1
+            raise NominatimBusy(f"Nominatim: очередь заполнена ({self._waiting} запросов)")
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self.bucket.acquire(), timeout=self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise NominatimBusy(f"Nominatim: не дождались очереди за {self.queue_timeout_s:.0f} с") from None
+        finally:
+            self._waiting -= 1
+        return await self._get(params, ssl)
+
+    async def _get(self, params: Dict[str, Any], ssl: Any) -> Optional[list]:
+        """JSON-список ответа; None — не-200 (search отдаст [] и отметит ошибку)."""
+        self.stats["requests"] += 1
+        kwargs: Dict[str, Any] = {"params": params}
+        if ssl is not None:
+            kwargs["ssl"] = ssl
+        async with http_client.client(headers={"User-Agent": self.user_agent},
+                                      timeout=aiohttp.ClientTimeout(total=self.timeout_s)) as s:
+            async with s.get(self.url, **kwargs) as r:
+                if r.status in (429, 503):
+                    pause = retry_after_seconds(r.headers.get("Retry-After")) or 5.0
+                    self.bucket.pause(pause)
+                    self.stats["throttled"] += 1
+                    logging.warning(f"Nominatim HTTP {r.status}: пауза {pause:.0f} с")
+                    raise NominatimBusy(f"Nominatim перегружен (HTTP {r.status})")
+                if r.status != 200:
+                    self.stats["errors"] += 1
+                    _ = await r.text()
+                    return None
+                data = await r.json(content_type=None)
+        return data if isinstance(data, list) else []
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"{self.bucket.rate:g} rps, в очереди {self._waiting}/{self.queue_max}, в полёте {len(self._inflight)} | "
+                f"запросов {s['requests']}, склеено {s['coalesced']}, отказов {s['rejected']}+{s['timeouts']} (очередь), "
+                f"429/503 {s['throttled']}, ошибок {s['errors']}")
+
+
+CLIENT = NominatimClient()
@@ -0,0 +1,195 @@
+# overpass_health.py
+# Здоровье зеркал Overpass: EWMA задержки и доли ошибок по каждому URL + circuit breaker.
+# Зеркала перебираются от самого здорового; «выбитое» (N ошибок подряд) пропускается на cooldown,
+# после паузы получает один пробный запрос. Опционально два лучших зеркала запрашиваются наперегонки.
+# Один трекер на процесс — его используют overpass_provider.search_overpass и bot._overpass_search.
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except Exception:
+        return default
+
+
+OVERPASS_EWMA_ALPHA       = _env_float("OVERPASS_EWMA_ALPHA", 0.3)
+OVERPASS_BREAKER_FAILS    = int(_env_float("OVERPASS_BREAKER_FAILS", 3))     # ошибок подряд до размыкания
+OVERPASS_BREAKER_COOLDOWN = _env_float("OVERPASS_BREAKER_COOLDOWN_S", 30)    # первая пауза, дальше ×2
+OVERPASS_BREAKER_MAX_S    = _env_float("OVERPASS_BREAKER_MAX_S", 300)
+OVERPASS_RACE_TOP         = int(_env_float("OVERPASS_RACE_TOP", 1))          # 2 — два лучших зеркала наперегонки
+
+_UNKNOWN_LATENCY_S = 1.0   # оценка для зеркала без истории: новое зеркало быстро получает шанс
+# ошибка в самом Overpass QL: зеркало живое, другие ответят так же — дальше не идём.
+# Любой другой не-200 (403/404/410 у выключенного или закрытого зеркала, ошибки прокси, 5xx) — вина зеркала.
+_QUERY_ERROR = {400}
+
+
+class MirrorHealth:
+    def __init__(self, url: str):
+        self.url = url
+        self.latency_s: Optional[float] = None   # EWMA по успешным ответам
+        self.error_rate = 0.0                    # EWMA 0/1 по всем ответам
+        self.ok = 0
+        self.failed = 0
+        self.consecutive_fails = 0
+        self.open_until = 0.0
+        self.trips = 0
+        self.last_error: Optional[str] = None
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) < self.open_until
+
+    def score(self) -> float:
+        """Чем меньше, тем лучше: ожидаемая задержка, штраф за долю ошибок."""
+        lat = self.latency_s if self.latency_s is not None else _UNKNOWN_LATENCY_S
+        return lat * (1.0 + 4.0 * self.error_rate)
+
+    def state(self, now: Optional[float] = None) -> str:
+        now = now or time.monotonic()
+        if self.is_open(now):
+            return f"open {self.open_until - now:.0f}с"
+        if self.consecutive_fails >= OVERPASS_BREAKER_FAILS:
+            return "half-open"
+        return "ok"
+
+
+class MirrorTracker:
+    def __init__(self, alpha: float = OVERPASS_EWMA_ALPHA):
+        self.alpha = float(alpha)
+        self._mirrors: Dict[str, MirrorHealth] = {}
+
+    def register(self, urls: Iterable[str]) -> None:
+        for u in urls:
+            self._mirrors.setdefault(u, MirrorHealth(u))
+
+    def _get(self, url: str) -> MirrorHealth:
+        return self._mirrors.setdefault(url, MirrorHealth(url))
+
+    def order(self, urls: Iterable[str]) -> List[str]:
+        """Замкнутые — по score; разомкнутые — в конец (крайний случай, если остальные не ответили)."""
+        now = time.monotonic()
+        hs = [self._get(u) for u in urls]
+        closed = sorted((h for h in hs if not h.is_open(now)), key=lambda h: h.score())
+        opened = sorted((h for h in hs if h.is_open(now)), key=lambda h: h.open_until)
+        return [h.url for h in closed + opened]
+
+    def record_success(self, url: str, latency_s: float) -> None:
+        h = self._get(url)
+        a = self.alpha
+        h.latency_s = latency_s if h.latency_s is None else (1 - a) * h.latency_s + a * latency_s
+        h.error_rate = (1 - a) * h.error_rate
+        h.ok += 1
+        h.consecutive_fails = 0
+        h.open_until = 0.0
+        h.trips = 0
+
+    def record_failure(self, url: str, error: str) -> None:
+        h = self._get(url)
+        a = self.alpha
+        h.error_rate = (1 - a) * h.error_rate + a
+        h.failed += 1
+        h.consecutive_fails += 1
+        h.last_error = error
+        if h.consecutive_fails >= OVERPASS_BREAKER_FAILS:
+            cooldown = min(OVERPASS_BREAKER_MAX_S, OVERPASS_BREAKER_COOLDOWN * (2 ** h.trips))
+            h.open_until = time.monotonic() + cooldown
+            h.trips += 1
+            logging.warning(f"overpass: {url} выключен на {cooldown:.0f} с ({error})")
+
+    def table(self) -> str:
+        now = time.monotonic()
+        rows = []
+        for url in self.order(self._mirrors):
+            h = self._mirrors[url]
+            lat = f"{h.latency_s:.1f}с" if h.latency_s is not None else "—"
+            host = url.split("//", 1)[-1].split("/", 1)[0]
+            rows.append(f"{host}: {h.state(now)}, ewma {lat}, ошибок {h.error_rate * 100:.0f}% ({h.ok}✓/{h.failed}✗)")
+        return "\n".join(rows) if rows else "—"
+
+    async def _post_one(self, session: Any, url: str, payload: bytes, kwargs: dict) -> Tuple[str, Optional[dict], bool]:
+        """(url, data, fatal). data=None — зеркало не справилось; fatal — ошибка запроса, другие зеркала не помогут."""
+        t0 = time.monotonic()
+        try:
+            async with session.post(url, data=payload, **kwargs) as r:
+                if r.status != 200:
+                    txt = (await r.text())[:120]
+                    if r.status not in _QUERY_ERROR:
+                        self.record_failure(url, f"HTTP {r.status}")
+                        return url, None, False
+                    self.record_success(url, time.monotonic() - t0)
+                    logging.warning(f"overpass: {url} HTTP {r.status}: {txt}")
+                    return url, None, True
+                data = await r.json(content_type=None)
+        except asyncio.CancelledError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.record_failure(url, type(e).__name__)
+            return url, None, False
+        remark = (data or {}).get("remark", "") if isinstance(data, dict) else ""
+        if "runtime error" in remark.lower():
+            # таймаут/память на стороне сервера: 200, но данных нет
+            self.record_failure(url, "runtime error")
+            return url, None, False
+        self.record_success(url, time.monotonic() - t0)
+        return url, data, False
+
+    async def post(
+        self,
+        session: Any,
+        urls: Iterable[str],
+        query: str,
+        *,
+        headers: Optional[dict] = None,
+        ssl: Any = None,
+        timeout_s: float = 40.0,
+        race_top: int = OVERPASS_RACE_TOP,
+    ) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        POST Overpass QL по зеркалам в порядке здоровья. Возвращает (url, json) первого ответившего
+        или (None, None). race_top ≥ 2 — первые race_top зеркал опрашиваются одновременно.
+        """
+        payload = query.encode("utf-8")
+        kwargs: Dict[str, Any] = {"timeout": aiohttp.ClientTimeout(total=timeout_s)}
+        if headers:
+            kwargs["headers"] = headers
+        if ssl is not None:
+            kwargs["ssl"] = ssl
+        order = self.order(urls)
+        head, rest = order[:max(1, race_top)], order[max(1, race_top):]
+
+        if len(head) > 1:
+            tasks = [asyncio.ensure_future(self._post_one(session, u, payload, kwargs)) for u in head]
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    url, data, fatal = await fut
+                    if data is not None:
+                        return url, data
+                    if fatal:
+                        return None, None
+            finally:
+                for t in tasks:
+                    if not t.done():
+                        t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        else:
+            rest = order
+
+        for u in rest:
+            url, data, fatal = await self._post_one(session, u, payload, kwargs)
+            if data is not None:
+                return url, data
+            if fatal:
+                break
+        return None, None
+
+
+TRACKER = MirrorTracker()
@@ -1,38 +1,25 @@
 # overpass_provider.py
-import aiohttp
 from typing import List, Dict, Optional, Tuple
 
+import http_client
+from city_bbox import RESOLVER as CITY_BBOXES
+from geo_cache import cached_geocoder, mark_failed
+from overpass_health import TRACKER as MIRRORS
+
 OVERPASS_URLS = [
     "https://overpass-api.de/api/interpreter",
     "https://overpass.openstreetmap.ru/api/interpreter",
     "https://lz4.overpass-api.de/api/interpreter",
 ]
+MIRRORS.register(OVERPASS_URLS)
 UA = "OmnikaBot/1.0 (+https://example.com; contact: youremail@example.com)"
 
-# bbox по городам (min_lon, min_lat, max_lon, max_lat)
-CITY_BBOX: dict[str, Tuple[float, float, float, float]] = {
-    # Москва
-    "москва": (37.2, 55.4, 37.95, 56.05),
-    "moscow": (37.2, 55.4, 37.95, 56.05),
-    "мск": (37.2, 55.4, 37.95, 56.05),
-    # Санкт-Петербург
-    "санкт-петербург": (29.4, 59.65, 31.0, 60.3),
-    "санкт петербург": (29.4, 59.65, 31.0, 60.3),
-    "спб": (29.4, 59.65, 31.0, 60.3),
-    "питер": (29.4, 59.65, 31.0, 60.3),
-    # Химки
-    "химки": (37.30, 55.84, 37.57, 56.02),
-    # Воронеж
-    "воронеж": (39.0, 51.5, 39.5, 51.9),
-    # Казань
-    "казань": (48.9, 55.65, 49.3, 55.95),
-}
-
 def _norm(s: Optional[str]) -> str:
     return (s or "").strip().lower()
 
-def _bbox_for_city(city: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
-    return CITY_BBOX.get(_norm(city))
+async def _bbox_for_city(city: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """(min_lon, min_lat, max_lon, max_lat): с диска/по инвентарю, иначе один раз из Nominatim."""
+    return await CITY_BBOXES.resolve(city)
 
 def _is_category(query: str) -> bool:
     q = _norm(query)
@@ -53,10 +40,13 @@ def _tag_filter(query: str) -> str:
     # если это бренд/имя (якитория, икеа, оби, твой дом и т.д.)
     return f'["name"~"{query}", i]'
 
+@cached_geocoder("overpass")
 async def search_overpass(query: str, city: Optional[str] = None, limit: int = 10) -> List[Dict]:
-    bbox = _bbox_for_city(city)
+    bbox = await _bbox_for_city(city)
     if not bbox:
         # без bbox запрос может быть очень тяжёлым — лучше пусто, чем таймаут на весь бот
+        if city:
+            mark_failed()   # bbox города мог не найтись из-за сбоя Nominatim — пустой ответ не кэшируем
         return []
     min_lon, min_lat, max_lon, max_lat = bbox
     tag = _tag_filter(query)
@@ -71,29 +61,20 @@ async def search_overpass(query: str, city: Optional[str] = None, limit: int = 1
     out center {min(int(limit or 10), 50)};
     """
 
-    headers = {"User-Agent": UA}
-    for url in OVERPASS_URLS:
-        try:
-            async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=40)) as sess:
-                async with sess.post(url, data=ql.encode("utf-8")) as r:
-                    if r.status != 200:
-                        _ = await r.text()
-                        continue
-                    data = await r.json()
-            elements = data.get("elements", [])
-            out: List[Dict] = []
-            for el in elements:
-                if "lat" in el and "lon" in el:
-                    lat, lon = el["lat"], el["lon"]
-                elif "center" in el and el["center"]:
-                    lat, lon = el["center"].get("lat"), el["center"].get("lon")
-                else:
-                    continue
-                name = (el.get("tags", {}) or {}).get("name") or query
-                out.append({"name": name, "address": name, "lat": lat, "lon": lon, "provider": "overpass"})
-            if out:
-                return out[: min(len(out), limit or 10)]
-        except Exception:
-            # пробуем следующий зеркало
+    # зеркала — от самого здорового; выбитые (circuit breaker) в конце
+    async with http_client.client(headers={"User-Agent": UA}) as sess:
+        _, data = await MIRRORS.post(sess, OVERPASS_URLS, ql, timeout_s=40)
+    if not data:
+        mark_failed()   # все зеркала упали — это не «ничего не найдено»
+        return []
+    out: List[Dict] = []
+    for el in data.get("elements", []):
+        if "lat" in el and "lon" in el:
+            lat, lon = el["lat"], el["lon"]
+        elif "center" in el and el["center"]:
+            lat, lon = el["center"].get("lat"), el["center"].get("lon")
+        else:
             continue
-    return []
\ No newline at end of file
+        name = (el.get("tags", {}) or {}).get("name") or query
+        out.append({"name": name, "address": name, "lat": lat, "lon": lon, "provider": "overpass"})
+    return out[: min(len(out), limit or 10)]
\ No newline at end of file
@@ -0,0 +1,345 @@
+# poi_index.py
+# Локальный индекс POI по категориям из выгрузки OSM — категорийные запросы («аптека», «тц», «школа»,
+# «парковка») /geo и /near_geo отвечаются с диска за миллисекунды, без Overpass.
+# Имена и бренды («Твой дом», «Якитория») сюда не попадают — для них по-прежнему Overpass/Nominatim.
+#
+# Сборка (один раз, на сервере или локально):
+#   python poi_index.py build russia-latest.osm.pbf        # нужен pyosmium (pip install osmium)
+#   python poi_index.py build moscow.geojson [out_dir]     # GeoJSON / GeoJSONSeq (osmium export, overpass turbo)
+#   python poi_index.py query аптека Москва
+# Формат на диске (POI_INDEX_DIR): meta.json + lat/lon/keys/rank .npy (mmap) + names.json.
+# Строки отсортированы по ключу (категория, ячейка сетки) — запрос по bbox это пара searchsorted на ряд ячеек.
+# rank — место строки в порядке выдачи (по имени без регистра, безымянные в конце): limit отрезается numpy,
+# в Python сортируются только limit строк. Индекс без rank.npy (собран раньше) считает его при первом запросе.
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+POI_INDEX_DIR = Path(os.getenv("POI_INDEX_DIR") or Path(os.getenv("SCREENS_CACHE_DIR", "/tmp/omnika_cache")) / "poi_index")
+POI_CELL_DEG = 0.05
+POI_INDEX_VERSION = 1
+
+# (ключ, значение) OSM → шаблоны слов запроса (целые токены, \w* — окончания)
+CATEGORIES: List[Tuple[Tuple[str, str], List[str]]] = [
+    (("amenity", "pharmacy"),      [r"аптек\w*", r"pharmac\w*"]),
+    (("shop", "mall"),             [r"тц", r"трц", r"торгов\w*(?:\s+центр\w*)?", r"молл\w*", r"mall\w*"]),
+    (("amenity", "school"),        [r"школ\w*", r"schools?"]),
+    (("amenity", "kindergarten"),  [r"детск\w*\s+сад\w*", r"садик\w*", r"kindergartens?"]),
+    (("amenity", "hospital"),      [r"больниц\w*", r"hospitals?"]),
+    (("amenity", "clinic"),        [r"поликлиник\w*", r"clinics?"]),
+    (("amenity", "university"),    [r"университет\w*", r"вуз\w*", r"universit\w*"]),
+    (("amenity", "cinema"),        [r"кинотеатр\w*", r"кино", r"cinemas?"]),
+    (("amenity", "theatre"),       [r"театр\w*", r"theatres?"]),
+    (("tourism", "museum"),        [r"музе\w+", r"museums?"]),
+    (("amenity", "parking"),       [r"парковк\w*", r"parkings?"]),
+    (("leisure", "stadium"),       [r"стадион\w*", r"stadiums?"]),
+    (("amenity", "marketplace"),   [r"рын(?:ок|к\w+)"]),
+    (("leisure", "park"),          [r"парк(?:и|а|ов|ам|ах|е)?", r"parks?"]),
+    (("railway", "station"),       [r"вокзал\w*"]),
+    (("aeroway", "aerodrome"),     [r"аэропорт\w*", r"airports?"]),
+]
+CATEGORY_KEYS = [kv for kv, _ in CATEGORIES]
+
+# слова, которые не делают запрос «именным»: «аптеки рядом», «все школы в городе»
+_STOP = re.compile(r"^(?:в|во|на|у|по|рядом|около|возле|все|всех|г|город\w*|ближайш\w*|near|all|in)$")
+_CATEGORY_RX = [
+    (kv, re.compile(r"(?<![\w-])(?:" + "|".join(pats) + r")(?![\w-])")) for kv, pats in CATEGORIES
+]
+
+
+def detect_category(query: str) -> Optional[Tuple[str, str]]:
+    """(key, value), если запрос — «чистая» категория; None для брендов/имён («аптека Ригла», «Твой дом»)."""
+    t = re.sub(r"\s+", " ", (query or "").lower().replace("ё", "е")).strip(" .,!?\"'«»")
+    if not t:
+        return None
+    for kv, rx in _CATEGORY_RX:
+        if not rx.search(t):
+            continue
+        rest = [w for w in re.findall(r"[\w-]+", rx.sub(" ", t)) if not _STOP.match(w)]
+        if not rest:
+            return kv
+    return None
+
+
+# ---------- сборка ----------
+
+def _centroid(coords) -> Optional[Tuple[float, float]]:
+    """Среднее всех вершин GeoJSON-геометрии (для POI-полигонов этого достаточно): (lat, lon)."""
+    xs: List[float] = []
+    ys: List[float] = []
+
+    def walk(c):
+        if isinstance(c, (list, tuple)) and c and isinstance(c[0], (int, float)):
+            xs.append(float(c[0])); ys.append(float(c[1]))
+        elif isinstance(c, (list, tuple)):
+            for x in c:
+                walk(x)
+
+    walk(coords)
+    if not xs:
+        return None
+    return sum(ys) / len(ys), sum(xs) / len(xs)
+
+
+def _iter_geojson(path: Path) -> Iterator[Tuple[dict, float, float]]:
+    """(tags, lat, lon) из FeatureCollection или построчного GeoJSONSeq."""
+    def features():
+        with open(path, "r", encoding="utf-8") as f:
+            head = f.read(1)
+            while head and head.isspace():
+                head = f.read(1)
+            f.seek(0)
+            if head == "{":
+                try:
+                    data = json.load(f)
+                except ValueError:   # не один объект — значит, GeoJSONSeq с расширением .geojson
+                    f.seek(0)
+                else:
+                    yield from (data.get("features") or [data])
+                    return
+            for line in f:
+                line = line.strip().lstrip("\x1e")   # RFC 8142: записи начинаются с RS
+                if line:
+                    yield json.loads(line)
+
+    for feat in features():
+        props = feat.get("properties") or {}
+        tags = props.get("tags") if isinstance(props.get("tags"), dict) else props
+        geom = feat.get("geometry") or {}
+        ll = _centroid(geom.get("coordinates"))
+        if ll is not None:
+            yield tags, ll[0], ll[1]
+
+
+def _iter_pbf(path: Path) -> Iterator[Tuple[dict, float, float]]:
+    try:
+        import osmium  # type: ignore
+    except Exception as e:
+        raise RuntimeError("для .pbf нужен pyosmium: pip install osmium (или экспортируйте GeoJSON через osmium export)") from e
+
+    keys = {k for k, _ in CATEGORY_KEYS}
+    out: List[Tuple[dict, float, float]] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if any(k in n.tags for k in keys) and n.location.valid():
+                out.append((dict(n.tags), n.location.lat, n.location.lon))
+
+        def area(self, a):
+            if not any(k in a.tags for k in keys):
+                return
+            lats, lons = [], []
+            for ring in a.outer_rings():
+                for nd in ring:
+                    if nd.location.valid():
+                        lats.append(nd.lat); lons.append(nd.lon)
+            if lats:
+                out.append((dict(a.tags), sum(lats) / len(lats), sum(lons) / len(lons)))
+
+    Handler().apply_file(str(path), locations=True)
+    yield from out
+
+
+class PoiIndex:
+    def __init__(self, meta: dict, lat: np.ndarray, lon: np.ndarray, keys: np.ndarray, names: List[str],
+                 rank: Optional[np.ndarray] = None):
+        self.meta = meta
+        self.cell_deg = float(meta.get("cell_deg", POI_CELL_DEG))
+        self.n_cols = int(np.ceil(360.0 / self.cell_deg)) + 1
+        self.n_cells = (int(np.ceil(180.0 / self.cell_deg)) + 1) * self.n_cols
+        self.categories = [tuple(c.split("=", 1)) for c in meta["categories"]]
+        self._code = {kv: i for i, kv in enumerate(self.categories)}
+        self.lat, self.lon, self.keys, self.names = lat, lon, keys, names
+        self._rank = rank
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # --- сборка/загрузка ---
+
+    @classmethod
+    def build(cls, source, out_dir=POI_INDEX_DIR, cell_deg: float = POI_CELL_DEG) -> "PoiIndex":
+        source = Path(source)
+        rows = _iter_pbf(source) if source.suffix.lower() == ".pbf" else _iter_geojson(source)
+        cats = [f"{k}={v}" for k, v in CATEGORY_KEYS]
+        n_cols = int(np.ceil(360.0 / cell_deg)) + 1
+        n_cells = (int(np.ceil(180.0 / cell_deg)) + 1) * n_cols
+        lat_l: List[float] = []; lon_l: List[float] = []; code_l: List[int] = []; names: List[str] = []
+        for tags, lat, lon in rows:
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                continue
+            for code, (k, v) in enumerate(CATEGORY_KEYS):
+                if tags.get(k) == v:
+                    lat_l.append(lat); lon_l.append(lon); code_l.append(code)
+                    names.append(str(tags.get("name") or tags.get("brand") or ""))
+        lat = np.asarray(lat_l, dtype=np.float32)
+        lon = np.asarray(lon_l, dtype=np.float32)
+        iy = np.floor((lat.astype(np.float64) + 90.0) / cell_deg).astype(np.int64)
+        ix = np.floor((lon.astype(np.float64) + 180.0) / cell_deg).astype(np.int64)
+        keys = np.asarray(code_l, dtype=np.int64) * n_cells + iy * n_cols + ix
+        order = np.argsort(keys, kind="stable")
+        meta = {
+            "version": POI_INDEX_VERSION, "cell_deg": cell_deg, "categories": cats, "rows": int(len(keys)),
+            "source": source.name, "built_at": time.time(),
+            "per_category": {cats[c]: int(n) for c, n in zip(*np.unique(np.asarray(code_l, dtype=np.int64), return_counts=True))},
+        }
+        self = cls(meta, lat[order], lon[order], keys[order], [names[i] for i in order])
+        self.name_rank()
+        self.save(out_dir)
+        return self
+
+    def save(self, out_dir) -> None:
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for name in ("lat", "lon", "keys", "rank"):
+            arr = self.name_rank() if name == "rank" else getattr(self, name)
+            tmp = out_dir / f"{name}.tmp.npy"
+            np.save(tmp, np.ascontiguousarray(arr))
+            os.replace(tmp, out_dir / f"{name}.npy")
+        for name, obj in (("names.json", self.names), ("meta.json", self.meta)):   # meta последней — признак целостности
+            tmp = out_dir / (name + ".tmp")
+            tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, out_dir / name)
+
+    @classmethod
+    def load(cls, directory=POI_INDEX_DIR) -> Optional["PoiIndex"]:
+        directory = Path(directory)
+        try:
+            meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+            if meta.get("version") != POI_INDEX_VERSION:
+                return None
+            arrays = {n: np.load(directory / f"{n}.npy", mmap_mode="r") for n in ("lat", "lon", "keys")}
+            names = json.loads((directory / "names.json").read_text(encoding="utf-8"))
+            rank_path = directory / "rank.npy"
+            rank = np.load(rank_path, mmap_mode="r") if rank_path.exists() else None
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            # обрезанный meta.json/names.json (JSONDecodeError) или .npy — считаем, что индекса нет
+            logging.warning(f"poi_index: повреждённые файлы в {directory}: {e}")
+            return None
+        if not (len(arrays["lat"]) == len(arrays["lon"]) == len(arrays["keys"]) == len(names)):
+            logging.warning(f"poi_index: несогласованные файлы в {directory}")
+            return None
+        if rank is not None and len(rank) != len(names):
+            rank = None   # от другой сборки — пересчитаем
+        return cls(meta, arrays["lat"], arrays["lon"], arrays["keys"], names, rank)
+
+    def name_rank(self) -> np.ndarray:
+        """Место каждой строки в порядке выдачи: по имени без регистра, безымянные в конце, при равенстве — по позиции."""
+        if self._rank is None:
+            order = sorted(range(len(self.names)), key=lambda i: (self.names[i] == "", self.names[i].lower()))
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[np.asarray(order, dtype=np.int64)] = np.arange(len(order), dtype=np.int64)
+            self._rank = rank
+        return self._rank
+
+    # --- запросы ---
+
+    def search(self, category: Tuple[str, str], bbox: Tuple[float, float, float, float], limit: int = 10) -> List[Dict]:
+        """POI категории в bbox=(min_lon, min_lat, max_lon, max_lat), по имени; limit<=0 — все."""
+        code = self._code.get(tuple(category))
+        if code is None:
+            return []
+        min_lon, min_lat, max_lon, max_lat = map(float, bbox)
+        iy0 = int(np.floor((min_lat + 90.0) / self.cell_deg)); iy1 = int(np.floor((max_lat + 90.0) / self.cell_deg))
+        ix0 = int(np.floor((min_lon + 180.0) / self.cell_deg)); ix1 = int(np.floor((max_lon + 180.0) / self.cell_deg))
+        base = code * self.n_cells + np.arange(iy0, iy1 + 1, dtype=np.int64) * self.n_cols
+        lo = np.searchsorted(self.keys, base + ix0, side="left")
+        hi = np.searchsorted(self.keys, base + ix1, side="right")
+        parts = [np.arange(a, b) for a, b in zip(lo, hi) if b > a]
+        if not parts:
+            return []
+        pos = np.concatenate(parts)
+        lat = self.lat[pos]; lon = self.lon[pos]
+        pos = pos[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)]
+        rank = self.name_rank()[pos]
+        if limit and 0 < limit < len(pos):
+            keep = np.argpartition(rank, limit - 1)[:limit]   # limit лучших без полной сортировки
+            pos, rank = pos[keep], rank[keep]
+        pos = pos[np.argsort(rank)].tolist()
+        k, v = self.categories[code]
+        return [{
+            "name": self.names[i] or f"{k}={v}",
+            "address": "",
+            "lat": round(float(self.lat[i]), 6),
+            "lon": round(float(self.lon[i]), 6),
+            "provider": "osm_local",
+            "raw": {"tags": {k: v}},
+        } for i in pos]
+
+    def summary(self) -> str:
+        m = self.meta
+        built = time.strftime("%Y-%m-%d %H:%M", time.localtime(m.get("built_at", 0)))
+        return f"{m.get('rows', len(self))} POI, {len(self.categories)} категорий, из {m.get('source')} ({built})"
+
+
+_INDEX: Optional[PoiIndex] = None
+_INDEX_MTIME: Optional[float] = None
+
+
+def get_index(directory=POI_INDEX_DIR) -> Optional[PoiIndex]:
+    """Индекс с диска; перечитывается, если meta.json пересобрали. None — индекса нет."""
+    global _INDEX, _INDEX_MTIME
+    meta = Path(directory) / "meta.json"
+    try:
+        mtime = meta.stat().st_mtime
+    except OSError:
+        _INDEX = _INDEX_MTIME = None
+        return None
+    if _INDEX is None or mtime != _INDEX_MTIME:
+        _INDEX = PoiIndex.load(directory)
+        _INDEX_MTIME = mtime
+    return _INDEX
+
+
+async def search_local(query: str, city: Optional[str], limit: int = 10) -> Optional[List[Dict]]:
+    """
+    Категорийный запрос по локальному индексу. None — запрос не для индекса (имя/бренд, нет индекса
+    или города); [] — индекс есть, но в bbox города пусто (вероятно, выгрузка его не покрывает).
+    """
+    cat = detect_category(query)
+    if cat is None or not city:
+        return None
+    idx = get_index()
+    if idx is None:
+        return None
+    import city_bbox   # bbox города: с диска/по инвентарю, Nominatim — один раз на город
+    bbox = await city_bbox.RESOLVER.resolve(city)
+    if bbox is None:
+        return None
+    return idx.search(cat, bbox, limit=limit)
+
+
+def summary() -> str:
+    idx = get_index()
+    return idx.summary() if idx is not None else f"нет (соберите: python poi_index.py build <extract>, каталог {POI_INDEX_DIR})"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 3 and sys.argv[1] == "build":
+        t0 = time.perf_counter()
+        idx = PoiIndex.build(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else POI_INDEX_DIR)
+        print(f"{idx.summary()} за {time.perf_counter() - t0:.1f} с")
+        for cat, n in sorted(idx.meta["per_category"].items(), key=lambda x: -x[1]):
+            print(f"  {cat}: {n}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "query":
+        import asyncio
+        t0 = time.perf_counter()
+        res = asyncio.run(search_local(sys.argv[2], sys.argv[3], limit=20))
+        print(f"{'—' if res is None else len(res)} за {(time.perf_counter() - t0) * 1000:.1f} мс")
+        for p in res or []:
+            print(f"  {p['name']}: {p['lat']}, {p['lon']}")
+    else:
+        print("python poi_index.py build <extract.osm.pbf|.geojson|.geojsonseq> [out_dir]\n"
+              "python poi_index.py query <категория> <город>")
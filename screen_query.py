@@ -0,0 +1,327 @@
+# screen_query.py
+# Единый движок подбора экранов для /pick_city, /pick_at, /plan, /near, /near_geo и /forecast.
+# Команда описывает, ЧТО нужно (ScreenQuery: город, форматы, владельцы, радиус/центры, пороги, стратегия
+# выбора), а run() решает, в каком порядке:
+#   1) city/format/owner — по индексу атрибутов (точные размеры без прохода по строкам), от самого короткого;
+#   2) bbox — одно векторное сравнение радиан (по выжившим позициям, если они уже есть);
+#   3) радиус — по меньшему из двух: кандидатам гео-сетки или уже отобранным позициям;
+#   4) пороги grp/ots — только по выжившим строкам.
+# До конца живут массивы позиций; DataFrame собирается один раз (без промежуточных .copy()).
+# Выбор (spread/mix/top по OTS) — select(): чистая функция, её гоняют в пуле процессов (см. executors).
+# Модуль без aiogram/BOT_TOKEN, как selection/geo_index.
+from __future__ import annotations
+
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import attr_index
+import geo_index
+import inventory_prep
+import inventory_snapshot
+from selection import _select_with_mix, spread_frame, spread_positions_rad
+
+MIN_BID_COLUMNS = ("minBid", "min_bid", "min_bid_rub", "min_bid_rur")
+
+STRATEGIES = ("all", "spread", "mix", "top_ots")
+
+
+class ScreenQuery(NamedTuple):
+    city: Optional[str] = None
+    formats: Tuple[str, ...] = ()
+    owners: Tuple[str, ...] = ()
+    center: Optional[Tuple[float, float]] = None      # один центр + radius_km → колонки geo_index.within_radius
+    centers: Tuple[Tuple[float, float], ...] = ()     # много центров (near_geo) → те же колонки + center_idx
+    radius_km: Optional[float] = None
+    bbox: Optional[Tuple[float, float, float, float]] = None   # (min_lon, min_lat, max_lon, max_lat), как city_bbox
+    nearest_only: bool = True                         # для centers: каждый экран один раз, к ближайшему
+    grp_min: Optional[float] = None
+    ots_min: Optional[float] = None
+    min_bid: bool = False                             # добавить min_bid_used / min_bid_source
+    prefer_formats: bool = False                      # без formats: BB → SUPERSITE → CITY_FORMAT* → остальное
+    strategy: str = "all"                             # см. STRATEGIES
+    n: int = 0
+    mix: Optional[str] = None
+    shuffle: bool = False
+    random_start: bool = True
+    seed: Optional[int] = None
+
+
+class Step(NamedTuple):
+    name: str
+    rows: int
+
+
+class QueryResult(NamedTuple):
+    frame: pd.DataFrame
+    steps: List[Step]
+    elapsed_ms: float
+
+    @property
+    def empty_at(self) -> Optional[str]:
+        """Имя первого шага, после которого строк не осталось (для понятного ответа пользователю)."""
+        return next((s.name for s in self.steps if s.rows == 0), None)
+
+    def explain(self) -> str:
+        return " → ".join(f"{s.name} {s.rows}" for s in self.steps) + f" ({self.elapsed_ms:.1f} мс)"
+
+
+def _attr_parts(df: pd.DataFrame, q: ScreenQuery, attrs: Optional[attr_index.AttrIndex]) -> List[Tuple[str, np.ndarray]]:
+    """Позиции по каждому атрибутному условию: из индекса, без него — маской (одной на условие)."""
+    parts = []
+    specs = (
+        ("city", q.city, inventory_prep.equals_mask, "city"),
+        ("format", list(q.formats), inventory_prep.format_mask, "formats"),
+        ("owner", list(q.owners), inventory_prep.owner_mask, "owners"),
+    )
+    for col, arg, mask_fn, method in specs:
+        if not arg or col not in df.columns or isinstance(df[col], pd.DataFrame):
+            continue
+        if attrs is not None and attrs.has(col):
+            pos = getattr(attrs, method)(arg)
+        else:
+            pos = np.flatnonzero(mask_fn(df[col], arg).to_numpy(dtype=bool))
+        parts.append((col, pos))
+    return parts
+
+
+def _numeric_at(series: pd.Series, pos: Optional[np.ndarray]) -> np.ndarray:
+    """float-значения колонки в позициях pos (None — все строки); подготовленная колонка не разбирается."""
+    if pd.api.types.is_float_dtype(series.dtype):
+        vals = series.to_numpy(dtype="float64", na_value=np.nan)
+        return vals if pos is None else vals[pos]
+    part = series if pos is None else series.take(pos)
+    return inventory_prep.numeric(part).to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _thresholds(df: pd.DataFrame, q: ScreenQuery, pos: Optional[np.ndarray], dist: Optional[np.ndarray],
+                steps: List[Step]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    for col, name, lo in (("grp", "grp_min", q.grp_min), ("ots", "ots_min", q.ots_min)):
+        if lo is None or col not in df.columns or (pos is not None and len(pos) == 0):
+            continue
+        with np.errstate(invalid="ignore"):
+            keep = _numeric_at(df[col], pos) >= float(lo)   # NaN → False
+        if pos is None:
+            pos = np.flatnonzero(keep)
+        else:
+            pos = pos[keep]
+            dist = dist[keep] if dist is not None else None
+        steps.append(Step(name, len(pos)))
+    return pos, dist
+
+
+def _bbox(df: pd.DataFrame, bbox: Tuple[float, float, float, float], pos: Optional[np.ndarray],
+          geo: Optional[geo_index.GridIndex]) -> np.ndarray:
+    """Позиции (по возрастанию) внутри bbox, границы включительно; строки без координат не попадают."""
+    lat_r, lon_r = (geo.lat_r, geo.lon_r) if geo is not None else geo_index.coords_radians(df)
+    w, s, e, n = np.radians(np.asarray(bbox, dtype="float64"))
+    if pos is not None:
+        lat_r, lon_r = lat_r[pos], lon_r[pos]
+    keep = (lat_r >= s) & (lat_r <= n) & (lon_r >= w) & (lon_r <= e)   # NaN → False
+    return np.flatnonzero(keep) if pos is None else pos[keep]
+
+
+def _radius(df: pd.DataFrame, center: Tuple[float, float], radius_km: float, pos: Optional[np.ndarray],
+            geo: Optional[geo_index.GridIndex]) -> Tuple[np.ndarray, np.ndarray]:
+    """Позиции в радиусе (по возрастанию) и расстояния; считаем haversine по меньшему набору кандидатов."""
+    if pos is None:
+        if geo is not None:
+            return geo.query(center, radius_km)
+        return geo_index.radius_positions(df, center, radius_km)
+    lat_r, lon_r = (geo.lat_r, geo.lon_r) if geo is not None else geo_index.coords_radians(df)
+    clat, clon = np.radians(float(center[0])), np.radians(float(center[1]))
+    cand = geo.candidates(center, radius_km) if geo is not None else None
+    if cand is not None and len(cand) < len(pos):
+        d = geo_index.haversine_rad(clat, clon, lat_r[cand], lon_r[cand])
+        keep = d <= float(radius_km)
+        cand, d = cand[keep], d[keep]
+        keep = geo_index.in_sorted(cand, pos)
+        return cand[keep], d[keep]
+    d = geo_index.haversine_rad(clat, clon, lat_r[pos], lon_r[pos])
+    keep = d <= float(radius_km)
+    return pos[keep], d[keep]
+
+
+def run(
+    df: pd.DataFrame,
+    q: ScreenQuery,
+    *,
+    attrs: Optional[attr_index.AttrIndex] = None,
+    geo: Optional[geo_index.GridIndex] = None,
+) -> QueryResult:
+    """
+    Отбор строк df по q → QueryResult(frame, шаги, мс). attrs/geo — индексы, построенные именно по df
+    (иначе передавайте None — будут маски и полный гео-проход). Без условий frame — inventory_snapshot.view(df),
+    а не сам df: снимок общий для всех запросов.
+    """
+    t0 = time.perf_counter()
+    steps: List[Step] = []
+    if attrs is not None and attrs.size != len(df):
+        attrs = None
+    if geo is not None and geo.size != len(df):
+        geo = None
+
+    # 1) атрибуты: от самого селективного; пустое условие — сразу конец
+    pos: Optional[np.ndarray] = None
+    for name, part in sorted(_attr_parts(df, q, attrs), key=lambda p: len(p[1])):
+        pos = part if pos is None else attr_index.intersect([pos, part])
+        steps.append(Step(name, len(pos)))
+        if len(pos) == 0:
+            break
+
+    # 2) bbox
+    if q.bbox is not None and {"lat", "lon"}.issubset(df.columns) and (pos is None or len(pos)):
+        pos = _bbox(df, q.bbox, pos, geo)
+        steps.append(Step("bbox", len(pos)))
+
+    dist: Optional[np.ndarray] = None
+    has_center = q.center is not None and q.radius_km is not None
+    has_centers = bool(q.centers) and q.radius_km is not None
+
+    # 3) радиус (один центр) → 4) пороги по выжившим
+    if has_center and (pos is None or len(pos)):
+        pos, dist = _radius(df, q.center, float(q.radius_km), pos, geo)
+        steps.append(Step("radius", len(pos)))
+    pos, dist = _thresholds(df, q, pos, dist, steps)
+
+    # сборка таблицы — один раз
+    if has_centers:
+        if pos is not None and len(pos) == 0:
+            frame = pd.DataFrame(columns=geo_index.RADIUS_COLUMNS + ["center_idx"])
+        else:
+            frame = geo_index.radius_join_frame(df, q.centers, float(q.radius_km), index=geo,
+                                                nearest_only=q.nearest_only, within=pos)
+        steps.append(Step("radius", len(frame)))
+    elif has_center:
+        frame = geo_index.frame_from_positions(df, pos, dist)
+    else:
+        # медиана minBid — по всему отобранному пулу, до приоритезации форматов (как раньше)
+        median = _pool_median_min_bid(df, pos) if q.min_bid else None
+        prefer = q.prefer_formats and not q.formats and "format" in df.columns and (pos is None or len(pos))
+        if prefer:
+            pos = prefer_positions(df, pos, q.n)
+            steps.append(Step("prefer", len(pos)))
+        if pos is None:
+            # условий нет — copy-on-write вид (или копия), чтобы fill_min_bid и хэндлеры не писали в снимок
+            frame = inventory_snapshot.view(df)
+        else:
+            frame = df.take(pos)
+            if prefer:
+                frame.index = pd.RangeIndex(len(frame))
+        if q.min_bid:
+            fill_min_bid(frame, inplace=True, median=median)
+        return QueryResult(frame, steps, (time.perf_counter() - t0) * 1000)
+
+    if q.min_bid:
+        frame = fill_min_bid(frame, inplace=True)
+    return QueryResult(frame, steps, (time.perf_counter() - t0) * 1000)
+
+
+def _ots(pool: pd.DataFrame) -> Optional[pd.Series]:
+    """OTS пула числами (индекс 0..len-1); None — колонки нет или она пустая (тогда top_ots выбирает как spread)."""
+    if "ots" not in pool.columns:
+        return None
+    ots = pd.to_numeric(pool["ots"], errors="coerce").reset_index(drop=True)
+    return None if ots.dropna().empty else ots
+
+
+def _top_ots(pool: pd.DataFrame, q: ScreenQuery) -> Optional[pd.DataFrame]:
+    """n лучших по OTS; None — OTS нет."""
+    ots = _ots(pool)
+    if ots is None:
+        return None
+    # сортируем одну колонку, строки пула берём только для первых n
+    return pool.take(ots.sort_values(ascending=False).index[:q.n]).reset_index(drop=True)
+
+
+def spread_job(pool: pd.DataFrame, q: ScreenQuery) -> Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Если q выбирает k-center'ом (spread; top_ots без OTS) — (lat_r, lon_r, order): радианы пула в порядке
+    перебора и перестановка shuffle (None — без неё). Это всё, что нужно spread_positions_rad в пуле процессов;
+    сам пул туда не пиклится. None — выбор другой стратегией (см. select).
+    """
+    if q.strategy not in {"spread", "top_ots"} or len(pool) == 0 or q.n <= 0:
+        return None
+    if q.strategy == "top_ots" and _ots(pool) is not None:
+        return None
+    lat_r, lon_r = geo_index.coords_radians(pool, cache=False)
+    # shuffle — перестановка позиций, а не перемешанная копия пула
+    order = np.random.permutation(len(pool)) if q.shuffle else None
+    if order is not None:
+        lat_r, lon_r = lat_r[order], lon_r[order]
+    return lat_r, lon_r, order
+
+
+def spread_result(pool: pd.DataFrame, order: Optional[np.ndarray], chosen: np.ndarray, mind: np.ndarray) -> pd.DataFrame:
+    """Таблица выбора по ответу spread_positions_rad на spread_job(pool, q)."""
+    return spread_frame(pool, chosen if order is None else order[chosen], mind)
+
+
+def select(pool: pd.DataFrame, q: ScreenQuery) -> pd.DataFrame:
+    """Финальный выбор из пула по q.strategy: all — весь пул, spread — k-center, mix — по долям форматов,
+    top_ots — n лучших по OTS (нет OTS — как spread). У выбранных n строк индекс 0..n-1 при любой стратегии,
+    кроме all (там метки пула)."""
+    if q.strategy == "top_ots":
+        top = _top_ots(pool, q)
+        if top is not None:
+            return top
+    if q.strategy == "mix":
+        return _select_with_mix(pool, q.n, q.mix, random_start=q.random_start, seed=q.seed)
+    if q.strategy in {"spread", "top_ots"}:
+        job = spread_job(pool, q)
+        if job is None:
+            return pool.iloc[0:0]
+        lat_r, lon_r, order = job
+        chosen, mind = spread_positions_rad(lat_r, lon_r, q.n, random_start=q.random_start, seed=q.seed)
+        return spread_result(pool, order, chosen, mind)
+    return inventory_snapshot.view(pool)
+
+
+def _min_bid_column(df: pd.DataFrame) -> Optional[str]:
+    return next((c for c in MIN_BID_COLUMNS if c in df.columns), None)
+
+
+def _pool_median_min_bid(df: pd.DataFrame, pos: Optional[np.ndarray]) -> Optional[float]:
+    src = _min_bid_column(df)
+    if src is None:
+        return None
+    col = df[src] if pos is None else df[src].take(pos)
+    vals = pd.to_numeric(col, errors="coerce")
+    return float(vals.median()) if not vals.dropna().empty else None
+
+
+def fill_min_bid(df: pd.DataFrame, *, inplace: bool = False, median: Optional[float] = None) -> pd.DataFrame:
+    """
+    min_bid_used (пропуски — медианой) и min_bid_source. median — готовая медиана пула (иначе по самому df).
+    inplace=True — дописать колонки в df (когда df — уже наша выборка, а не общий инвентарь).
+    """
+    out = df if inplace else df.copy()
+    src_col = _min_bid_column(out)
+    if src_col:
+        vals = pd.to_numeric(out[src_col], errors="coerce")
+        if median is None:
+            median = float(vals.median()) if not vals.dropna().empty else None
+        out["min_bid_used"] = vals.fillna(median if median else 0)
+        out["min_bid_source"] = src_col
+    else:
+        out["min_bid_used"] = None
+        out["min_bid_source"] = None
+    return out
+
+
+def prefer_positions(df: pd.DataFrame, pos: Optional[np.ndarray], n: int) -> np.ndarray:
+    """Если формат не задан пользователем: сначала BILLBOARD, потом SUPERSITE, потом CITY_FORMAT*, затем остальное.
+       Позиции df (из pos, None — все строки), не больше n*5 — чтобы было из чего равномерно выбирать."""
+    fmt = df["format"] if pos is None else df["format"].take(pos)
+    local = np.arange(len(fmt), dtype=np.int64)
+    taken = np.zeros(len(fmt), dtype=bool)
+    parts = []
+    for token in ("BILLBOARD", "SUPERSITE", "CITY_FORMAT"):
+        m = inventory_prep.format_mask(fmt, token).to_numpy(dtype=bool) & ~taken
+        parts.append(local[m])
+        taken |= m
+    parts.append(local[~taken])
+    order = np.concatenate(parts)[:max(n * 5, n)]   # небольшой запас
+    return order if pos is None else pos[order]
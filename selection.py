@@ -0,0 +1,186 @@
+# selection.py
+# Выбор экранов: равномерная выборка (k-center), mix по форматам, маски форматов.
+# Чистые функции над DataFrame без aiogram/BOT_TOKEN — их можно гонять в пуле процессов (см. executors).
+# Внутри работаем с позициями строк (numpy), DataFrame собираем один раз — из выбранных позиций.
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+import geo_index
+import inventory_prep
+
+
+def _extract_screen_ids(frame: pd.DataFrame) -> list[str]:
+    """Безопасно достаёт список screen_id даже при дублированных колонках."""
+    if "screen_id" not in frame.columns:
+        return []
+    ser = frame["screen_id"]
+    if isinstance(ser, pd.DataFrame):   # на случай дубликатов колонок
+        ser = ser.iloc[:, 0]
+    return [s for s in ser.astype(str).tolist() if s and s.lower() != "nan"]
+
+def _format_mask(series: pd.Series, token: str) -> pd.Series:
+    """CITY* → семейство CITY_FORMAT*, BB → BILLBOARD, иначе точное совпадение (по категориям, см. inventory_prep)."""
+    return inventory_prep.format_mask(series, token)
+
+def spread_positions_rad(lat_r: np.ndarray, lon_r: np.ndarray, n: int, *,
+                         random_start: bool = True, seed: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    k-center по готовым радианам: (позиции в массивах, мин. расстояние до соседа внутри выборки, км).
+    Только numpy на входе и выходе — в пул процессов уходят два float64-массива, а не DataFrame.
+    """
+    chosen = np.asarray(geo_index.farthest_point_positions(lat_r, lon_r, n, random_start=random_start, seed=seed),
+                        dtype=np.int64)
+    return chosen, geo_index.min_dist_to_others_km(lat_r[chosen], lon_r[chosen])
+
+def spread_positions(df: pd.DataFrame, n: int, *, positions: np.ndarray | None = None,
+                     random_start: bool = True, seed: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    k-center по строкам df или по подмножеству positions (в его порядке — он задаёт и тай-брейки).
+    Возвращает (позиции df, мин. расстояние до соседа внутри выборки, км).
+    """
+    lat_r, lon_r = geo_index.coords_radians(df)
+    if positions is not None:
+        lat_r, lon_r = lat_r[positions], lon_r[positions]
+    chosen, mind = spread_positions_rad(lat_r, lon_r, n, random_start=random_start, seed=seed)
+    return (chosen if positions is None else positions[chosen]), mind
+
+def spread_frame(df: pd.DataFrame, chosen: np.ndarray, mind: np.ndarray) -> pd.DataFrame:
+    """Строки df по позициям chosen (индекс 0..n-1) + min_dist_to_others_km."""
+    res = df.take(chosen).reset_index(drop=True)   # единственная материализация: n строк
+    res["min_dist_to_others_km"] = np.round(mind, 3)
+    return res
+
+def spread_select(df: pd.DataFrame, n: int, *, positions: np.ndarray | None = None,
+                  random_start: bool = True, seed: int | None = None) -> pd.DataFrame:
+    """
+    Жадный k-center (Gonzalez) c рандомным стартом и случайными тай-брейками (векторно, см. geo_index).
+    Индекс результата — 0..n-1, как у _select_with_mix: метки строк df наружу не уходят.
+    """
+    size = len(df) if positions is None else len(positions)
+    if size == 0 or n <= 0:
+        return df.iloc[0:0]
+
+    chosen, mind = spread_positions(df, n, positions=positions, random_start=random_start, seed=seed)
+    return spread_frame(df, chosen, mind)
+
+def parse_mix(val: str) -> list[tuple[str, str]]:
+    if not isinstance(val, str) or not val.strip():
+        return []
+    s = val.replace("|", ",").replace(";", ",")
+    items = []
+    for part in s.split(","):
+        part = part.strip()
+        if not part or ":" not in part:
+            continue
+        token, v = part.split(":", 1)
+        items.append((token.strip(), v.strip()))
+    return items
+
+def _allocate_counts(total_n: int, mix_items: list[tuple[str, str]]) -> list[tuple[str, int]]:
+    fixed: list[tuple[str, int]] = []
+    perc:  list[tuple[str, float]] = []
+    for token, v in mix_items:
+        if v.endswith("%"):
+            try: perc.append((token, float(v[:-1])))
+            except: pass
+        else:
+            try: fixed.append((token, int(v)))
+            except: pass
+    fixed_sum = sum(cnt for _, cnt in fixed)
+    remaining = max(0, total_n - fixed_sum)
+    out: list[tuple[str, int]] = fixed[:]
+    if remaining > 0 and perc:
+        p_total = sum(p for _, p in perc) or 1.0
+        raw = [(tok, remaining * p / p_total) for tok, p in perc]
+        base = [(tok, int(x)) for tok, x in raw]
+        used = sum(cnt for _, cnt in base)
+        rem  = remaining - used
+        fracs = sorted(((x - int(x), tok) for tok, x in raw), reverse=True)
+        extra: dict[str,int] = {}
+        for i in range(rem):
+            _, tok = fracs[i % len(fracs)]
+            extra[tok] = extra.get(tok, 0) + 1
+        for tok, cnt in base:
+            out.append((tok, cnt + extra.get(tok, 0)))
+    total = sum(cnt for _, cnt in out)
+    if total > total_n:
+        delta = total - total_n
+        trimmed = []
+        for tok, cnt in out:
+            take = max(0, cnt - delta)
+            delta -= (cnt - take)
+            trimmed.append((tok, take))
+            if delta <= 0:
+                trimmed.extend(out[len(trimmed):])
+                break
+        out = trimmed
+    return out
+
+def _select_with_mix(df_city: pd.DataFrame, n: int, mix_arg: str | None,
+                     *, random_start: bool = True, seed: int | None = None) -> pd.DataFrame:
+    if not mix_arg:
+        return spread_select(df_city, n, random_start=random_start, seed=seed)
+    items = parse_mix(mix_arg)
+    if not items:
+        return spread_select(df_city, n, random_start=random_start, seed=seed)
+
+    allowed_tokens = [tok for tok, _ in items]
+
+    # маски форматов — один раз на токен по всему df_city; дальше только позиции
+    has_format = "format" in df_city.columns
+    tok_masks: dict[str, np.ndarray] = {}
+    if has_format:
+        for tok in allowed_tokens:
+            if tok not in tok_masks:
+                tok_masks[tok] = _format_mask(df_city["format"], tok).to_numpy(dtype=bool)
+        allowed = np.logical_or.reduce([tok_masks[t] for t in allowed_tokens])
+        pool = np.flatnonzero(allowed)
+    else:
+        pool = np.arange(len(df_city), dtype=np.int64)
+
+    if len(pool) == 0:
+        return spread_select(df_city, n, random_start=random_start, seed=seed)
+
+    targets = _allocate_counts(n, items)
+    chosen_parts: list[np.ndarray] = []
+    mind_parts: list[np.ndarray] = []
+    used_ids: set[str] = set()
+    ids = df_city["screen_id"].astype(str) if "screen_id" in df_city.columns else None
+
+    for token, need in targets:
+        if need <= 0 or len(pool) == 0:
+            continue
+        subset = pool[tok_masks[token][pool]] if has_format else pool
+        if len(subset) == 0:
+            continue
+        pick_n = min(need, len(subset))
+        picked, mind = spread_positions(df_city, pick_n, positions=subset, random_start=random_start, seed=seed)
+        chosen_parts.append(picked)
+        mind_parts.append(mind)
+
+        if ids is not None:
+            used_ids.update(_extract_screen_ids(df_city.iloc[picked]))
+            pool = pool[~ids.iloc[pool].isin(used_ids).to_numpy(dtype=bool)]
+        else:
+            lat = df_city["lat"].astype(float)
+            lon = df_city["lon"].astype(float)
+            xs, ys = lat.iloc[picked].to_numpy(), lon.iloc[picked].to_numpy()
+            pool = pool[~(lat.round(7).iloc[pool].isin(xs).to_numpy(dtype=bool) &
+                          lon.round(7).iloc[pool].isin(ys).to_numpy(dtype=bool))]
+        if len(pool) == 0:
+            break
+
+    remain = n - sum(len(p) for p in chosen_parts)
+    if remain > 0 and len(pool):
+        picked, mind = spread_positions(df_city, min(remain, len(pool)), positions=pool,
+                                        random_start=random_start, seed=seed)
+        chosen_parts.append(picked)
+        mind_parts.append(mind)
+
+    chosen = np.concatenate(chosen_parts)[:n] if chosen_parts else np.empty(0, dtype=np.int64)
+    mind = np.concatenate(mind_parts)[:n] if mind_parts else np.empty(0, dtype="float64")
+    res = df_city.take(chosen).reset_index(drop=True)
+    res["min_dist_to_others_km"] = np.round(mind, 3)
+    return res
@@ -0,0 +1,43 @@
+# conftest.py
+# Тесты чистых модулей (geo_index, selection, attr_index, screen_query, adaptive_http, …) — без aiogram/сети.
+# Модули лежат в корне репозитория плоско, поэтому добавляем его в sys.path; кэши — во временный каталог.
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("SCREENS_CACHE_DIR", tempfile.mkdtemp(prefix="omnika_test_"))
+
+
+def synthetic_inventory(n: int, seed: int = 42) -> pd.DataFrame:
+    """n экранов в трёх городах; форматы/владельцы — как в выгрузке API, grp — строками."""
+    rng = np.random.default_rng(seed)
+    cities = np.array(["Москва", "Санкт-Петербург", "Казань"], dtype=object)
+    centers = np.array([[55.75, 37.62], [59.93, 30.33], [55.79, 49.12]])
+    ci = rng.integers(0, len(cities), n)
+    formats = np.array(["BILLBOARD", "SUPERSITE", "CITY_FORMAT", "CITY_FORMAT_RC", "MEDIA_FACADE"], dtype=object)
+    owners = np.array(["Russ Outdoor", "Gallery", "РИМ", "Перспектива"], dtype=object)
+    df = pd.DataFrame({
+        "screen_id": [f"S{i:06d}" for i in range(n)],
+        "name": [f"screen {i}" for i in range(n)],
+        "city": cities[ci],
+        "format": formats[rng.integers(0, len(formats), n)],
+        "owner": owners[rng.integers(0, len(owners), n)],
+        "lat": centers[ci, 0] + rng.normal(0, 0.1, n),
+        "lon": centers[ci, 1] + rng.normal(0, 0.15, n),
+        "grp": np.array(["1,5", "2", "0.5", "3", ""], dtype=object)[rng.integers(0, 5, n)],
+        "ots": rng.random(n) * 1000,
+    })
+    df.loc[[3, 17], "lat"] = np.nan   # строки без координат должны просто не попадать в гео-выборки
+    return df
+
+
+@pytest.fixture
+def inventory() -> pd.DataFrame:
+    return synthetic_inventory(3000)
@@ -0,0 +1,81 @@
+# AIMD-лимитер: +1 за «круг» быстрых ответов, ×decrease на перегрузку (не чаще cooldown), пауза по Retry-After.
+import asyncio
+import time
+
+import pytest
+
+from adaptive_http import AIMDLimiter, backoff_delay, retry_after_seconds
+
+
+def test_additive_increase_after_a_round_of_fast_responses():
+    lim = AIMDLimiter(initial=4, max_limit=6, latency_target_s=1.0)
+    for _ in range(3):
+        lim.on_success(0.1)
+    assert lim.limit == 4
+    lim.on_success(0.1)
+    assert lim.limit == 5
+    for _ in range(50):
+        lim.on_success(0.1)
+    assert lim.limit == 6 and lim.peak_limit == 6
+
+
+def test_slow_response_resets_the_round():
+    lim = AIMDLimiter(initial=2, latency_target_s=1.0)
+    lim.on_success(0.1)
+    lim.on_success(5.0)
+    lim.on_success(0.1)
+    assert lim.limit == 2
+    lim.on_success(0.1)
+    assert lim.limit == 3
+
+
+def test_multiplicative_decrease_once_per_cooldown():
+    lim = AIMDLimiter(initial=16, min_limit=2, decrease=0.5, cooldown_s=60.0)
+    lim.on_overload()
+    lim.on_overload()   # пачка ошибок от уже отправленных запросов — второй раз не режем
+    assert lim.limit == 8 and lim.low_limit == 8
+
+
+def test_decrease_stops_at_min_limit():
+    lim = AIMDLimiter(initial=4, min_limit=3, cooldown_s=0.0)
+    for _ in range(5):
+        lim.on_overload()
+    assert lim.limit == 3
+
+
+def test_acquire_respects_limit():
+    async def scenario():
+        lim = AIMDLimiter(initial=2)
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            await lim.acquire()
+            peak = max(peak, lim.in_flight)
+            await asyncio.sleep(0.01)
+            await lim.release()
+
+        await asyncio.gather(*(job() for _ in range(10)))
+        return peak, lim.in_flight
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+def test_retry_after_pauses_new_requests():
+    async def scenario():
+        lim = AIMDLimiter(initial=4)
+        lim.on_overload(retry_after_s=0.2)
+        t0 = time.monotonic()
+        await lim.acquire()
+        return time.monotonic() - t0
+
+    assert asyncio.run(scenario()) >= 0.15
+
+
+@pytest.mark.parametrize("value,expected", [("3", 3.0), ("-1", 0.0), (None, None), ("garbage", None)])
+def test_retry_after_seconds(value, expected):
+    assert retry_after_seconds(value) == expected
+
+
+def test_backoff_delay_is_capped():
+    assert all(0 <= backoff_delay(attempt, base_s=0.5, max_s=2.0) <= 2.0 for attempt in range(10))
@@ -0,0 +1,81 @@
+# Индекс атрибутов и движок запросов против масок inventory_prep и старого конвейера из bench_select.
+import numpy as np
+import pytest
+
+import attr_index
+import geo_index
+import inventory_prep
+import screen_query
+from bench_select import legacy_apply_filters
+from screen_query import ScreenQuery
+
+
+def _positions(mask) -> np.ndarray:
+    return np.flatnonzero(mask.to_numpy(dtype=bool))
+
+
+@pytest.fixture(params=["raw", "prepared"])
+def frame(request, inventory):
+    return inventory_prep.prepare(inventory.copy()) if request.param == "prepared" else inventory
+
+
+@pytest.mark.parametrize("city", ["Москва", " москва ", "Казань", "Тула"])
+def test_city_matches_mask(frame, city):
+    idx = attr_index.AttrIndex.from_frame(frame)
+    assert np.array_equal(idx.city(city), _positions(inventory_prep.equals_mask(frame["city"], city)))
+
+
+@pytest.mark.parametrize("tokens", [["BILLBOARD"], ["bb"], ["CITY"], ["CITY_FORMAT_RC", "SUPERSITE"], ["NOPE"]])
+def test_formats_match_mask(frame, tokens):
+    idx = attr_index.AttrIndex.from_frame(frame)
+    assert np.array_equal(idx.formats(tokens), _positions(inventory_prep.format_mask(frame["format"], tokens)))
+
+
+@pytest.mark.parametrize("needles", [["russ"], ["РИМ", "gallery"], ["нет такого"]])
+def test_owners_match_mask(frame, needles):
+    idx = attr_index.AttrIndex.from_frame(frame)
+    assert np.array_equal(idx.owners(needles), _positions(inventory_prep.owner_mask(frame["owner"], needles)))
+
+
+def test_intersect_matches_numpy():
+    rng = np.random.default_rng(0)
+    parts = [np.unique(rng.integers(0, 5000, size)) for size in (3000, 400, 1200)]
+    expected = np.intersect1d(np.intersect1d(parts[0], parts[1]), parts[2])
+    assert np.array_equal(attr_index.intersect(parts), expected)
+    assert len(attr_index.intersect(parts + [np.empty(0, dtype=np.int64)])) == 0
+
+
+def test_frozen_index_rejects_writes(inventory):
+    idx = attr_index.AttrIndex.from_frame(inventory).freeze()
+    with pytest.raises(ValueError):
+        idx.city("Москва")[:1] = 0
+
+
+@pytest.mark.parametrize("q", [
+    ScreenQuery(city="Москва", formats=("BILLBOARD",)),
+    ScreenQuery(formats=("CITY",), owners=("russ",)),
+    ScreenQuery(city="Москва", center=(55.75, 37.62), radius_km=5.0),
+    ScreenQuery(formats=("BB",), bbox=(37.5, 55.7, 37.8, 55.8)),
+    ScreenQuery(city="Казань", grp_min=1.0),
+    ScreenQuery(city="Самара"),
+])
+def test_query_with_indexes_matches_without(inventory, q):
+    df = inventory_prep.prepare(inventory.copy())
+    attrs = attr_index.AttrIndex.from_frame(df)
+    geo = geo_index.GridIndex.from_frame(df)
+    fast = screen_query.run(df, q, attrs=attrs, geo=geo).frame
+    slow = screen_query.run(df, q).frame
+    assert sorted(fast["screen_id"]) == sorted(slow["screen_id"])
+
+
+def test_query_matches_legacy_filters(inventory):
+    q = ScreenQuery(formats=("CITY",), owners=("russ", "РИМ"), grp_min=1.0)
+    old = legacy_apply_filters(inventory, formats=q.formats, owners=q.owners, grp_min=q.grp_min)
+    new = screen_query.run(inventory, q).frame
+    assert list(new["screen_id"]) == list(old["screen_id"])
+
+
+def test_query_without_conditions_does_not_expose_input(inventory):
+    res = screen_query.run(inventory, ScreenQuery(min_bid=True)).frame
+    res["extra"] = 1
+    assert "extra" not in inventory.columns and "min_bid_used" not in inventory.columns
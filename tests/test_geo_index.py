@@ -0,0 +1,80 @@
+# Векторный гео-движок против построчных версий из bench_geo (как было в bot.py до geo_index).
+import numpy as np
+import pandas as pd
+import pytest
+
+import geo_index
+import selection
+from bench_geo import legacy_find_within_radius, legacy_spread_select
+
+
+def _by_distance(frame: pd.DataFrame) -> list:
+    # у legacy порядок равных distance_km не определён (нестабильный sort_values)
+    if frame.empty:
+        return []
+    return list(frame.sort_values(["distance_km", "screen_id"], kind="stable")["screen_id"])
+
+
+@pytest.mark.parametrize("center,radius_km", [((55.75, 37.62), 3.0), ((59.93, 30.33), 10.0), ((0.0, 0.0), 5.0)])
+def test_within_radius_matches_legacy(inventory, center, radius_km):
+    old = legacy_find_within_radius(inventory, center, radius_km)
+    new = geo_index.within_radius(inventory, center, radius_km)
+    assert _by_distance(new) == _by_distance(old)
+    if not old.empty:
+        merged = old.merge(new, on="screen_id", suffixes=("_old", "_new"))
+        np.testing.assert_allclose(merged["distance_km_old"], merged["distance_km_new"], atol=1e-3)
+
+
+def test_grid_index_matches_full_scan(inventory):
+    idx = geo_index.GridIndex.from_frame(inventory)
+    for center, radius_km in (((55.75, 37.62), 2.0), ((55.79, 49.12), 15.0), ((59.9, 30.3), 0.5)):
+        full_pos, full_d = geo_index.radius_positions(inventory, center, radius_km)
+        pos, d = idx.query(center, radius_km)
+        order = np.argsort(pos)
+        assert np.array_equal(np.sort(full_pos), pos[order])
+        np.testing.assert_allclose(full_d[np.argsort(full_pos)], d[order])
+
+
+def test_radius_join_matches_per_center(inventory):
+    centers = [(55.75, 37.62), (55.76, 37.63), (59.93, 30.33)]
+    frame = geo_index.radius_join_frame(inventory, centers, 3.0, nearest_only=False)
+    for i, c in enumerate(centers):
+        part = frame[frame["center_idx"] == i].drop(columns="center_idx")
+        assert _by_distance(part) == _by_distance(geo_index.within_radius(inventory, c, 3.0))
+
+
+def test_radius_join_nearest_only_assigns_each_screen_once(inventory):
+    centers = [(55.75, 37.62), (55.76, 37.63)]
+    frame = geo_index.radius_join_frame(inventory, centers, 3.0, nearest_only=True)
+    assert frame["screen_id"].is_unique
+    rows = inventory[inventory["screen_id"].isin(frame["screen_id"])]
+    lat_r, lon_r = np.radians(rows["lat"].to_numpy()), np.radians(rows["lon"].to_numpy())
+    d = np.stack([geo_index.haversine_rad(np.radians(a), np.radians(b), lat_r, lon_r) for a, b in centers])
+    expected = dict(zip(rows["screen_id"], d.argmin(axis=0)))
+    assert all(expected[s] == c for s, c in zip(frame["screen_id"], frame["center_idx"]))
+
+
+@pytest.mark.parametrize("random_start", [True, False])
+def test_spread_select_matches_legacy(inventory, random_start):
+    pool = inventory.dropna(subset=["lat"]).iloc[:800].reset_index(drop=True)
+    old = legacy_spread_select(pool, 15, random_start=random_start, seed=7)
+    new = selection.spread_select(pool, 15, random_start=random_start, seed=7)
+    assert list(new["screen_id"]) == list(old["screen_id"])
+    np.testing.assert_allclose(new["min_dist_to_others_km"], old["min_dist_to_others_km"])
+    assert list(new.index) == list(range(15))
+
+
+def test_spread_positions_rad_matches_frame_path(inventory):
+    pool = inventory.iloc[:500]
+    lat_r, lon_r = geo_index.coords_radians(pool, cache=False)
+    chosen, mind = selection.spread_positions_rad(lat_r, lon_r, 10, seed=3)
+    via_frame = selection.spread_select(pool, 10, seed=3)
+    assert list(pool["screen_id"].to_numpy()[chosen]) == list(via_frame["screen_id"])
+    np.testing.assert_allclose(np.round(mind, 3), via_frame["min_dist_to_others_km"])
+
+
+def test_spread_select_skips_rows_without_coordinates(inventory):
+    pool = inventory.iloc[:200]   # строки 3 и 17 — без lat
+    for seed in range(20):
+        res = selection.spread_select(pool, 10, seed=seed, random_start=False)
+        assert len(res) == 10 and res["lat"].notna().all()
@@ -0,0 +1,49 @@
+# Дельта-синк: upsert/удаление по id при любом dtype id в кэше (int, float после CSV, string после Feather).
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("aiogram")
+os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)   # bot.py без токена не импортируется
+import bot  # noqa: E402
+
+
+CACHED_IDS = {
+    "int": [1, 2, 3, 4],
+    "float": [1.0, 2.0, 3.0, 4.0],
+    "object": ["1", "2", "3", "4"],
+    "string": pd.array(["1", "2", "3", "4"], dtype="string"),
+}
+
+
+@pytest.fixture(params=list(CACHED_IDS))
+def base(request) -> pd.DataFrame:
+    return pd.DataFrame({"id": CACHED_IDS[request.param], "name": ["a", "b", "c", "d"]})
+
+
+def test_deleted_ids_ignore_dtype(base):
+    # выгрузка API: id — int, строки 3 нет
+    assert bot._deleted_ids(base, [1, 2, 4, 5, None]) == {"3"}
+
+
+def test_nothing_deleted_when_all_ids_seen(base):
+    assert bot._deleted_ids(base, [4, 3, 2, 1]) == set()
+
+
+def test_merge_delta_upserts_and_deletes(base):
+    changed = pd.DataFrame({"id": [2, 5], "name": ["B", "e"]})
+    out = bot._merge_delta(base, changed, bot._deleted_ids(base, [1, 2, 4, 5]))
+    assert list(out["name"]) == ["a", "d", "B", "e"]
+
+
+def test_merge_delta_replaces_unkeyed_rows():
+    base = pd.DataFrame({"id": [1, None], "name": ["a", "old"]})
+    changed = pd.DataFrame({"id": [None], "name": ["new"]})
+    assert list(bot._merge_delta(base, changed, set(), replace_unkeyed=True)["name"]) == ["a", "new"]
+    assert list(bot._merge_delta(base, changed, set())["name"]) == ["a", "old", "new"]
+
+
+def test_merge_delta_without_changes_keeps_base(base):
+    out = bot._merge_delta(base, pd.DataFrame({"id": [], "name": []}), set())
+    assert list(out["name"]) == list(base["name"])